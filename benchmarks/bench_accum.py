@@ -0,0 +1,112 @@
+"""
+Peak memory vs step time of activation checkpointing and gradient accumulation.
+
+Every setting trains the track model in a fresh process for --steps optimizer
+steps (after one warm-up step) with the same effective batch: micro-batches of
+``micro`` images, ``--effective_batch / micro`` of them per step. Settings are
+the product of --checkpoint_grid (comma-separated granularities of
+--checkpoint_modules, 'none' = no checkpointing) and --micro_batches.
+
+Peak memory is torch.cuda.max_memory_allocated on CUDA and the peak RSS of
+the process on CPU (which includes the model, the detector and the dataset).
+Other submodules are given as re:<regex>; a pattern that matches no module
+of the model fails that setting with a ValueError.
+
+    python -m benchmarks.bench_accum --resume exps/checkpoint.pth --device cuda --effective_batch 4 \
+        --micro_batches 1 2 4 --checkpoint_grid none enc_layer,dec_layer
+"""
+import argparse
+import itertools
+import multiprocessing as mp
+import time
+
+import torch
+
+from benchmarks.common import peak_rss_mb, print_table, run_in_process, write_json
+from main_track import get_args_parser
+
+
+def _train(args, modules, micro):
+    from torch.utils.data import BatchSampler, DataLoader
+
+    import util.misc as utils
+    from datasets import build_dataset
+    from engine_track_accum import GradientAccumulator, train_one_epoch_accum
+    from models import build_tracktrain_model
+    from models.detector_registry import DetectorRegistry, detector_for_phase
+    from util.activation_checkpoint import apply_activation_checkpointing
+
+    torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+    accum_steps = args.effective_batch // micro
+    args.batch_size = micro
+
+    model, criterion, _ = build_tracktrain_model(args)
+    if args.resume:
+        model.load_state_dict(torch.load(args.resume, map_location='cpu')['model'], strict=False)
+    model.to(device)
+    if modules:
+        apply_activation_checkpointing(model, modules)
+    detector = DetectorRegistry(device).get(detector_for_phase(args))
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=args.lr,
+                                  weight_decay=args.weight_decay)
+    scaler = torch.cuda.amp.GradScaler(enabled=args.fp16)
+    accumulator = GradientAccumulator(model, optimizer, scaler, accum_steps, args.clip_max_norm)
+
+    dataset = build_dataset(image_set=args.track_train_split, args=args)
+    group = micro * accum_steps
+
+    def loader(first, steps):
+        indices = list(range(first * group, (first + steps) * group))
+        return DataLoader(dataset, batch_sampler=BatchSampler(indices, micro, drop_last=True),
+                          collate_fn=utils.collate_fn, num_workers=args.num_workers)
+
+    train_one_epoch_accum(accumulator, model, detector, criterion, loader(0, 1), device, 0, criterion.weight_dict,
+                          fp16=args.fp16)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    train_one_epoch_accum(accumulator, model, detector, criterion, loader(1, args.steps), device, 0,
+                          criterion.weight_dict, fp16=args.fp16)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    elapsed = time.perf_counter() - start
+    peak = torch.cuda.max_memory_allocated(device) / 2 ** 20 if device.type == 'cuda' else peak_rss_mb()
+    return {
+        'checkpoint': ','.join(modules) or 'none',
+        'micro_batch': micro,
+        'accum_steps': accum_steps,
+        'effective_batch': group,
+        'peak_mb': peak,
+        'step_s': elapsed / args.steps,
+        'images_per_s': args.steps * group / elapsed,
+    }
+
+
+def main(args):
+    ctx = mp.get_context('spawn')
+    rows = []
+    for grid, micro in itertools.product(args.checkpoint_grid, args.micro_batches):
+        assert args.effective_batch % micro == 0, '--micro_batches must divide --effective_batch'
+        modules = [] if grid == 'none' else grid.split(',')
+        rows.append(run_in_process(ctx, _train, args, modules, micro))
+
+    base = rows[0]
+    for row in rows:
+        row['memory_ratio'] = row['peak_mb'] / base['peak_mb']
+        row['time_ratio'] = row['step_s'] / base['step_s']
+    print_table(rows, ['checkpoint', 'micro_batch', 'accum_steps', 'effective_batch', 'peak_mb', 'memory_ratio',
+                       'step_s', 'time_ratio', 'images_per_s'])
+    if args.output:
+        write_json(args.output, rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Activation checkpointing / accumulation benchmark', parents=[get_args_parser()])
+    parser.add_argument('--checkpoint_grid', default=['none', 'enc_layer', 'enc_layer,dec_layer'], nargs='+')
+    parser.add_argument('--micro_batches', default=[1, 2], type=int, nargs='+')
+    parser.add_argument('--effective_batch', default=2, type=int)
+    parser.add_argument('--steps', default=5, type=int, help='timed optimizer steps per setting')
+    parser.add_argument('--threads', default=torch.get_num_threads(), type=int)
+    parser.add_argument('--output', default='', help='write the results as JSON')
+    main(parser.parse_args())
@@ -0,0 +1,130 @@
+"""
+bfloat16 autocast (--bf16) vs fp32 on the tracking test split, on --device.
+
+Tracks the whole --track_eval_split twice, fp32 first, with freshly built
+models. Reports frames/s and HOTA / MOTA / IDF1 / ID switches of both, and
+the per-frame parity of the bf16 run against fp32: detections (postprocessed,
+above --track_thresh) and active tracks are matched by IoU as in
+export_track.py.
+
+    python -m benchmarks.bench_bf16 --resume exps/checkpoint.pth --device cpu --output bf16.json
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+import util.misc as utils
+from benchmarks.common import print_table, write_json
+from datasets import build_dataset
+from datasets.frame_index import load_frame_index, split_ann_file
+from engine_track_online import evaluate_lockstep
+from export_track import compare_frame
+from main_track import get_args_parser
+from models import build_tracktest_model
+from models.detector_registry import DetectorRegistry, detector_for_phase
+from models.query_pruning import build_pruner
+from models.sparse_tracker import build_tracker
+from util.mot_metrics import collect_sequences, evaluate_mot
+from util.precision import enable_bf16, keep_fp32_tracker
+
+
+class RecordingPostProcess(object):
+    """Postprocessor that keeps a CPU copy of every frame's detections, in loader order."""
+
+    def __init__(self, postprocess):
+        self.postprocess = postprocess
+        self.frames = []
+
+    def __call__(self, outputs, target_sizes):
+        results = self.postprocess(outputs, target_sizes)
+        self.frames += [{'scores': r['scores'].float().cpu(), 'boxes': r['boxes'].float().cpu()} for r in results]
+        return results
+
+
+def track_boxes(res_track):
+    tracks = [t for t in res_track if t['active'] > 0]
+    return {'scores': torch.as_tensor([float(t['score']) for t in tracks]).reshape(-1),
+            'boxes': torch.as_tensor(np.asarray([t['bbox'] for t in tracks], dtype=np.float32)).reshape(-1, 4)}
+
+
+def run(args, bf16, data_loader):
+    device = torch.device(args.device)
+    model, _, postprocessors = build_tracktest_model(args)
+    checkpoint = torch.load(args.resume, map_location='cpu')
+    model.load_state_dict(checkpoint['model'], strict=False)
+    model.to(device)
+    det_model = build_pruner(args, DetectorRegistry(device).get(detector_for_phase(args)))
+    tracker = build_tracker(args)
+    if bf16:
+        enable_bf16(model, det_model, device_type=device.type)
+        keep_fp32_tracker(tracker, device.type)
+
+    recorder = RecordingPostProcess(postprocessors['bbox'])
+    postprocessors = dict(postprocessors, bbox=recorder)
+    start = time.perf_counter()
+    res_tracks = evaluate_lockstep(model, det_model, postprocessors, data_loader, device, [tracker])
+    return res_tracks, recorder.frames, time.perf_counter() - start
+
+
+def parity(ref_frames, frames, thresh):
+    num_ref, num_matched, ious, score_diffs = 0, 0, [], []
+    for ref, out in zip(ref_frames, frames):
+        n, m, i, s = compare_frame(ref, out, thresh)
+        num_ref += n
+        num_matched += m
+        ious += i
+        score_diffs += s
+    return {
+        'boxes': num_ref,
+        'agreement': num_matched / num_ref if num_ref else 1.0,
+        'mean_iou': float(np.mean(ious)) if ious else 1.0,
+        'max_score_diff': float(np.max(score_diffs)) if score_diffs else 0.0,
+    }
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    dataset_val = build_dataset(image_set=args.track_eval_split, args=args)
+    video_to_images, video_names = load_frame_index(
+        dataset_val, split_ann_file(args.coco_path, args.track_eval_split)).group_by_video()
+    data_loader = DataLoader(dataset_val, 1, sampler=torch.utils.data.SequentialSampler(dataset_val),
+                             collate_fn=utils.collate_fn, num_workers=args.num_workers)
+    image_ids = [dataset_val.ids[i] for i in range(len(dataset_val))]
+
+    rows, runs = [], {}
+    for mode in ('fp32', 'bf16'):
+        res_tracks, det_frames, elapsed = run(args, mode == 'bf16', data_loader)
+        runs[mode] = (res_tracks, det_frames)
+        overall = evaluate_mot(collect_sequences(res_tracks, dataset_val.coco, video_to_images, video_names))['overall']
+        rows.append({'mode': mode, 'fps': len(dataset_val) / elapsed, 'total_s': elapsed,
+                     'hota': overall['HOTA'], 'mota': overall['MOTA'], 'idf1': overall['IDF1'],
+                     'id_switches': overall['IDSW']})
+
+    base = rows[0]
+    for row in rows:
+        row['speedup'] = row['fps'] / base['fps']
+        row['d_hota'] = row['hota'] - base['hota']
+        row['d_mota'] = row['mota'] - base['mota']
+        row['d_idf1'] = row['idf1'] - base['idf1']
+    print_table(rows, ['mode', 'fps', 'speedup', 'hota', 'd_hota', 'mota', 'd_mota', 'idf1', 'd_idf1', 'id_switches'])
+
+    (ref_tracks, ref_dets), (tracks, dets) = runs['fp32'], runs['bf16']
+    detections = parity(ref_dets, dets, args.track_thresh)
+    active = parity([track_boxes(ref_tracks.get(i, [])) for i in image_ids],
+                    [track_boxes(tracks.get(i, [])) for i in image_ids], 0.0)
+    report = [dict(kind='detections', **detections), dict(kind='tracks', **active)]
+    print_table(report, ['kind', 'boxes', 'agreement', 'mean_iou', 'max_score_diff'])
+    if args.output:
+        write_json(args.output, {'runs': rows, 'parity': report})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('bf16 autocast benchmark', parents=[get_args_parser()])
+    parser.add_argument('--threads', default=torch.get_num_threads(), type=int)
+    parser.add_argument('--output', default='', help='write the results as JSON')
+    args = parser.parse_args()
+    args.eval = True
+    main(args)
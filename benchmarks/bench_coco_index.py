@@ -0,0 +1,100 @@
+"""
+Cold vs warm startup with the annotation index cache.
+
+Every mode runs in a fresh process: it builds the COCO API object of the
+annotation file, the frame index of its images, and then looks up the
+annotations of every image once, as the dataset does during an epoch.
+
+    json         pycocotools COCO, parses the file
+    cache_cold   CachedCOCO with an empty cache directory (parse + write)
+    cache_warm   CachedCOCO reading the memory-mapped entry written by cache_cold
+
+    python -m benchmarks.bench_coco_index --ann_file data/visem/annotations/train.json
+    python -m benchmarks.bench_coco_index --videos 20 --frames 1500 --objects 60
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import tempfile
+import time
+
+from benchmarks.common import peak_rss_mb, print_table, write_json
+from benchmarks.suite import synthetic_annotations
+
+
+def _startup(mode, ann_file, cache_dir, queue):
+    from pycocotools.coco import COCO
+
+    from datasets.coco_index_cache import install_coco_index_cache
+    from datasets.frame_index import VideoFrameIndex
+
+    if mode != 'json':
+        install_coco_index_cache(cache_dir)
+    base_rss = peak_rss_mb()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco = COCO(ann_file)
+    load_s = time.perf_counter() - start
+    ids = sorted(coco.imgs.keys())
+    VideoFrameIndex.from_coco(coco, ids)
+    index_s = time.perf_counter() - start - load_s
+    start = time.perf_counter()
+    num_anns = 0
+    for img_id in ids:
+        num_anns += len(coco.loadAnns(coco.getAnnIds(imgIds=img_id)))
+    queue.put({
+        'mode': mode,
+        'load_s': load_s,
+        'frame_index_s': index_s,
+        'startup_s': load_s + index_s,
+        'epoch_lookups_s': time.perf_counter() - start,
+        'images': len(ids),
+        'annotations': num_anns,
+        'rss_added_mb': peak_rss_mb() - base_rss,
+    })
+
+
+def _run(ctx, mode, ann_file, cache_dir):
+    queue = ctx.Queue()
+    p = ctx.Process(target=_startup, args=(mode, ann_file, cache_dir, queue))
+    p.start()
+    row = queue.get()
+    p.join()
+    return row
+
+
+def main(args):
+    ctx = mp.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ann_file = args.ann_file
+        if not ann_file:
+            ann_file = os.path.join(tmpdir, 'annotations.json')
+            with open(ann_file, 'w') as f:
+                json.dump(synthetic_annotations(args.videos, args.frames, args.objects), f)
+        cache_dir = os.path.join(tmpdir, 'coco_index')
+
+        rows = [_run(ctx, 'json', ann_file, cache_dir), _run(ctx, 'cache_cold', ann_file, cache_dir)]
+        rows += [_run(ctx, 'cache_warm', ann_file, cache_dir) for _ in range(args.repeat)]
+
+    base = rows[0]['startup_s']
+    for row in rows:
+        row['speedup'] = base / row['startup_s'] if row['startup_s'] > 0 else 0.0
+    print('{}: {} images'.format(args.ann_file or 'synthetic', rows[0]['images']))
+    print_table(rows, ['mode', 'load_s', 'frame_index_s', 'startup_s', 'speedup', 'epoch_lookups_s',
+                       'annotations', 'rss_added_mb'])
+    if args.output:
+        write_json(args.output, rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Annotation index cache startup benchmark')
+    parser.add_argument('--ann_file', default='', help='annotation json; synthetic annotations if empty')
+    parser.add_argument('--videos', default=10, type=int)
+    parser.add_argument('--frames', default=1000, type=int)
+    parser.add_argument('--objects', default=60, type=int, help='sperm per frame')
+    parser.add_argument('--repeat', default=3, type=int, help='warm runs')
+    parser.add_argument('--output', default='', help='write the results as JSON')
+    main(parser.parse_args())
@@ -0,0 +1,92 @@
+"""
+CPU latency of exported track-test models vs the eager fp32 model.
+
+Each exported directory (see export_track.py) is loaded through track_runtime
+and run frame by frame over --frames. With --resume the eager model is timed
+on the same frames too. Latency covers preprocessing, the model and the
+detector, but not the Tracker.
+
+    python -m benchmarks.bench_export --artifacts exports/fp32 exports/int8 --frames data/VISEM/test/12/img1 \
+        --threads 1 4
+"""
+import argparse
+import itertools
+
+import torch
+
+from benchmarks.common import peak_rss_mb, print_table, summarize, time_calls, write_json
+from track_runtime import ExportedTrackModel, load_frames
+
+
+def cycle_calls(fn, frames, reset):
+    """A no-argument callable that runs ``fn`` on the next frame, restarting the video at the end."""
+    it = itertools.cycle(range(len(frames)))
+
+    def call():
+        i = next(it)
+        if i == 0:
+            reset()
+        fn(frames[i])
+    return call
+
+
+def eager_runner(args):
+    from export_track import MEAN, STD, input_size
+    from main_track import get_args_parser
+    from models import build_tracktest_model
+    from models.detector_registry import DetectorRegistry, detector_for_phase
+    from models.export import TrackExportWrapper
+    from track_runtime import preprocess_frame
+
+    model_args = get_args_parser().parse_args(['--eval', '--device', 'cpu', '--resume', args.resume])
+    model, _, postprocessors = build_tracktest_model(model_args)
+    model.load_state_dict(torch.load(args.resume, map_location='cpu')['model'], strict=False)
+    det_model = DetectorRegistry(torch.device('cpu')).get(detector_for_phase(model_args))
+    wrapper = TrackExportWrapper(model.eval(), det_model, postprocessors['bbox']).eval()
+    state = {'pre_embed': ()}
+
+    @torch.no_grad()
+    def run(frame):
+        h, w = frame.shape[:2]
+        image, orig_size = preprocess_frame(frame, input_size(h, w), MEAN, STD)
+        out = wrapper(image, orig_size, *state['pre_embed'])
+        state['pre_embed'] = out[4:] if state['pre_embed'] else out[3:]
+
+    def reset():
+        state['pre_embed'] = ()
+    return run, reset
+
+
+def main(args):
+    frames = load_frames(args.frames, args.num_frames)
+    runners = []
+    if args.resume:
+        runners.append(('eager fp32',) + eager_runner(args))
+    for path in args.artifacts:
+        runtime = ExportedTrackModel(path)
+        label = '{} ({})'.format(path, 'int8' if runtime.meta['quantized'] else 'fp32')
+        runners.append((label, runtime, runtime.reset))
+
+    rows = []
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for label, fn, reset in runners:
+            reset()
+            times = time_calls(cycle_calls(fn, frames, reset), args.repeat, warmup=args.warmup)
+            rows.append(dict(model=label, threads=threads, peak_rss_mb=peak_rss_mb(), **summarize(times)))
+    print_table(rows, ['model', 'threads', 'p50_ms', 'p99_ms', 'throughput', 'peak_rss_mb'])
+    if args.output:
+        write_json(args.output, rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Exported track model CPU latency')
+    parser.add_argument('--artifacts', default=[], nargs='+', help='directories written by export_track.py')
+    parser.add_argument('--frames', required=True, help='directory with the frames of one video')
+    parser.add_argument('--num_frames', default=50, type=int)
+    parser.add_argument('--resume', default='', help='also time the eager fp32 model of this checkpoint')
+    parser.add_argument('--threads', default=[torch.get_num_threads()], type=int, nargs='+')
+    parser.add_argument('--repeat', default=50, type=int)
+    parser.add_argument('--warmup', default=3, type=int)
+    parser.add_argument('--output', default='', help='write the results as JSON')
+    main(parser.parse_args())
@@ -0,0 +1,83 @@
+"""
+util/fast_ap.py vs pycocotools COCOeval on synthetic single-class sperm detections.
+
+Detections are jittered copies of the ground-truth boxes plus false positives,
+as many per frame as the detector keeps (up to 100). Reports the evaluation
+time of both and the largest difference of the 12 summary numbers.
+
+    python -m benchmarks.bench_fast_ap --videos 4 --frames 250 --objects 60
+"""
+import argparse
+import contextlib
+import copy
+import io
+import time
+
+import numpy as np
+from pycocotools.coco import COCO
+from pycocotools.cocoeval import COCOeval
+
+from benchmarks.common import print_table, write_json
+from benchmarks.suite import synthetic_annotations
+from util.fast_ap import STAT_NAMES, evaluate_bbox, gt_from_coco
+
+
+def synthetic_detections(coco, num_dets, seed=0):
+    rng = np.random.RandomState(seed)
+    results = []
+    for img_id in sorted(coco.getImgIds()):
+        gts = np.asarray([a['bbox'] for a in coco.imgToAnns[img_id]]).reshape(-1, 4)
+        src = gts[rng.randint(0, len(gts), num_dets)] if len(gts) else np.tile([[0, 0, 12, 6]], (num_dets, 1))
+        boxes = src + rng.randn(num_dets, 4) * rng.choice([0.5, 2.0, 8.0], (num_dets, 1))
+        boxes[:, 2:] = np.abs(boxes[:, 2:]) + 1
+        for box, score in zip(boxes.tolist(), rng.rand(num_dets).tolist()):
+            results.append({'image_id': img_id, 'category_id': 1, 'bbox': box, 'score': score})
+    return results
+
+
+def main(args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        gt = COCO()
+        gt.dataset = synthetic_annotations(args.videos, args.frames, args.objects)
+        gt.createIndex()
+        results = synthetic_detections(gt, args.dets)
+        dt_coco = gt.loadRes(copy.deepcopy(results))
+    img_ids = sorted(gt.getImgIds())
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco_eval = COCOeval(gt, dt_coco, 'bbox')
+        coco_eval.evaluate()
+        coco_eval.accumulate()
+        coco_eval.summarize()
+    cocoeval_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dt = {
+        'image_id': np.asarray([r['image_id'] for r in results], dtype=np.int64),
+        'category_id': np.asarray([r['category_id'] for r in results], dtype=np.int64),
+        'bbox': np.asarray([r['bbox'] for r in results], dtype=np.float64),
+        'score': np.asarray([r['score'] for r in results], dtype=np.float64),
+    }
+    stats = evaluate_bbox(gt_from_coco(gt, img_ids), dt, img_ids)['stats']
+    fast_s = time.perf_counter() - start
+
+    diff = np.abs(stats - coco_eval.stats)
+    rows = [{'stat': name, 'cocoeval': float(a), 'fast_ap': float(b), 'abs_diff': float(d)}
+            for name, a, b, d in zip(STAT_NAMES, coco_eval.stats, stats, diff)]
+    print_table(rows, ['stat', 'cocoeval', 'fast_ap', 'abs_diff'])
+    print('{} images, {} boxes, {} detections: COCOeval {:.2f} s, fast_ap {:.2f} s ({:.1f}x), max diff {:.2e}'.format(
+        len(img_ids), len(gt.anns), len(results), cocoeval_s, fast_s, cocoeval_s / fast_s, diff.max()))
+    if args.output:
+        write_json(args.output, {'cocoeval_s': cocoeval_s, 'fast_ap_s': fast_s, 'max_abs_diff': float(diff.max()),
+                                 'stats': rows})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Fast bbox AP benchmark')
+    parser.add_argument('--videos', default=4, type=int)
+    parser.add_argument('--frames', default=250, type=int)
+    parser.add_argument('--objects', default=60, type=int, help='sperm per frame')
+    parser.add_argument('--dets', default=100, type=int, help='detections per frame')
+    parser.add_argument('--output', default='', help='write the results as JSON')
+    main(parser.parse_args())
@@ -0,0 +1,122 @@
+"""
+Throughput of the frame-pair training pipeline on a synthetic VISEM-like video.
+
+Compares the current loader (random frame order, every sample decodes its
+current and previous frame) with the video-sequential order plus the decoded
+frame LRU, with and without the pinned-memory prefetcher.
+
+    python -m benchmarks.bench_frame_pipeline --videos 4 --frames 150 --num_workers 1
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset, RandomSampler
+
+from benchmarks.common import print_table, write_json
+from datasets.frame_cache import PinnedPrefetcher, attach_frame_cache, video_sequential_sampler
+
+
+def make_sequence(root, num_videos, num_frames, size=(640, 480), num_sperm=60, seed=0):
+    """Dark frames with bright moving ellipses, written as JPEG like the VISEM frames."""
+    rng = np.random.RandomState(seed)
+    w, h = size
+    yy, xx = np.mgrid[0:h, 0:w]
+    imgs = {}
+    img_id = 0
+    for video_id in range(1, num_videos + 1):
+        os.makedirs(os.path.join(root, str(video_id), 'img1'), exist_ok=True)
+        pos = rng.rand(num_sperm, 2) * [w, h]
+        vel = rng.randn(num_sperm, 2) * 3
+        for frame_id in range(1, num_frames + 1):
+            pos = (pos + vel) % [w, h]
+            frame = rng.normal(40, 8, size=(h, w))
+            for x, y in pos:
+                frame += 150 * np.exp(-((xx - x) ** 2 / 18.0 + (yy - y) ** 2 / 8.0))
+            file_name = '{}/img1/{:06d}.jpg'.format(video_id, frame_id)
+            Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8)).convert('RGB').save(
+                os.path.join(root, file_name), quality=90)
+            img_id += 1
+            imgs[img_id] = {'id': img_id, 'video_id': video_id, 'frame_id': frame_id, 'file_name': file_name}
+    return imgs
+
+
+class _Coco(object):
+    def __init__(self, imgs):
+        self.imgs = imgs
+
+
+class FramePairDataset(Dataset):
+    def __init__(self, root, imgs):
+        self.root = root
+        self.coco = _Coco(imgs)
+        self.ids = sorted(imgs)
+
+    def get_image(self, path):
+        return Image.open(os.path.join(self.root, path)).convert('RGB')
+
+    @staticmethod
+    def _to_tensor(img):
+        img = torch.from_numpy(np.asarray(img, dtype=np.float32) / 255.).permute(2, 0, 1)
+        return (img - 0.45) / 0.225
+
+    def __getitem__(self, idx):
+        img_info = self.coco.imgs[self.ids[idx]]
+        pre_id = self.ids[idx] - 1 if img_info['frame_id'] > 1 else self.ids[idx]
+        img = self._to_tensor(self.get_image(img_info['file_name']))
+        pre_img = self._to_tensor(self.get_image(self.coco.imgs[pre_id]['file_name']))
+        return torch.cat([img, pre_img], dim=0), {'image_id': torch.tensor(img_info['id'])}
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def run(name, dataset, sampler, args, prefetch=False):
+    loader = DataLoader(dataset, batch_size=args.batch_size, sampler=sampler, num_workers=args.num_workers,
+                        pin_memory=False, drop_last=True)
+    if prefetch:
+        loader = PinnedPrefetcher(loader, args.device)
+    start = time.perf_counter()
+    frames = 0
+    for samples, _ in loader:
+        frames += samples.shape[0]
+    elapsed = time.perf_counter() - start
+    return {'pipeline': name, 'frames': frames, 'seconds': elapsed, 'frames_per_s': frames / elapsed}
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as root:
+        imgs = make_sequence(root, args.videos, args.frames)
+        rows = [run('random, no cache', FramePairDataset(root, imgs), RandomSampler(range(len(imgs))), args)]
+
+        cached = FramePairDataset(root, imgs)
+        cache = attach_frame_cache(cached, args.cache_size)
+        rows.append(run('sequential + LRU', cached, video_sequential_sampler(cached, args.clip_len), args))
+        if args.num_workers == 0:
+            rows[-1]['hit_rate'] = cache.hit_rate
+
+        cached = FramePairDataset(root, imgs)
+        attach_frame_cache(cached, args.cache_size)
+        rows.append(run('sequential + LRU + prefetch', cached, video_sequential_sampler(cached, args.clip_len),
+                        args, prefetch=True))
+
+    print_table(rows, ['pipeline', 'frames', 'seconds', 'frames_per_s', 'hit_rate'])
+    if args.output:
+        write_json(args.output, rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('frame-pair pipeline benchmark')
+    parser.add_argument('--videos', default=4, type=int)
+    parser.add_argument('--frames', default=150, type=int)
+    parser.add_argument('--clip_len', default=8, type=int)
+    parser.add_argument('--cache_size', default=64, type=int)
+    parser.add_argument('--batch_size', default=1, type=int)
+    parser.add_argument('--num_workers', default=1, type=int)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--output', default='', help='write the results as JSON')
+    main(parser.parse_args())
@@ -0,0 +1,83 @@
+"""
+Accuracy / throughput of detector query pruning on the tracking test split.
+
+Tracks the whole --track_eval_split once per pruning setting (unpruned first)
+and reports frames/s, the share of detector queries passed to the track model
+and HOTA / MOTA / IDF1 / ID switches against the ground-truth track ids.
+
+    python -m benchmarks.bench_query_pruning --resume exps/checkpoint.pth --device cpu \
+        --prune_grid 0 300 100 50 --prune_scores none 0.05
+"""
+import argparse
+import itertools
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+import util.misc as utils
+from benchmarks.common import print_table, write_json
+from datasets import build_dataset
+from datasets.frame_index import load_frame_index, split_ann_file
+from engine_track_online import evaluate_lockstep
+from main_track import get_args_parser
+from models import build_tracktest_model
+from models.detector_registry import DetectorRegistry, detector_for_phase
+from models.query_pruning import QueryPruner
+from models.sparse_tracker import build_tracker
+from util.mot_metrics import collect_sequences, evaluate_mot
+
+
+def main(args):
+    device = torch.device(args.device)
+    torch.set_num_threads(args.threads)
+
+    model, _, postprocessors = build_tracktest_model(args)
+    checkpoint = torch.load(args.resume, map_location='cpu')
+    model.load_state_dict(checkpoint['model'], strict=False)
+    model.to(device)
+    detector = DetectorRegistry(device).get(detector_for_phase(args))
+
+    dataset_val = build_dataset(image_set=args.track_eval_split, args=args)
+    video_to_images, video_names = load_frame_index(
+        dataset_val, split_ann_file(args.coco_path, args.track_eval_split)).group_by_video()
+    data_loader = DataLoader(dataset_val, 1, sampler=torch.utils.data.SequentialSampler(dataset_val),
+                             collate_fn=utils.collate_fn, num_workers=args.num_workers)
+
+    rows = []
+    for topk, score in itertools.product(args.prune_grid, args.prune_scores):
+        score = None if score == 'none' else float(score)
+        pruner = QueryPruner(detector, topk=topk, score_thresh=score, min_keep=args.prune_min_keep)
+        trackers = [build_tracker(args)]
+        start = time.perf_counter()
+        res_tracks = evaluate_lockstep(model, pruner, postprocessors, data_loader, device, trackers, fp16=args.fp16)
+        elapsed = time.perf_counter() - start
+        row = {'topk': topk or 'all', 'score': score if score is not None else '-',
+               'kept': pruner.kept_fraction(), 'fps': len(dataset_val) / elapsed, 'total_s': elapsed}
+        overall = evaluate_mot(collect_sequences(res_tracks, dataset_val.coco, video_to_images, video_names))['overall']
+        row.update(hota=overall['HOTA'], mota=overall['MOTA'], idf1=overall['IDF1'], id_switches=overall['IDSW'])
+        rows.append(row)
+
+    base = rows[0]
+    for row in rows:
+        row['speedup'] = row['fps'] / base['fps']
+        row['d_hota'] = row['hota'] - base['hota']
+        row['d_mota'] = row['mota'] - base['mota']
+        row['d_idf1'] = row['idf1'] - base['idf1']
+    print_table(rows, ['topk', 'score', 'kept', 'fps', 'speedup', 'hota', 'd_hota', 'mota', 'd_mota', 'idf1', 'd_idf1',
+                       'id_switches'])
+    if args.output:
+        write_json(args.output, rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Query pruning benchmark', parents=[get_args_parser()])
+    parser.add_argument('--prune_grid', default=[0, 300, 100, 50], type=int, nargs='+',
+                        help='top-k values to try, 0 = no top-k; the first setting is the reference')
+    parser.add_argument('--prune_scores', default=['none'], nargs='+',
+                        help="score gates to try, 'none' = no gate")
+    parser.add_argument('--threads', default=torch.get_num_threads(), type=int)
+    parser.add_argument('--output', default='', help='write the results as JSON')
+    args = parser.parse_args()
+    args.eval = True
+    main(args)
@@ -0,0 +1,45 @@
+"""
+Startup cost of the frozen RT-DETR detectors.
+
+Loads each checkpoint through DetectorRegistry in a fresh process and reports
+wall time and peak RSS, so the cost of loading one detector vs both is visible.
+
+    python -m benchmarks.bench_startup --device cpu
+"""
+import argparse
+import multiprocessing as mp
+
+from benchmarks.common import peak_rss_mb, print_table, run_in_process, write_json
+from models.detector_registry import DetectorRegistry, EVAL_DETECTOR, TRAIN_DETECTOR
+
+
+def _load(checkpoints, device):
+    import torch
+
+    registry = DetectorRegistry(torch.device(device))
+    base_rss = peak_rss_mb()
+    for checkpoint in checkpoints:
+        registry.get(checkpoint)
+    return {
+        'checkpoints': '+'.join(checkpoints),
+        'load_s': sum(registry.load_times.values()),
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_added_mb': peak_rss_mb() - base_rss,
+    }
+
+
+def main(args):
+    ctx = mp.get_context('spawn')
+    rows = []
+    for checkpoints in ([TRAIN_DETECTOR], [EVAL_DETECTOR], [TRAIN_DETECTOR, EVAL_DETECTOR]):
+        rows.append(run_in_process(ctx, _load, checkpoints, args.device))
+    print_table(rows, ['checkpoints', 'load_s', 'peak_rss_mb', 'rss_added_mb'])
+    if args.output:
+        write_json(args.output, rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('RT-DETR startup benchmark')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--output', default='', help='write the results as JSON')
+    main(parser.parse_args())
@@ -0,0 +1,89 @@
+"""
+Shared helpers for the CPU benchmarks: timing, latency percentiles and reports.
+
+Run a benchmark from the repository root, e.g. ``python -m benchmarks.bench_startup``.
+"""
+import json
+import queue as queue_module
+import resource
+import sys
+import time
+import traceback
+
+import numpy as np
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def time_calls(fn, repeat, warmup=1):
+    """Run ``fn`` ``warmup + repeat`` times and return the ``repeat`` wall times in seconds."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times, items_per_call=1):
+    times = np.asarray(times, dtype=np.float64)
+    total = times.sum()
+    return {
+        'calls': int(times.size),
+        'mean_ms': float(times.mean() * 1e3) if times.size else 0.0,
+        'p50_ms': float(np.percentile(times, 50) * 1e3) if times.size else 0.0,
+        'p99_ms': float(np.percentile(times, 99) * 1e3) if times.size else 0.0,
+        'throughput': float(times.size * items_per_call / total) if total > 0 else 0.0,
+    }
+
+
+def print_table(rows, columns):
+    cells = [['{:.3f}'.format(r[c]) if isinstance(r.get(c), float) else str(r.get(c, '')) for c in columns]
+             for r in rows]
+    widths = [max([len(c)] + [len(row[i]) for row in cells]) for i, c in enumerate(columns)]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in cells:
+        print('  '.join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+def write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def _child(target, args, queue):
+    try:
+        queue.put(('ok', target(*args)))
+    except BaseException:
+        queue.put(('error', traceback.format_exc()))
+
+
+def run_in_process(ctx, target, *args, poll_s=1.0):
+    """``target(*args)`` in a fresh ``ctx`` process; returns its result, raises if it fails or dies."""
+    queue = ctx.Queue()
+    p = ctx.Process(target=_child, args=(target, args, queue))
+    p.start()
+    while True:
+        try:
+            status, value = queue.get(timeout=poll_s)
+            break
+        except queue_module.Empty:
+            if p.is_alive():
+                continue
+            try:
+                # the result may have been put right before the process exited
+                status, value = queue.get(timeout=poll_s)
+                break
+            except queue_module.Empty:
+                p.join()
+                raise RuntimeError('{} exited with code {} without a result'.format(target.__name__, p.exitcode))
+    p.join()
+    if status == 'error':
+        raise RuntimeError('{} failed in its process:\n{}'.format(target.__name__, value))
+    return value
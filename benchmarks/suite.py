@@ -0,0 +1,266 @@
+"""
+End-to-end CPU benchmark of the detection / tracking / evaluation stages.
+
+Every stage runs on synthetic microscope-like data and is timed on its own,
+so a slowdown can be traced to the stage that caused it:
+
+    data_loading        frame-pair decoding + transforms through a DataLoader
+    detector_forward    frozen RT-DETR forward (skipped without the checkpoint)
+    track_forward       track-test model forward
+    tracker_step        Tracker association on a dense field of detections
+    save_track          MOT text output of the tracked frames
+    coco_api_build      annotation parsing + COCO index build
+
+    python -m benchmarks.suite --save_baseline bench/baseline.json
+    python -m benchmarks.suite --compare bench/baseline.json --tolerance 0.2
+
+Only a stage that raises ``Skip`` (e.g. no detector checkpoint) is skipped.
+A stage that fails with any other error makes the run exit with status 1.
+With --compare the same holds for a stage whose p50 latency grew by more than
+the tolerance, or that has a baseline measurement but was not measured now.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+import torch
+
+from benchmarks.common import print_table, summarize, time_calls, write_json
+
+
+class Skip(Exception):
+    pass
+
+
+def synthetic_detections(num_frames, num_objects, size=(640, 480), seed=0):
+    """Per-frame Tracker inputs (x1y1x2y2 boxes) for objects drifting across the field."""
+    rng = np.random.RandomState(seed)
+    w, h = size
+    pos = rng.rand(num_objects, 2) * [w, h]
+    vel = rng.randn(num_objects, 2) * 2
+    frames = []
+    for _ in range(num_frames):
+        pos = (pos + vel) % [w, h]
+        boxes = np.concatenate([pos - [6, 3], pos + [6, 3]], axis=1)
+        scores = np.clip(rng.normal(0.8, 0.1, num_objects), 0, 1)
+        frames.append({
+            'scores': torch.as_tensor(scores, dtype=torch.float32),
+            'labels': torch.zeros(num_objects, dtype=torch.int64),
+            'boxes': torch.as_tensor(boxes, dtype=torch.float32),
+        })
+    return frames
+
+
+def synthetic_annotations(num_videos, num_frames, num_objects, seed=0):
+    rng = np.random.RandomState(seed)
+    images, annotations = [], []
+    for video_id in range(1, num_videos + 1):
+        for frame_id in range(1, num_frames + 1):
+            img_id = len(images) + 1
+            images.append({'id': img_id, 'video_id': video_id, 'frame_id': frame_id,
+                           'file_name': '{}/img1/{:06d}.jpg'.format(video_id, frame_id),
+                           'width': 640, 'height': 480})
+            xy = rng.rand(num_objects, 2) * [628, 474]
+            for track_id, (x, y) in enumerate(xy.tolist(), 1):
+                annotations.append({'id': len(annotations) + 1, 'image_id': img_id, 'category_id': 1,
+                                    'bbox': [x, y, 12.0, 6.0], 'area': 72.0, 'iscrowd': 0,
+                                    'track_id': track_id + video_id * 1000})
+    return {'images': images, 'annotations': annotations, 'categories': [{'id': 1, 'name': 'sperm'}]}
+
+
+def stage_data_loading(args, ctx):
+    from benchmarks.bench_frame_pipeline import FramePairDataset, make_sequence
+
+    root = ctx['tmpdir']
+    imgs = make_sequence(os.path.join(root, 'frames'), 1, args.frames)
+    dataset = FramePairDataset(os.path.join(root, 'frames'), imgs)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=1, num_workers=0)
+    it = iter(loader)
+
+    def fn():
+        nonlocal it
+        try:
+            next(it)
+        except StopIteration:
+            it = iter(loader)
+            next(it)
+    return fn, 1
+
+
+def stage_detector_forward(args, ctx):
+    from models.detector_registry import DetectorRegistry, EVAL_DETECTOR
+
+    if not os.path.exists(EVAL_DETECTOR):
+        raise Skip('{} not found'.format(EVAL_DETECTOR))
+    detector = DetectorRegistry(torch.device('cpu')).get(EVAL_DETECTOR)
+    images = torch.rand(1, 3, 640, 640)
+    ctx['detector'] = detector
+    return lambda: detector.predict(images, verbose=False), 1
+
+
+def stage_track_forward(args, ctx):
+    detector = ctx.get('detector')
+    if detector is None:
+        raise Skip('needs detector_forward output')
+
+    from engine_track_online import track_forward
+    from main_track import get_args_parser
+    from models import build_tracktest_model
+
+    model_args = get_args_parser().parse_args(['--eval', '--device', 'cpu'])
+    model, _, _ = build_tracktest_model(model_args)
+    model.eval()
+    samples = torch.rand(1, 3, 480, 640)
+    try:
+        from util.misc import nested_tensor_from_tensor_list
+        samples = nested_tensor_from_tensor_list([samples[0]])
+    except ImportError:
+        pass
+    state = {'pre_embed': None}
+
+    @torch.no_grad()
+    def fn():
+        _, state['pre_embed'] = track_forward(model, detector, samples, state['pre_embed'])
+    return fn, 1
+
+
+def stage_tracker_step(args, ctx):
+    from models import Tracker
+
+    frames = synthetic_detections(args.frames, args.objects)
+    tracker = Tracker(score_thresh=0.4)
+    state = {'t': 1}
+    res_tracks = {1: tracker.init_track(frames[0])}
+
+    def fn():
+        t = state['t']
+        if t == len(frames):
+            tracker.reset_all()
+            res_tracks[1] = tracker.init_track(frames[0])
+            t = 1
+        res_tracks[t + 1] = tracker.step(frames[t])
+        state['t'] = t + 1
+    ctx['res_tracks'] = res_tracks
+    return fn, 1
+
+
+def stage_save_track(args, ctx):
+    from models import save_track
+
+    res_tracks = ctx.get('res_tracks')
+    if not res_tracks:
+        raise Skip('needs tracker_step output')
+    video_to_images = {1: [{'image_id': i, 'frame_id': i} for i in sorted(res_tracks)]}
+    video_names = {1: 'synthetic'}
+    out_root = os.path.join(ctx['tmpdir'], 'tracks')
+    os.makedirs(out_root, exist_ok=True)
+    return lambda: save_track(res_tracks, out_root, video_to_images, video_names, 'bench'), len(res_tracks)
+
+
+def stage_coco_api_build(args, ctx):
+    from pycocotools.coco import COCO
+
+    ann_file = os.path.join(ctx['tmpdir'], 'annotations.json')
+    with open(ann_file, 'w') as f:
+        json.dump(synthetic_annotations(args.videos, args.frames, args.objects), f)
+
+    def fn():
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                COCO(ann_file)
+            finally:
+                sys.stdout = stdout
+    return fn, args.videos * args.frames
+
+
+STAGES = [
+    ('data_loading', stage_data_loading),
+    ('detector_forward', stage_detector_forward),
+    ('track_forward', stage_track_forward),
+    ('tracker_step', stage_tracker_step),
+    ('save_track', stage_save_track),
+    ('coco_api_build', stage_coco_api_build),
+]
+
+
+def compare(results, baseline, tolerance, selected=None):
+    regressions = []
+    for name, base in baseline.items():
+        if 'p50_ms' not in base or (selected is not None and name not in selected):
+            continue
+        res = results.get(name, {})
+        if 'p50_ms' not in res:
+            regressions.append('{} (not measured)'.format(name))
+            continue
+        ratio = res['p50_ms'] / base['p50_ms'] if base['p50_ms'] > 0 else 1.0
+        res['vs_baseline'] = ratio
+        if ratio > 1.0 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    selected = set(args.stages) if args.stages else None
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ctx = {'tmpdir': tmpdir}
+        for name, stage in STAGES:
+            if selected is not None and name not in selected:
+                continue
+            try:
+                start = time.perf_counter()
+                fn, items = stage(args, ctx)
+                setup_s = time.perf_counter() - start
+                times = time_calls(fn, args.repeat, warmup=args.warmup)
+            except Skip as e:
+                results[name] = {'skipped': str(e)}
+                continue
+            except Exception as e:
+                traceback.print_exc()
+                results[name] = {'error': '{}: {}'.format(type(e).__name__, e)}
+                continue
+            results[name] = dict(summarize(times, items), setup_s=setup_s)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['stages']
+        regressions = compare(results, baseline, args.tolerance, selected)
+
+    rows = [dict(stage=name, **res) for name, res in results.items()]
+    print_table(rows, ['stage', 'calls', 'p50_ms', 'p99_ms', 'throughput', 'setup_s', 'vs_baseline', 'skipped', 'error'])
+    report = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('save_baseline', 'compare')},
+        'torch': torch.__version__,
+        'stages': results,
+    }
+    if args.save_baseline:
+        write_json(args.save_baseline, report)
+    errors = [name for name, res in results.items() if 'error' in res]
+    if errors:
+        print('failed stages: {}'.format(', '.join(errors)))
+    if regressions:
+        print('regressions (p50 > {:.0%} over baseline): {}'.format(args.tolerance, ', '.join(regressions)))
+    return 1 if errors or regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('HDE-Track CPU benchmark suite')
+    parser.add_argument('--stages', nargs='+', default=None, choices=[name for name, _ in STAGES])
+    parser.add_argument('--videos', default=4, type=int)
+    parser.add_argument('--frames', default=60, type=int)
+    parser.add_argument('--objects', default=150, type=int, help='sperm per frame')
+    parser.add_argument('--repeat', default=30, type=int)
+    parser.add_argument('--warmup', default=2, type=int)
+    parser.add_argument('--threads', default=os.cpu_count() or 1, type=int)
+    parser.add_argument('--save_baseline', default='', help='write this run as a JSON baseline')
+    parser.add_argument('--compare', default='', help='baseline JSON to check for regressions')
+    parser.add_argument('--tolerance', default=0.2, type=float, help='allowed relative p50 slowdown')
+    sys.exit(main(parser.parse_args()))
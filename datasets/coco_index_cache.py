@@ -0,0 +1,488 @@
+"""
+Persistent, memory-mapped index of COCO annotation files.
+
+``COCO(ann_file)`` parses the whole JSON and builds its dict indexes on every
+launch and in every rank. After ``install_coco_index_cache(cache_dir)`` every
+``COCO(ann_file)``, i.e. the datasets made by ``build_dataset`` and the COCO
+API object returned by ``get_coco_api_from_dataset``, is a ``CachedCOCO``
+that reads a binary copy of the file instead:
+
+    <cache_dir>/<sha1 of the annotation file>/
+        meta.json               column layout + the JSON's non-table fields
+        images.<j>.npy ...      one array per column of the images / annotations / videos / categories tables
+        index.<name>.npy        id lookups and the image -> annotations CSR
+
+The arrays are opened with ``mmap_mode='r'`` so all ranks on a node share one
+copy through the page cache, and a row becomes a dict only when it is looked
+up. The first launch after the annotation file changed writes a new entry;
+the file is hashed only when its size or mtime changed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+from pycocotools.coco import COCO, _isArrayLike
+
+FORMAT_VERSION = 1
+TABLES = ('images', 'annotations', 'categories', 'videos')
+
+_cache_dir = None
+
+
+class UnsupportedAnnotations(ValueError):
+    pass
+
+
+def file_digest(path, cache_dir=None):
+    """sha1 of ``path``, remembered per (path, size, mtime) under ``<cache_dir>/stamps``."""
+    st = os.stat(path)
+    stamp = [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+    stamp_file = None
+    if cache_dir:
+        name = hashlib.sha1(stamp[0].encode('utf-8')).hexdigest()
+        stamp_file = os.path.join(cache_dir, 'stamps', name + '.json')
+        if os.path.exists(stamp_file):
+            with open(stamp_file, 'r') as f:
+                saved = json.load(f)
+            if saved['stamp'] == stamp:
+                return saved['sha1']
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    if stamp_file:
+        try:
+            os.makedirs(os.path.dirname(stamp_file), exist_ok=True)
+            tmp = '{}.{}.tmp'.format(stamp_file, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump({'stamp': stamp, 'sha1': digest}, f)
+            os.replace(tmp, stamp_file)
+        except OSError:
+            pass
+    return digest
+
+
+def _encode_texts(texts):
+    data = [t.encode('utf-8') for t in texts]
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum([len(d) for d in data], out=offsets[1:])
+    return np.frombuffer(b''.join(data), dtype=np.uint8), offsets
+
+
+_MISSING = object()
+
+
+def _column_kind(values):
+    if any(v is _MISSING for v in values):
+        return 'json'
+    types = set(map(type, values))
+    if types == {int}:
+        return 'int'
+    if types <= {int, float}:
+        return 'float'
+    if types == {str}:
+        return 'str'
+    if types == {list}:
+        n = len(values[0])
+        if all(len(v) == n for v in values) and all(type(x) in (int, float) for v in values for x in v):
+            return 'vec'
+    return 'json'
+
+
+class ColumnTable(object):
+    """A JSON list of dicts as one array per key; ``row(i)`` rebuilds the i-th dict.
+
+    Integer, float and fixed-length numeric list values (``bbox``) become
+    numeric arrays, strings a byte blob with offsets, anything else (e.g.
+    ``segmentation``) per-row JSON text.
+    """
+    def __init__(self, length, kinds, arrays):
+        self.length = length
+        self.kinds = kinds
+        self.arrays = arrays
+
+    def __len__(self):
+        return self.length
+
+    @classmethod
+    def encode(cls, rows):
+        keys = {}
+        for row in rows:
+            for key in row:
+                keys.setdefault(key, None)
+        kinds, arrays = {}, {}
+        for key in keys:
+            values = [row.get(key, _MISSING) for row in rows]
+            kind = kinds[key] = _column_kind(values)
+            if kind == 'int':
+                arrays[key] = np.asarray(values, dtype=np.int64)
+            elif kind in ('float', 'vec'):
+                arrays[key] = np.asarray(values, dtype=np.float64)
+            elif kind == 'str':
+                arrays[key] = _encode_texts(values)
+            else:
+                arrays[key] = _encode_texts(['' if v is _MISSING else json.dumps(v) for v in values])
+        return cls(len(rows), kinds, arrays)
+
+    def numeric(self, key):
+        """The array of an int / float column, None for other kinds."""
+        return self.arrays[key] if self.kinds.get(key) in ('int', 'float') else None
+
+    def text(self, key, i):
+        blob, offsets = self.arrays[key]
+        return blob[offsets[i]:offsets[i + 1]].tobytes().decode('utf-8')
+
+    def row(self, i):
+        return self.rows([i])[0]
+
+    def rows(self, idx):
+        """Dicts of the rows ``idx``, one array slice per column."""
+        idx = np.asarray(idx, dtype=np.int64)
+        out = [{} for _ in range(len(idx))]
+        for key, kind in self.kinds.items():
+            if kind in ('str', 'json'):
+                values = [self.text(key, i) for i in idx.tolist()]
+            else:
+                values = self.arrays[key][idx].tolist()
+            if kind == 'json':
+                for d, raw in zip(out, values):
+                    if raw:
+                        d[key] = json.loads(raw)
+            else:
+                for d, value in zip(out, values):
+                    d[key] = value
+        return out
+
+    def save(self, prefix):
+        layout = []
+        for j, (key, kind) in enumerate(self.kinds.items()):
+            layout.append([key, kind])
+            if kind in ('str', 'json'):
+                blob, offsets = self.arrays[key]
+                np.save('{}.{}.npy'.format(prefix, j), blob)
+                np.save('{}.{}.offsets.npy'.format(prefix, j), offsets)
+            else:
+                np.save('{}.{}.npy'.format(prefix, j), self.arrays[key])
+        return {'length': self.length, 'columns': layout}
+
+    @classmethod
+    def load(cls, prefix, layout, mmap=True):
+        kinds, arrays = {}, {}
+        for j, (key, kind) in enumerate(layout['columns']):
+            kinds[key] = kind
+            if kind in ('str', 'json'):
+                arrays[key] = (_load_array('{}.{}.npy'.format(prefix, j), mmap),
+                               _load_array('{}.{}.offsets.npy'.format(prefix, j), mmap))
+            else:
+                arrays[key] = _load_array('{}.{}.npy'.format(prefix, j), mmap)
+        return cls(layout['length'], kinds, arrays)
+
+
+def _load_array(path, mmap):
+    try:
+        return np.load(path, mmap_mode='r' if mmap else None)
+    except ValueError:
+        # empty arrays cannot be memory-mapped
+        return np.load(path)
+
+
+def _id_lookup(ids):
+    """Sorted ids and their rows; with duplicate ids the last row wins, as in a dict."""
+    order = np.argsort(ids, kind='stable')
+    return ids[order], order
+
+
+def build_index(dataset):
+    """Tables and index arrays of a parsed annotation JSON."""
+    tables = {name: ColumnTable.encode(dataset[name]) for name in TABLES if name in dataset}
+    index = {}
+    for name in ('images', 'annotations'):
+        if name in tables:
+            ids = tables[name].numeric('id') if len(tables[name]) else np.zeros(0, dtype=np.int64)
+            if ids is None or ids.dtype.kind != 'i':
+                raise UnsupportedAnnotations('{} need integer ids'.format(name))
+            index[name + '_ids'], index[name + '_rows'] = _id_lookup(ids)
+    if 'annotations' in tables:
+        image_ids = tables['annotations'].numeric('image_id') if len(tables['annotations']) \
+            else np.zeros(0, dtype=np.int64)
+        if image_ids is None or image_ids.dtype.kind != 'i':
+            raise UnsupportedAnnotations('annotations need integer image ids')
+        # annotations grouped by image id, file order within an image
+        by_image = np.argsort(image_ids, kind='stable')
+        uniq, starts = np.unique(image_ids[by_image], return_index=True)
+        index['ann_by_image'] = by_image
+        index['ann_image_ids'] = uniq
+        index['ann_image_bounds'] = np.append(starts, len(by_image)).astype(np.int64)
+    extra = {k: v for k, v in dataset.items() if k not in TABLES}
+    return tables, index, extra
+
+
+def write_index(path, tables, index, extra):
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    meta = {'version': FORMAT_VERSION, 'extra': extra, 'tables': {}, 'index': sorted(index)}
+    for name, table in tables.items():
+        meta['tables'][name] = table.save(os.path.join(tmp, name))
+    for name, arr in index.items():
+        np.save(os.path.join(tmp, 'index.{}.npy'.format(name)), arr)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # another rank finished the same entry first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def read_index(path, mmap=True):
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    if meta.get('version') != FORMAT_VERSION:
+        raise UnsupportedAnnotations('cache format {} != {}'.format(meta.get('version'), FORMAT_VERSION))
+    tables = {name: ColumnTable.load(os.path.join(path, name), layout, mmap)
+              for name, layout in meta['tables'].items()}
+    index = {name: _load_array(os.path.join(path, 'index.{}.npy'.format(name)), mmap) for name in meta['index']}
+    return tables, index, meta['extra']
+
+
+def load_or_build(annotation_file, cache_dir):
+    """Cache entry of ``annotation_file`` (written on a miss) as ``(path, tables, index, extra)``."""
+    path = os.path.join(cache_dir, file_digest(annotation_file, cache_dir))
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        try:
+            return (path,) + read_index(path)
+        except UnsupportedAnnotations:
+            shutil.rmtree(path, ignore_errors=True)
+    with open(annotation_file, 'r') as f:
+        dataset = json.load(f)
+    assert type(dataset) == dict, 'annotation file format {} not supported'.format(type(dataset))
+    tables, index, extra = build_index(dataset)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        write_index(path, tables, index, extra)
+        return (path,) + read_index(path)
+    except OSError:
+        # read-only cache directory: use the arrays built in memory
+        return (None, tables, index, extra)
+
+
+class _RowList(Sequence):
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.table.rows(np.arange(*i.indices(len(self))))
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.table.row(i)
+
+
+class _RowMapping(Mapping):
+    """``id -> dict`` view of a table, like ``COCO.imgs`` / ``COCO.anns``."""
+    def __init__(self, table, sorted_ids, rows):
+        self.table = table
+        self.sorted_ids = sorted_ids
+        self.rows = rows
+
+    def row_of(self, key):
+        i = int(np.searchsorted(self.sorted_ids, key, side='right')) - 1
+        if i < 0 or self.sorted_ids[i] != key:
+            raise KeyError(key)
+        return int(self.rows[i])
+
+    def rows_of(self, keys):
+        keys = np.asarray(keys, dtype=np.int64)
+        i = np.searchsorted(self.sorted_ids, keys, side='right') - 1
+        if len(keys) and (np.any(i < 0) or np.any(self.sorted_ids[np.maximum(i, 0)] != keys)):
+            missing = keys[(i < 0) | (self.sorted_ids[np.maximum(i, 0)] != keys)]
+            raise KeyError(missing[0].item())
+        return self.rows[i]
+
+    def __getitem__(self, key):
+        return self.table.row(self.row_of(key))
+
+    def __contains__(self, key):
+        try:
+            self.row_of(key)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.table.arrays['id'].tolist() if len(self.table) else [])
+
+    def __len__(self):
+        return len(self.table)
+
+
+class _ImgToAnns(Mapping):
+    """``image id -> annotation dicts``; like pycocotools' defaultdict, unknown ids give ``[]``."""
+    def __init__(self, coco):
+        self.coco = coco
+
+    def rows(self, image_id):
+        index = self.coco.index
+        uniq = index['ann_image_ids']
+        i = int(np.searchsorted(uniq, image_id))
+        if i == len(uniq) or uniq[i] != image_id:
+            return index['ann_by_image'][:0]
+        bounds = index['ann_image_bounds']
+        return index['ann_by_image'][bounds[i]:bounds[i + 1]]
+
+    def __getitem__(self, image_id):
+        return self.coco.tables['annotations'].rows(self.rows(image_id))
+
+    def __contains__(self, image_id):
+        try:
+            return len(self.rows(image_id)) > 0
+        except TypeError:
+            return False
+
+    def __iter__(self):
+        return iter(self.coco.index['ann_image_ids'].tolist())
+
+    def __len__(self):
+        return len(self.coco.index['ann_image_ids'])
+
+
+class _CatToImgs(Mapping):
+    """``category id -> image id of every annotation of it``, like ``COCO.catToImgs``."""
+    def __init__(self, coco):
+        self.coco = coco
+
+    def __getitem__(self, cat_id):
+        table = self.coco.tables['annotations']
+        rows = np.flatnonzero(table.arrays['category_id'] == cat_id)
+        return table.arrays['image_id'][rows].tolist()
+
+    def __iter__(self):
+        return iter(np.unique(self.coco.tables['annotations'].arrays['category_id']).tolist())
+
+    def __len__(self):
+        return len(np.unique(self.coco.tables['annotations'].arrays['category_id']))
+
+
+class CachedCOCO(COCO):
+    """pycocotools ``COCO`` whose indexes are views over a ``load_or_build`` cache entry."""
+    def __init__(self, annotation_file=None, cache_dir=None):
+        cache_dir = cache_dir or _cache_dir
+        if annotation_file is None or not cache_dir:
+            COCO.__init__(self, annotation_file)
+            return
+        print('loading annotation index...')
+        tic = time.time()
+        try:
+            entry = load_or_build(annotation_file, cache_dir)
+        except UnsupportedAnnotations as e:
+            print('annotation index not usable ({}), parsing the json'.format(e))
+            COCO.__init__(self, annotation_file)
+            return
+        self._attach(*entry)
+        print('Done (t={:0.2f}s)'.format(time.time() - tic))
+
+    def _attach(self, path, tables, index, extra):
+        self.cache_path = path
+        self.tables = tables
+        self.index = index
+        self.dataset = dict(extra)
+        for name, table in tables.items():
+            self.dataset[name] = table.rows(np.arange(len(table))) if name == 'categories' \
+                else _RowList(table)
+        self.imgs = _RowMapping(tables['images'], index['images_ids'], index['images_rows']) \
+            if 'images' in tables else {}
+        self.anns = _RowMapping(tables['annotations'], index['annotations_ids'], index['annotations_rows']) \
+            if 'annotations' in tables else {}
+        self.cats = {cat['id']: cat for cat in self.dataset.get('categories', [])}
+        has_anns = 'annotations' in tables
+        self.imgToAnns = _ImgToAnns(self) if has_anns else {}
+        has_cats = has_anns and 'categories' in tables and tables['annotations'].numeric('category_id') is not None
+        self.catToImgs = _CatToImgs(self) if has_cats else {}
+
+    def __reduce__(self):
+        # DataLoader workers started with spawn re-open the memory map instead of copying the arrays
+        if getattr(self, 'cache_path', None) is None:
+            return object.__reduce__(self)
+        return _open_cached_coco, (self.cache_path,)
+
+    def getAnnIds(self, imgIds=[], catIds=[], areaRng=[], iscrowd=None):
+        if not isinstance(self.imgToAnns, _ImgToAnns):
+            return COCO.getAnnIds(self, imgIds, catIds, areaRng, iscrowd)
+        table = self.tables['annotations']
+        if len(table) == 0:
+            return []
+        imgIds = imgIds if _isArrayLike(imgIds) else [imgIds]
+        catIds = catIds if _isArrayLike(catIds) else [catIds]
+        columns = {'category_id': len(catIds), 'area': len(areaRng), 'iscrowd': iscrowd is not None}
+        if any(used and table.numeric(key) is None for key, used in columns.items()):
+            return COCO.getAnnIds(self, imgIds, catIds, areaRng, iscrowd)
+
+        if len(imgIds):
+            rows = [self.imgToAnns.rows(img_id) for img_id in imgIds]
+            rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        else:
+            rows = np.arange(len(table))
+        if len(catIds):
+            rows = rows[np.isin(table.arrays['category_id'][rows], catIds)]
+        if len(areaRng):
+            area = table.arrays['area'][rows]
+            rows = rows[(area > areaRng[0]) & (area < areaRng[1])]
+        if iscrowd is not None:
+            rows = rows[table.arrays['iscrowd'][rows] == iscrowd]
+        return table.arrays['id'][rows].tolist()
+
+    def loadAnns(self, ids=[]):
+        if not isinstance(self.anns, _RowMapping):
+            return COCO.loadAnns(self, ids)
+        ids = ids if _isArrayLike(ids) else [ids]
+        return self.anns.table.rows(self.anns.rows_of(ids))
+
+    def loadImgs(self, ids=[]):
+        if not isinstance(self.imgs, _RowMapping):
+            return COCO.loadImgs(self, ids)
+        ids = ids if _isArrayLike(ids) else [ids]
+        return self.imgs.table.rows(self.imgs.rows_of(ids))
+
+    def image_columns(self, img_ids, keys):
+        """Numeric image columns of ``img_ids`` as arrays, without building the image dicts; None if one is not numeric."""
+        table = self.tables.get('images')
+        if table is None or any(table.numeric(key) is None for key in keys):
+            return None
+        rows = self.imgs.rows_of(img_ids)
+        return [np.asarray(table.numeric(key))[rows] for key in keys]
+
+
+def _open_cached_coco(path):
+    coco = object.__new__(CachedCOCO)
+    coco._attach(path, *read_index(path))
+    return coco
+
+
+def _new_coco(cls, annotation_file=None, *args, **kwargs):
+    if cls is COCO and annotation_file is not None and _cache_dir:
+        cls = CachedCOCO
+    return object.__new__(cls)
+
+
+def install_coco_index_cache(cache_dir):
+    """Make ``COCO(annotation_file)`` return a ``CachedCOCO`` backed by ``cache_dir``."""
+    global _cache_dir
+    _cache_dir = cache_dir
+    COCO.__new__ = staticmethod(_new_coco)
+
+
+def uninstall_coco_index_cache():
+    global _cache_dir
+    # COCO.__new__ stays installed (deleting it breaks later COCO(...) calls); without a directory it is a no-op
+    _cache_dir = None
@@ -0,0 +1,168 @@
+"""
+Decoded-frame cache and pinned-memory prefetching for track training.
+
+A training sample needs the current and the previous frame of a video, so
+with a video-sequential order every frame is decoded twice: once as
+"current" and once as "previous". ``attach_frame_cache`` puts a bounded LRU
+of decoded images in front of the dataset's ``get_image`` so the second read
+is a cache hit. Decoded images are cached before the (random) transforms,
+which keeps augmentation unchanged.
+
+The cache lives in the dataset, so every DataLoader worker has its own, and
+the DataLoader hands batch k to worker ``k % num_workers``. With more than
+one worker ``WorkerChunkBatchSampler`` reorders the batches so that each
+worker gets a contiguous run of them, otherwise neighbouring frames land in
+different workers and the cache never hits.
+
+``PinnedPrefetcher`` moves the next batches into pinned memory and onto the
+device on a background thread while the current step runs.
+"""
+import queue
+import threading
+from collections import OrderedDict
+
+import torch
+
+from datasets.sampler_video_train import DistributedVideoClipSampler
+
+
+class DecodedFrameCache(object):
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, load):
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                return frame
+        frame = load()
+        with self._lock:
+            self.misses += 1
+            self._frames[key] = frame
+            if len(self._frames) > self.capacity:
+                self._frames.popitem(last=False)
+        return frame
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def attach_frame_cache(dataset, capacity=64):
+    """Wrap ``dataset.get_image`` with an LRU of decoded frames; returns the cache.
+
+    Every DataLoader worker gets its own copy of the dataset and therefore its own cache;
+    wrap the batch sampler in ``WorkerChunkBatchSampler`` when ``num_workers > 1``.
+    """
+    cache = DecodedFrameCache(capacity)
+    get_image = dataset.get_image
+
+    def cached_get_image(path):
+        # PIL images are shared between samples, hand out copies so transforms cannot alter the cache
+        return cache.get_or_load(path, lambda: get_image(path)).copy()
+
+    dataset.get_image = cached_get_image
+    return cache
+
+
+def video_sequential_sampler(dataset, clip_len=8, seed=0):
+    """Single-process sampler that visits shuffled clips of consecutive frames."""
+    return DistributedVideoClipSampler(dataset, clip_len=clip_len, num_replicas=1, rank=0, seed=seed)
+
+
+class WorkerChunkBatchSampler(object):
+    """Reorders the batches of ``batch_sampler`` so each of ``num_workers`` workers reads a contiguous run.
+
+    The batches of an epoch are cut into ``num_workers`` consecutive chunks and
+    interleaved, so the DataLoader's round-robin gives chunk w to worker w in order.
+    """
+    def __init__(self, batch_sampler, num_workers):
+        self.batch_sampler = batch_sampler
+        self.num_workers = max(1, num_workers)
+
+    def __iter__(self):
+        batches = list(self.batch_sampler)
+        n, w = len(batches), self.num_workers
+        # worker i receives the batches at positions i, i + w, ...: len(range(i, n, w)) of them
+        starts = [0]
+        for i in range(w):
+            starts.append(starts[-1] + len(range(i, n, w)))
+        for p in range(n):
+            yield batches[starts[p % w] + p // w]
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+
+def _apply(obj, fn):
+    if torch.is_tensor(obj):
+        return fn(obj)
+    if hasattr(obj, 'tensors') and hasattr(obj, 'mask'):
+        # NestedTensor
+        mask = _apply(obj.mask, fn) if obj.mask is not None else None
+        return type(obj)(fn(obj.tensors), mask)
+    if isinstance(obj, dict):
+        return {k: _apply(v, fn) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_apply(v, fn) for v in obj)
+    return obj
+
+
+class PinnedPrefetcher(object):
+    """Iterates ``loader`` with up to ``depth`` batches pinned and copied to ``device`` ahead of time."""
+    def __init__(self, loader, device, depth=2):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.depth = depth
+        self.pin = self.device.type == 'cuda'
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _worker(self, batches, stop):
+        stream = torch.cuda.Stream(self.device) if self.pin else None
+        try:
+            for batch in self.loader:
+                if stop.is_set():
+                    break
+                if self.pin:
+                    batch = _apply(batch, lambda t: t.pin_memory())
+                    with torch.cuda.stream(stream):
+                        batch = _apply(batch, lambda t: t.to(self.device, non_blocking=True))
+                    stream.synchronize()
+                else:
+                    batch = _apply(batch, lambda t: t.to(self.device))
+                batches.put(batch)
+        except Exception as e:
+            batches.put(e)
+            return
+        batches.put(None)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._worker, args=(batches, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            # unblock the worker if it is waiting on a full queue
+            while thread.is_alive():
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    thread.join(timeout=0.1)
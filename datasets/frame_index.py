@@ -0,0 +1,126 @@
+"""
+Array-backed image/video/frame index of a video dataset.
+
+One row per dataset index with the image id, video id and frame id, plus an
+interned table of video names. It replaces per-image ``coco.loadImgs`` calls
+and ``file_name`` splitting when grouping tracking results by video, and is
+cached next to the annotation file.
+"""
+import os
+
+import numpy as np
+
+
+class VideoFrameIndex(object):
+    def __init__(self, image_ids, video_ids, frame_ids, table_video_ids, table_names):
+        self.image_ids = np.asarray(image_ids, dtype=np.int64)
+        self.video_ids = np.asarray(video_ids, dtype=np.int64)
+        self.frame_ids = np.asarray(frame_ids, dtype=np.int64)
+        # interned video names, sorted by video id
+        self.table_video_ids = np.asarray(table_video_ids, dtype=np.int64)
+        self.table_names = np.asarray(table_names, dtype=str)
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    @classmethod
+    def from_coco(cls, coco, ids):
+        # CachedCOCO (datasets/coco_index_cache.py) has the columns as arrays already
+        columns = coco.image_columns(ids, ('id', 'video_id', 'frame_id')) if hasattr(coco, 'image_columns') else None
+        if columns is not None:
+            image_ids, video_ids, frame_ids = columns
+            table_video_ids, first = np.unique(video_ids, return_index=True)
+            table_names = [coco.imgs[img_id]['file_name'].split('/')[0] for img_id in image_ids[first].tolist()]
+            return cls(image_ids, video_ids, frame_ids, table_video_ids, table_names)
+
+        imgs = [coco.imgs[img_id] for img_id in ids]
+        image_ids = np.fromiter((img['id'] for img in imgs), dtype=np.int64, count=len(imgs))
+        video_ids = np.fromiter((img['video_id'] for img in imgs), dtype=np.int64, count=len(imgs))
+        frame_ids = np.fromiter((img['frame_id'] for img in imgs), dtype=np.int64, count=len(imgs))
+        # only the first frame of every video is needed for its name
+        table_video_ids, first = np.unique(video_ids, return_index=True)
+        table_names = [imgs[i]['file_name'].split('/')[0] for i in first]
+        return cls(image_ids, video_ids, frame_ids, table_video_ids, table_names)
+
+    def video_names(self, video_ids):
+        pos = np.searchsorted(self.table_video_ids, video_ids)
+        return self.table_names[pos]
+
+    def group_by_video(self, indices=None):
+        """``video_to_images`` and ``video_names`` as expected by ``save_track``.
+
+        ``indices`` are dataset indices (e.g. the ones this rank evaluated); videos are
+        listed in order of first appearance and frames keep their order in ``indices``.
+        """
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices, dtype=np.int64)
+        video_ids = self.video_ids[indices]
+        image_ids = self.image_ids[indices]
+        frame_ids = self.frame_ids[indices]
+
+        order = np.argsort(video_ids, kind='stable')
+        uniq, starts = np.unique(video_ids[order], return_index=True)
+        first_seen = order[starts]
+        bounds = np.append(starts, len(order))
+        names = self.video_names(uniq)
+
+        video_to_images = {}
+        video_names = {}
+        for k in np.argsort(first_seen, kind='stable'):
+            rows = order[bounds[k]:bounds[k + 1]]
+            video_id = int(uniq[k])
+            video_to_images[video_id] = [{"image_id": i, "frame_id": f}
+                                         for i, f in zip(image_ids[rows].tolist(), frame_ids[rows].tolist())]
+            video_names[video_id] = str(names[k])
+        return video_to_images, video_names
+
+    def video_indices(self):
+        """``{video_id: dataset indices in frame order}`` for every video."""
+        order = np.lexsort((self.frame_ids, self.video_ids))
+        video_ids = self.video_ids[order]
+        bounds = np.flatnonzero(np.diff(video_ids)) + 1
+        return {int(self.video_ids[rows[0]]): rows for rows in np.split(order, bounds) if len(rows)}
+
+    def save(self, path, stamp=None):
+        stamp = np.asarray(stamp if stamp is not None else [], dtype=np.int64)
+        tmp_path = '{}.{}.tmp.npz'.format(path, os.getpid())
+        np.savez(tmp_path, image_ids=self.image_ids, video_ids=self.video_ids, frame_ids=self.frame_ids,
+                 table_video_ids=self.table_video_ids, table_names=self.table_names, stamp=stamp)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(data['image_ids'], data['video_ids'], data['frame_ids'],
+                        data['table_video_ids'], data['table_names'])
+            stamp = data['stamp']
+        return index, stamp
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def split_ann_file(data_root, split):
+    """``<data_root>/annotations/<split>.json``, as written by track_tools/convert_visem.py."""
+    return os.path.join(data_root, 'annotations', '{}.json'.format(split))
+
+
+def load_frame_index(dataset, ann_file=None):
+    """Frame index of ``dataset``, cached as ``<ann_file>.frame_index.npz`` when the path is known."""
+    ann_file = ann_file or getattr(dataset, 'ann_file', None)
+    cache_file = '{}.frame_index.npz'.format(ann_file) if ann_file else None
+    ids = np.asarray(dataset.ids, dtype=np.int64)
+
+    if cache_file and os.path.exists(cache_file):
+        index, stamp = VideoFrameIndex.load(cache_file)
+        if stamp.tolist() == _file_stamp(ann_file) and np.array_equal(index.image_ids, ids):
+            return index
+
+    index = VideoFrameIndex.from_coco(dataset.coco, dataset.ids)
+    if cache_file:
+        try:
+            index.save(cache_file, stamp=_file_stamp(ann_file))
+        except OSError:
+            pass
+    return index
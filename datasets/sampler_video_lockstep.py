@@ -0,0 +1,35 @@
+from collections import defaultdict
+
+
+class VideoLockstepBatchSampler(object):
+    """Batches frame t of up to ``num_videos`` different videos together.
+
+    Videos are sorted by length (longest first) and grouped into waves of
+    ``num_videos``. Inside a wave, batch t holds frame t of every video that is
+    still running, always in the same slot order, so the videos that have
+    finished are the ones at the end of the batch. The tracking loop can then
+    keep per-slot state in a list and just truncate it when the batch shrinks.
+    """
+    def __init__(self, dataset, num_videos, indices=None):
+        assert num_videos >= 1
+        coco = dataset.coco
+        if indices is None:
+            indices = range(len(dataset))
+
+        videos = defaultdict(list)
+        for idx in indices:
+            img_info = coco.imgs[dataset.ids[idx]]
+            videos[img_info['video_id']].append((img_info['frame_id'], idx))
+
+        frames = [[idx for _, idx in sorted(video)] for video in videos.values()]
+        frames.sort(key=len, reverse=True)
+        self.num_videos = num_videos
+        self.waves = [frames[i:i + num_videos] for i in range(0, len(frames), num_videos)]
+
+    def __iter__(self):
+        for wave in self.waves:
+            for t in range(len(wave[0])):
+                yield [video[t] for video in wave if t < len(video)]
+
+    def __len__(self):
+        return sum(len(wave[0]) for wave in self.waves)
@@ -0,0 +1,117 @@
+import heapq
+import math
+import os
+import random
+from collections import defaultdict
+
+import torch.distributed as dist
+
+
+class DistributedVideoClipSampler(object):
+    """Distributed training sampler that hands out contiguous clips of videos.
+
+    Every video is cut into clips of ``clip_len`` consecutive frames. Each
+    epoch the clips are shuffled and given to the least loaded rank (by frame
+    count), so a rank reads runs of neighbouring frames instead of frames
+    scattered over all videos. All ranks compute the same assignment and are
+    padded with their own frames to the same number of samples.
+
+    With ``fixed_videos`` whole videos are given to the ranks once, balanced by
+    frame count, and each epoch only shuffles the clips of this rank's videos, so
+    a rank reads the same images for the whole run (``owned_indices``). This is
+    what --cache_mode needs, see ``restrict_image_cache``.
+    """
+    def __init__(self, dataset, clip_len=8, num_replicas=None, rank=None, shuffle=True, seed=0, fixed_videos=False):
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.clip_len = clip_len
+        self.shuffle = shuffle
+        self.seed = seed
+        self.fixed_videos = fixed_videos
+        self.epoch = 0
+
+        coco = dataset.coco
+        videos = defaultdict(list)
+        for idx, img_id in enumerate(dataset.ids):
+            img_info = coco.imgs[img_id]
+            videos[img_info['video_id']].append((img_info['frame_id'], idx))
+        self.videos = [[idx for _, idx in sorted(videos[v])] for v in sorted(videos)]
+
+        if fixed_videos:
+            # largest videos first so the loads end up close
+            order = sorted(range(len(self.videos)), key=lambda v: -len(self.videos[v]))
+            owners = self._balance([len(self.videos[v]) for v in order])
+            self.owned = [self.videos[v] for v, owner in sorted(zip(order, owners)) if owner == rank]
+            loads = [0] * num_replicas
+            for v, owner in zip(order, owners):
+                loads[owner] += len(self.videos[v])
+            self.num_samples = max(loads)
+        else:
+            self.owned = None
+            total = sum(len(v) for v in self.videos)
+            # clip assignment changes every epoch but the largest load never exceeds this
+            self.num_samples = total if num_replicas == 1 else math.ceil(total / num_replicas) + clip_len
+
+    def _clips(self, videos):
+        return [v[i:i + self.clip_len] for v in videos for i in range(0, len(v), self.clip_len)]
+
+    def _balance(self, sizes):
+        """Owner rank per item, filling the least loaded rank first (in the given order)."""
+        heap = [(0, r) for r in range(self.num_replicas)]
+        owners = []
+        for size in sizes:
+            load, r = heapq.heappop(heap)
+            owners.append(r)
+            heapq.heappush(heap, (load + size, r))
+        return owners
+
+    def __iter__(self):
+        rng = random.Random(self.seed + self.epoch)
+        clips = self._clips(self.videos if self.owned is None else self.owned)
+        if self.shuffle:
+            rng.shuffle(clips)
+        if self.owned is None:
+            owners = self._balance([len(c) for c in clips])
+            clips = [c for c, owner in zip(clips, owners) if owner == self.rank]
+
+        indices = [idx for c in clips for idx in c]
+        if not indices:
+            return iter([])
+        # pad with this rank's own frames so every rank yields num_samples
+        while len(indices) < self.num_samples:
+            indices += indices[:self.num_samples - len(indices)]
+        return iter(indices[:self.num_samples])
+
+    def __len__(self):
+        return self.num_samples
+
+    def owned_indices(self):
+        """Sorted dataset indices this rank reads in every epoch (``fixed_videos`` only)."""
+        assert self.owned is not None, 'owned_indices needs fixed_videos=True'
+        return sorted(idx for v in self.owned for idx in v)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+
+def restrict_image_cache(dataset, indices):
+    """Make the --cache_mode image cache of ``dataset`` hold exactly the images at ``indices``.
+
+    The dataset caches the images with ``index % local_size == local_rank`` when it is
+    built; with ``DistributedVideoClipSampler(fixed_videos=True)`` this rank reads
+    ``sampler.owned_indices()`` instead, so the others are dropped and these are read.
+    The cache is keyed by ``file_name`` relative to ``dataset.root``.
+    """
+    cache = getattr(dataset, 'cache', None)
+    if cache is None:
+        return
+    paths = {dataset.coco.imgs[dataset.ids[i]]['file_name'] for i in indices}
+    for path in [p for p in cache if p not in paths]:
+        del cache[path]
+    for path in sorted(paths.difference(cache)):
+        with open(os.path.join(dataset.root, path), 'rb') as f:
+            cache[path] = f.read()
@@ -0,0 +1,99 @@
+"""
+Validation scheduling for detector training, and evaluate() with the NumPy AP.
+
+main.py asks ``eval_kind`` after every epoch whether to validate on the full
+val split, on a fixed stratified subset of it (``stratified_subset``) or not
+at all. Full validations always run before an LR drop and after the last
+epoch. ``evaluate_fast`` is engine.evaluate with util/fast_ap.py in place of
+CocoEvaluator / COCOeval.
+"""
+import numpy as np
+import torch
+
+import util.misc as utils
+from datasets.frame_index import load_frame_index
+from util.fast_ap import detections_from_results, evaluate_bbox, gt_from_coco, print_stats
+
+
+def eval_kind(epoch, args):
+    """'full', 'subset' or None for the validation after ``epoch``."""
+    if epoch == args.epochs - 1 or (epoch + 1) % args.lr_drop == 0:
+        return 'full'
+    if args.full_eval_every > 0 and (epoch + 1) % args.full_eval_every == 0:
+        return 'full'
+    if (epoch + 1) % args.eval_every != 0:
+        return None
+    return 'subset' if args.eval_subset > 0 else 'full'
+
+
+def stratified_subset(dataset, fraction):
+    """Sorted dataset indices of about ``fraction`` of the images, evenly spaced within every video.
+
+    The same indices every call, so subset validations are comparable across epochs.
+    """
+    try:
+        groups = list(load_frame_index(dataset).video_indices().values())
+    except KeyError:
+        # images without video_id (plain COCO): one group in dataset order
+        groups = [np.arange(len(dataset))]
+    picked = []
+    for rows in groups:
+        n = min(len(rows), max(1, int(round(fraction * len(rows)))))
+        picked.append(rows[np.linspace(0, len(rows) - 1, n).round().astype(np.int64)])
+    return np.unique(np.concatenate(picked))
+
+
+@torch.no_grad()
+def evaluate_fast(model, criterion, postprocessors, data_loader, base_ds, device, output_dir=None):
+    """engine.evaluate with the NumPy bbox AP; returns ``(stats, None)`` as there is no CocoEvaluator."""
+    model.eval()
+    criterion.eval()
+
+    metric_logger = utils.MetricLogger(delimiter="  ")
+    metric_logger.add_meter('class_error', utils.SmoothedValue(window_size=1, fmt='{value:.2f}'))
+    header = 'Test:'
+
+    dets = {}
+    for samples, targets in metric_logger.log_every(data_loader, 10, header):
+        samples = samples.to(device)
+        targets = [{k: v.to(device) for k, v in t.items()} for t in targets]
+
+        outputs = model(samples)
+        loss_dict = criterion(outputs, targets)
+        weight_dict = criterion.weight_dict
+
+        # reduce losses over all GPUs for logging purposes
+        loss_dict_reduced = utils.reduce_dict(loss_dict)
+        loss_dict_reduced_scaled = {k: v * weight_dict[k]
+                                    for k, v in loss_dict_reduced.items() if k in weight_dict}
+        loss_dict_reduced_unscaled = {f'{k}_unscaled': v
+                                      for k, v in loss_dict_reduced.items()}
+        metric_logger.update(loss=sum(loss_dict_reduced_scaled.values()),
+                             **loss_dict_reduced_scaled,
+                             **loss_dict_reduced_unscaled)
+        metric_logger.update(class_error=loss_dict_reduced['class_error'])
+
+        orig_target_sizes = torch.stack([t["orig_size"] for t in targets], dim=0)
+        results = postprocessors['bbox'](outputs, orig_target_sizes)
+        for target, output in zip(targets, results):
+            image_id = target['image_id'].item()
+            dets[image_id] = detections_from_results({image_id: output})
+
+    metric_logger.synchronize_between_processes()
+    print("Averaged stats:", metric_logger)
+
+    # all ranks evaluate the gathered detections and return the same stats; images repeated by the
+    # distributed sampler's padding count once, as in CocoEvaluator
+    merged = {}
+    for rank_dets in utils.all_gather(dets):
+        for image_id, d in rank_dets.items():
+            merged.setdefault(image_id, d)
+    img_ids = sorted(merged)
+    parts = [merged[i] for i in img_ids] or [detections_from_results({})]
+    dets = {k: np.concatenate([d[k] for d in parts]) for k in parts[0]}
+    result = evaluate_bbox(gt_from_coco(base_ds, img_ids), dets, img_ids)
+    print_stats(result['stats'])
+
+    stats = {k: meter.global_avg for k, meter in metric_logger.meters.items()}
+    stats['coco_eval_bbox'] = result['stats'].tolist()
+    return stats, None
@@ -0,0 +1,142 @@
+"""
+Gradient accumulation over micro-batches for engine_track.train_one_epoch.
+
+train_one_epoch zeroes the gradients, runs backward and steps the optimizer
+(through the GradScaler with --fp16) once per batch. ``GradientAccumulator``
+hands it an optimizer and a scaler that only do so once every
+``accum_steps`` batches:
+
+* ``zero_grad`` only clears the gradients at the start of a group;
+* ``step`` (on the optimizer or the scaler) counts the micro-batch. On the
+  last one of the group the summed gradients are divided by the group size,
+  unscaled, clipped to ``clip_max_norm`` and applied with the real scaler and
+  optimizer, followed by ``scaler.update()``;
+* with DistributedDataParallel the gradient all-reduce is skipped for all but
+  the last micro-batch of a group.
+
+An overflow in any micro-batch makes the GradScaler skip the whole group, as
+it would for one large batch. train_one_epoch must be called with
+``max_norm=0`` so that it does not clip partial sums; ``train_one_epoch_accum``
+does this and applies the last incomplete group of the epoch.
+"""
+import torch
+
+from engine_track import train_one_epoch
+
+
+class _MicroBatchOptimizer(object):
+    def __init__(self, accumulator):
+        self._accumulator = accumulator
+
+    def zero_grad(self, *args, **kwargs):
+        if self._accumulator.micro == 0:
+            self._accumulator.optimizer.zero_grad(*args, **kwargs)
+
+    def step(self, closure=None):
+        assert closure is None, 'closures are not supported with gradient accumulation'
+        self._accumulator.micro_step()
+
+    def __getattr__(self, name):
+        return getattr(self._accumulator.optimizer, name)
+
+
+class _MicroBatchScaler(object):
+    def __init__(self, accumulator):
+        self._accumulator = accumulator
+
+    def scale(self, outputs):
+        return self._accumulator.scaler.scale(outputs)
+
+    def unscale_(self, optimizer):
+        # the summed gradients are unscaled once, at the end of the group
+        pass
+
+    def step(self, optimizer, *args, **kwargs):
+        self._accumulator.micro_step()
+
+    def update(self, new_scale=None):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._accumulator.scaler, name)
+
+
+class GradientAccumulator(object):
+    def __init__(self, model, optimizer, scaler, accum_steps, clip_max_norm=0.0):
+        assert accum_steps >= 1
+        self.model = model
+        self.optimizer = optimizer
+        self.scaler = scaler
+        self.accum_steps = accum_steps
+        self.clip_max_norm = clip_max_norm
+        self.micro = 0
+        self.num_updates = 0
+        self.micro_optimizer = _MicroBatchOptimizer(self)
+        self.micro_scaler = _MicroBatchScaler(self)
+        self._set_grad_sync()
+
+    def _params(self, with_grad=True):
+        return [p for group in self.optimizer.param_groups for p in group['params']
+                if p.grad is not None or (not with_grad and p.requires_grad)]
+
+    def _set_grad_sync(self):
+        # what DistributedDataParallel.no_sync() toggles, for the next backward
+        if hasattr(self.model, 'require_backward_grad_sync'):
+            self.model.require_backward_grad_sync = self.micro == self.accum_steps - 1
+
+    def micro_step(self):
+        self.micro += 1
+        if self.micro == self.accum_steps:
+            self.apply()
+        self._set_grad_sync()
+
+    def apply(self):
+        """Step with the gradients summed since the last step (if any) and start a new group."""
+        if self.micro == 0:
+            return
+        params = self._params()
+        if self.micro > 1:
+            for p in params:
+                p.grad.div_(self.micro)
+        self.scaler.unscale_(self.optimizer)
+        if self.clip_max_norm > 0:
+            torch.nn.utils.clip_grad_norm_(params, self.clip_max_norm)
+        self.scaler.step(self.optimizer)
+        self.scaler.update()
+        self.optimizer.zero_grad()
+        self.micro = 0
+        self.num_updates += 1
+
+    def flush(self):
+        """Apply the last incomplete group, e.g. at the end of an epoch."""
+        if self.micro > 0 and hasattr(self.model, 'require_backward_grad_sync'):
+            # every backward of an incomplete group skipped the all-reduce. All ranks reduce
+            # the same parameters in the same order: those that have a grad on any rank,
+            # with zeros where this rank did not use them in its micro-batches
+            params = self._params(with_grad=False)
+            used = torch.tensor([float(p.grad is not None) for p in params], device=params[0].device)
+            torch.distributed.all_reduce(used)
+            for p, n in zip(params, used.tolist()):
+                if n == 0:
+                    continue
+                if p.grad is None:
+                    p.grad = torch.zeros_like(p)
+                torch.distributed.all_reduce(p.grad)
+                p.grad.div_(torch.distributed.get_world_size())
+        self.apply()
+        self._set_grad_sync()
+
+
+def build_accumulator(args, model, optimizer, scaler):
+    if args.accum_steps <= 1:
+        return None
+    return GradientAccumulator(model, optimizer, scaler, args.accum_steps, args.clip_max_norm)
+
+
+def train_one_epoch_accum(accumulator, model, det_model, criterion, data_loader, device, epoch, weight_dict,
+                          fp16=False):
+    """train_one_epoch with one optimizer step every ``accumulator.accum_steps`` batches."""
+    stats = train_one_epoch(model, det_model, criterion, data_loader, accumulator.micro_optimizer, device,
+                            accumulator.micro_scaler, epoch, weight_dict, 0, fp16=fp16)
+    accumulator.flush()
+    return stats
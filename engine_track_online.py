@@ -0,0 +1,133 @@
+"""
+Tracking inference that keeps per-video state across calls.
+
+evaluate_lockstep runs several test videos at once: batch t holds frame t of
+each video in the current wave (see datasets/sampler_video_lockstep.py) and
+every batch slot keeps its own Tracker and previous-frame embedding.
+
+StreamingTracker tracks a live feed, one frame per call, without any dataset
+or annotation files.
+"""
+import torch
+
+import util.misc as utils
+
+
+def track_forward(model, det_model, samples, pre_embed):
+    """One forward pass of the track-test model, as in engine_track.evaluate."""
+    return model(samples, pre_embed, det_model)
+
+
+def slice_batch(obj, n):
+    """Keep the first ``n`` entries along the batch dim of every tensor in ``obj``."""
+    if torch.is_tensor(obj):
+        return obj[:n]
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(slice_batch(o, n) for o in obj)
+    if isinstance(obj, dict):
+        return {k: slice_batch(v, n) for k, v in obj.items()}
+    return obj
+
+
+@torch.no_grad()
+def evaluate_lockstep(model, det_model, postprocessors, data_loader, device, trackers, fp16=False):
+    """Track a lockstep-batched loader; returns ``res_tracks`` keyed by image id like evaluate."""
+    model.eval()
+
+    metric_logger = utils.MetricLogger(delimiter="  ")
+    header = 'Test (lockstep x{}):'.format(len(trackers))
+
+    res_tracks = dict()
+    pre_embed = None
+    for samples, targets in metric_logger.log_every(data_loader, 10, header):
+        assert len(targets) <= len(trackers)
+        frame_ids = [t['frame_id'].item() for t in targets]
+        new_wave = frame_ids[0] == 1
+        if new_wave:
+            assert all(f == 1 for f in frame_ids), 'videos of a wave must start together'
+            for tracker in trackers:
+                tracker.reset_all()
+            pre_embed = None
+        elif pre_embed is not None:
+            # videos that ended drop off the end of the batch
+            pre_embed = slice_batch(pre_embed, len(targets))
+
+        samples = samples.to(device)
+        targets = [{k: v.to(device) for k, v in t.items()} for t in targets]
+
+        with torch.cuda.amp.autocast(enabled=fp16):
+            outputs, pre_embed = track_forward(model, det_model, samples, pre_embed)
+
+        orig_target_sizes = torch.stack([t["orig_size"] for t in targets], dim=0)
+        results = postprocessors['bbox'](outputs, orig_target_sizes)
+
+        for tracker, target, result in zip(trackers, targets, results):
+            if new_wave:
+                res_track = tracker.init_track(result)
+            else:
+                res_track = tracker.step(result)
+            res_tracks[target['image_id'].item()] = res_track
+
+    metric_logger.synchronize_between_processes()
+    print("Averaged stats:", metric_logger)
+    return res_tracks
+
+
+def default_frame_transform(frame, input_size=800, max_size=1333):
+    """RGB uint8 HxWx3 array or PIL image -> normalized CHW tensor, resized like the val split."""
+    import torchvision.transforms.functional as F
+
+    image = F.to_tensor(frame)
+    h, w = image.shape[-2:]
+    scale = min(input_size / min(h, w), max_size / max(h, w))
+    if scale != 1.0:
+        image = F.resize(image, [int(round(h * scale)), int(round(w * scale))], antialias=True)
+    return F.normalize(image, mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+
+
+class StreamingTracker(object):
+    """Online tracking over frames that arrive one at a time.
+
+    No dataset or annotation file is involved: every ``step`` takes a single RGB
+    frame, runs the track-test model and the Tracker, and returns the current
+    tracks. Only the previous-frame embedding and the Tracker state are kept
+    between frames, so memory does not grow with the length of the stream.
+    """
+    def __init__(self, model, det_model, postprocessors, tracker, device, transform=None, fp16=False):
+        self.model = model.eval()
+        self.det_model = det_model
+        self.postprocessors = postprocessors
+        self.tracker = tracker
+        self.device = device
+        self.transform = transform or default_frame_transform
+        self.fp16 = fp16
+        self.reset()
+
+    def reset(self):
+        """Start a new video; the next frame initialises fresh tracks."""
+        self.tracker.reset_all()
+        self.pre_embed = None
+        self.frame_id = 0
+
+    @torch.no_grad()
+    def step(self, frame):
+        h, w = frame.shape[:2] if hasattr(frame, 'shape') else frame.size[::-1]
+        image = self.transform(frame).to(self.device, non_blocking=True)
+        samples = utils.nested_tensor_from_tensor_list([image])
+
+        with torch.cuda.amp.autocast(enabled=self.fp16):
+            outputs, self.pre_embed = track_forward(self.model, self.det_model, samples, self.pre_embed)
+
+        orig_target_sizes = torch.as_tensor([[h, w]], device=self.device)
+        result = self.postprocessors['bbox'](outputs, orig_target_sizes)[0]
+
+        self.frame_id += 1
+        if self.frame_id == 1:
+            return self.tracker.init_track(result)
+        return self.tracker.step(result)
+
+    def track(self, frames):
+        """Yield ``(frame_id, tracks)`` for every frame of the generator ``frames``."""
+        for frame in frames:
+            tracks = self.step(frame)
+            yield self.frame_id, tracks
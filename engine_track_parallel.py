@@ -0,0 +1,88 @@
+"""
+Test-set tracking sharded over a local process pool, without torch.distributed.
+
+Every worker process builds its own track-test model, detector and Tracker
+once, with its torch thread count capped, and then tracks whole videos pulled
+from a shared queue, longest first. The per-video ``res_tracks`` are sent back
+and merged, so ``save_track`` runs once in the parent as in the single-process
+evaluation.
+"""
+import multiprocessing as mp
+import os
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+import util.misc as utils
+
+_worker = {}
+
+
+def _init_worker(args, num_threads):
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+
+    from datasets import build_dataset
+    from engine_track_online import evaluate_lockstep
+    from models import build_tracktest_model
+    from models.detector_registry import DetectorRegistry, detector_for_phase
+    from models.query_pruning import build_pruner
+    from models.sparse_tracker import build_tracker
+    from util.precision import enable_bf16, keep_fp32_tracker
+
+    device = torch.device(args.device)
+    model, _, postprocessors = build_tracktest_model(args)
+    if args.resume:
+        checkpoint = torch.load(args.resume, map_location='cpu')
+        model.load_state_dict(checkpoint['model'], strict=False)
+    model.to(device)
+    det_model = build_pruner(args, DetectorRegistry(device).get(detector_for_phase(args)))
+    tracker = build_tracker(args)
+    if args.bf16:
+        enable_bf16(model, det_model, device_type=device.type)
+        keep_fp32_tracker(tracker, device.type)
+
+    _worker.update(
+        args=args,
+        device=device,
+        model=model,
+        postprocessors=postprocessors,
+        det_model=det_model,
+        tracker=tracker,
+        dataset=build_dataset(image_set=args.track_eval_split, args=args),
+        evaluate=evaluate_lockstep,
+    )
+
+
+def _track_video(task):
+    video_id, indices = task
+    start = time.perf_counter()
+    # pool workers are daemonic and cannot start DataLoader workers of their own
+    loader = DataLoader(_worker['dataset'], batch_size=1, sampler=list(indices),
+                        collate_fn=utils.collate_fn, num_workers=0)
+    res_tracks = _worker['evaluate'](_worker['model'], _worker['det_model'], _worker['postprocessors'], loader,
+                                     _worker['device'], [_worker['tracker']], fp16=_worker['args'].fp16)
+    return video_id, res_tracks, len(indices), time.perf_counter() - start
+
+
+def evaluate_parallel(args, frame_index, num_workers, threads_per_worker=None):
+    """Track every video of the eval split on ``num_workers`` processes; returns merged ``res_tracks``."""
+    if threads_per_worker is None:
+        threads_per_worker = max((os.cpu_count() or 1) // num_workers, 1)
+    videos = frame_index.video_indices()
+    tasks = sorted(videos.items(), key=lambda kv: len(kv[1]), reverse=True)
+    num_workers = min(num_workers, len(tasks))
+    print('Tracking {} videos on {} workers x {} threads'.format(len(tasks), num_workers, threads_per_worker))
+
+    res_tracks = dict()
+    start = time.perf_counter()
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(num_workers, initializer=_init_worker, initargs=(args, threads_per_worker)) as pool:
+        for done, (video_id, video_tracks, num_frames, elapsed) in enumerate(
+                pool.imap_unordered(_track_video, tasks), 1):
+            res_tracks.update(video_tracks)
+            print('[{}/{}] video {}: {} frames in {:.1f}s'.format(done, len(tasks), video_id, num_frames, elapsed))
+    total = time.perf_counter() - start
+    print('Tracked {} frames in {:.1f}s ({:.2f} frames/s)'.format(len(frame_index), total, len(frame_index) / total))
+    return res_tracks
@@ -0,0 +1,133 @@
+"""
+Export the track-test model for CPU inference (see models/export.py).
+
+    python export_track.py --resume exps/checkpoint.pth --frames data/VISEM/test/12/img1 --export_out exports/int8
+    python export_track.py --resume exps/checkpoint.pth --frames data/VISEM/test/12/img1 --export_out exports/fp32 \
+        --no_quantize
+
+The first two frames of --frames are used for tracing. Afterwards the exported
+graphs are loaded through track_runtime and run on the first --parity_frames
+frames next to the eager fp32 model. Detections above --track_thresh are
+matched by IoU. The script exits with status 1 if fewer than
+--parity_min_agreement of the eager detections are found again at IoU >= 0.5;
+the export is then marked as failed in export.json and track_runtime will not
+load it.
+"""
+import argparse
+import sys
+
+import numpy as np
+import torch
+from scipy.optimize import linear_sum_assignment
+
+from main_track import get_args_parser
+from models import build_tracktest_model
+from models.detector_registry import DetectorRegistry, detector_for_phase
+from models.export import DEFAULT_QUANT_SKIP, TrackExportWrapper, export_track_model, write_export_meta
+from track_runtime import ExportedTrackModel, load_frames, preprocess_frame
+
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+def input_size(h, w, size=800, max_size=1333):
+    """Size of the val transform's output for an ``h`` x ``w`` frame."""
+    scale = min(size / min(h, w), max_size / max(h, w))
+    return int(round(h * scale)), int(round(w * scale))
+
+
+def box_iou(a, b):
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(-1)
+    area_a = (a[:, 2:] - a[:, :2]).prod(-1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(-1)
+    return inter / np.maximum(area_a[:, None] + area_b[None] - inter, 1e-7)
+
+
+def compare_frame(ref, out, thresh):
+    """Eager detections above ``thresh`` matched to exported ones: (#ref, #matched, IoUs, score diffs)."""
+    keep_r = ref['scores'].numpy() >= thresh
+    keep_o = out['scores'].numpy() >= thresh
+    ref_boxes, out_boxes = ref['boxes'].numpy()[keep_r], out['boxes'].numpy()[keep_o]
+    if len(ref_boxes) == 0 or len(out_boxes) == 0:
+        return len(ref_boxes), 0, [], []
+    iou = box_iou(ref_boxes, out_boxes)
+    rows, cols = linear_sum_assignment(-iou)
+    ok = iou[rows, cols] >= 0.5
+    score_diff = np.abs(ref['scores'].numpy()[keep_r][rows[ok]] - out['scores'].numpy()[keep_o][cols[ok]])
+    return len(ref_boxes), int(ok.sum()), iou[rows, cols][ok].tolist(), score_diff.tolist()
+
+
+def parity(wrapper, runtime, frames, thresh):
+    num_ref, num_matched, ious, score_diffs = 0, 0, [], []
+    pre_embed = ()
+    runtime.reset()
+    with torch.no_grad():
+        for frame in frames:
+            image, orig_size = runtime.preprocess(frame)
+            out = wrapper(image, orig_size, *pre_embed)
+            # first frame: scores, labels, boxes; later frames also track_boxes
+            pre_embed = out[4:] if pre_embed else out[3:]
+            ref = {'scores': out[0], 'boxes': out[2]}
+            n, m, i, s = compare_frame(ref, runtime(frame), thresh)
+            num_ref += n
+            num_matched += m
+            ious += i
+            score_diffs += s
+    return {
+        'frames': len(frames),
+        'detections': num_ref,
+        'agreement': num_matched / num_ref if num_ref else 1.0,
+        'mean_iou': float(np.mean(ious)) if ious else 1.0,
+        'max_score_diff': float(np.max(score_diffs)) if score_diffs else 0.0,
+    }
+
+
+def main(args):
+    device = torch.device('cpu')
+    model, _, postprocessors = build_tracktest_model(args)
+    checkpoint = torch.load(args.resume, map_location='cpu')
+    missing_keys, _ = model.load_state_dict(checkpoint['model'], strict=False)
+    if len(missing_keys) > 0:
+        print('Missing Keys: {}'.format(missing_keys), file=sys.stderr)
+    model.to(device).eval()
+    det_model = DetectorRegistry(device).get(detector_for_phase(args))
+
+    frames = load_frames(args.frames, max(args.parity_frames, 2))
+    assert len(frames) >= 2, 'need at least two frames in {}'.format(args.frames)
+    h, w = frames[0].shape[:2]
+    size = input_size(h, w)
+
+    # tracing goes through the runtime's own preprocessing so both sides see the same input
+    examples = [preprocess_frame(f, size, MEAN, STD) for f in frames[:2]]
+    meta = export_track_model(model, det_model, postprocessors['bbox'], examples, args.export_out, MEAN, STD,
+                              quantize=not args.no_quantize, quant_skip=args.quant_skip)
+    print('exported {} ({}, input {}x{})'.format(args.export_out, 'int8' if meta['quantized'] else 'fp32',
+                                                 *meta['input_size']))
+
+    runtime = ExportedTrackModel(args.export_out)
+    eager = TrackExportWrapper(model, det_model, postprocessors['bbox']).eval()
+    report = parity(eager, runtime, frames[:args.parity_frames], args.track_thresh)
+    print('parity vs eager fp32: ' + ', '.join('{}={:.4g}'.format(k, v) for k, v in report.items()))
+    passed = report['agreement'] >= args.parity_min_agreement
+    write_export_meta(args.export_out, dict(meta, parity=dict(report, min_agreement=args.parity_min_agreement,
+                                                              passed=passed)))
+    if not passed:
+        print('agreement below {}, export marked as failed'.format(args.parity_min_agreement))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Track-test model export', parents=[get_args_parser()])
+    parser.add_argument('--frames', required=True, help='directory with the frames of one video')
+    parser.add_argument('--export_out', required=True, help='output directory of the exported graphs')
+    parser.add_argument('--no_quantize', default=False, action='store_true', help='export fp32 graphs')
+    parser.add_argument('--quant_skip', default=list(DEFAULT_QUANT_SKIP), nargs='*',
+                        help='keep nn.Linear layers whose name contains one of these in fp32')
+    parser.add_argument('--parity_frames', default=20, type=int)
+    parser.add_argument('--parity_min_agreement', default=0.95, type=float)
+    args = parser.parse_args()
+    args.eval = True
+    sys.exit(main(args))
@@ -20,7 +20,10 @@ import datasets
 import util.misc as utils
 import datasets.samplers as samplers
 from datasets import build_dataset, get_coco_api_from_dataset
+from datasets.coco_index_cache import install_coco_index_cache
 from engine import evaluate, train_one_epoch
+from engine_fast_eval import eval_kind, evaluate_fast, stratified_subset
+from util.checkpoint_writer import AsyncCheckpointWriter
 from models import build_model
 
 
@@ -120,11 +123,25 @@ def get_args_parser():
     parser.add_argument('--eval', action='store_true')
     parser.add_argument('--num_workers', default=2, type=int)
     parser.add_argument('--cache_mode', default=False, action='store_true', help='whether to cache images on memory')
+    parser.add_argument('--coco_index_cache', default='', type=str,
+                        help='directory of the memory-mapped annotation index cache (empty = parse the json)')
 
     # PyTorch checkpointing for saving memory (torch.utils.checkpoint.checkpoint)
     parser.add_argument('--checkpoint_enc_ffn', default=False, action='store_true')
     parser.add_argument('--checkpoint_dec_ffn', default=False, action='store_true')
 
+    # keep only the last K numbered checkpoint files (0 keeps all)
+    parser.add_argument('--keep_checkpoints', default=0, type=int)
+
+    # validation schedule (full validations always run before LR drops and after the last epoch)
+    parser.add_argument('--eval_every', default=1, type=int, help='validate every N epochs')
+    parser.add_argument('--eval_subset', default=0.0, type=float,
+                        help='fraction of the val images, spread over every video, for the validations '
+                             'between full ones (0 = always full)')
+    parser.add_argument('--full_eval_every', default=0, type=int, help='also a full validation every N epochs')
+    parser.add_argument('--fast_ap', default=False, action='store_true',
+                        help='NumPy bbox AP instead of pycocotools COCOeval')
+
     return parser
 
 
@@ -151,6 +168,8 @@ def main(args):
     n_parameters = sum(p.numel() for p in model.parameters() if p.requires_grad)
     print('number of params:', n_parameters)
 
+    if args.coco_index_cache:
+        install_coco_index_cache(args.coco_index_cache)
     dataset_train = build_dataset(image_set='train', args=args)
     dataset_val = build_dataset(image_set='val', args=args)
 
@@ -174,6 +193,16 @@ def main(args):
     data_loader_val = DataLoader(dataset_val, args.batch_size, sampler=sampler_val,
                                  drop_last=False, collate_fn=utils.collate_fn, num_workers=args.num_workers,
                                  pin_memory=True)
+    if args.eval_subset > 0:
+        dataset_val_subset = torch.utils.data.Subset(dataset_val, stratified_subset(dataset_val, args.eval_subset).tolist())
+        print('val subset: {} of {} images'.format(len(dataset_val_subset), len(dataset_val)))
+        if args.distributed:
+            sampler_val_subset = samplers.DistributedSampler(dataset_val_subset, shuffle=False)
+        else:
+            sampler_val_subset = torch.utils.data.SequentialSampler(dataset_val_subset)
+        data_loader_val_subset = DataLoader(dataset_val_subset, args.batch_size, sampler=sampler_val_subset,
+                                            drop_last=False, collate_fn=utils.collate_fn,
+                                            num_workers=args.num_workers, pin_memory=True)
 
     # lr_backbone_names = ["backbone.0", "backbone.neck", "input_proj", "transformer.encoder"]
     def match_name_keywords(n, name_keywords):
@@ -227,6 +256,7 @@ def main(args):
         model_without_ddp.detr.load_state_dict(checkpoint['model'])
 
     output_dir = Path(args.output_dir)
+    evaluate_fn = evaluate_fast if args.fast_ap else evaluate
     if args.resume:
         if args.resume.startswith('https'):
             checkpoint = torch.hub.load_state_dict_from_url(
@@ -258,18 +288,19 @@ def main(args):
             args.start_epoch = checkpoint['epoch'] + 1
         # check the resumed model
         if not args.eval:
-            test_stats, coco_evaluator = evaluate(
+            test_stats, coco_evaluator = evaluate_fn(
                 model, criterion, postprocessors, data_loader_val, base_ds, device, args.output_dir
             )
     
     if args.eval:
-        test_stats, coco_evaluator = evaluate(model, criterion, postprocessors,
-                                              data_loader_val, base_ds, device, args.output_dir)
-        if args.output_dir:
+        test_stats, coco_evaluator = evaluate_fn(model, criterion, postprocessors,
+                                                 data_loader_val, base_ds, device, args.output_dir)
+        if args.output_dir and coco_evaluator is not None:
             utils.save_on_master(coco_evaluator.coco_eval["bbox"].eval, output_dir / "eval.pth")
         return
 
     print("Start training")
+    checkpoint_writer = AsyncCheckpointWriter(keep_last=args.keep_checkpoints)
     start_time = time.time()
     for epoch in range(args.start_epoch, args.epochs):
         if args.distributed:
@@ -282,21 +313,26 @@ def main(args):
             # extra checkpoint before LR drop and every 5 epochs
             if (epoch + 1) % args.lr_drop == 0 or (epoch + 1) % 5 == 0:
                 checkpoint_paths.append(output_dir / f'checkpoint{epoch:04}.pth')
-            for checkpoint_path in checkpoint_paths:
-                utils.save_on_master({
-                    'model': model_without_ddp.state_dict(),
-                    'optimizer': optimizer.state_dict(),
-                    'lr_scheduler': lr_scheduler.state_dict(),
-                    'epoch': epoch,
-                    'args': args,
-                }, checkpoint_path)
-
-        test_stats, coco_evaluator = evaluate(
-            model, criterion, postprocessors, data_loader_val, base_ds, device, args.output_dir
-        )
+            checkpoint_writer.save({
+                'model': model_without_ddp.state_dict(),
+                'optimizer': optimizer.state_dict(),
+                'lr_scheduler': lr_scheduler.state_dict(),
+                'epoch': epoch,
+                'args': args,
+            }, checkpoint_paths)
+
+        kind = eval_kind(epoch, args)
+        test_stats, coco_evaluator = {}, None
+        if kind is not None:
+            test_stats, coco_evaluator = evaluate_fn(
+                model, criterion, postprocessors, data_loader_val if kind == 'full' else data_loader_val_subset,
+                base_ds, device, args.output_dir
+            )
+        # subset results are logged apart so that they do not mix with the full-split curves
+        test_prefix = 'test' if kind == 'full' else 'subset'
 
         log_stats = {**{f'train_{k}': v for k, v in train_stats.items()},
-                     **{f'test_{k}': v for k, v in test_stats.items()},
+                     **{f'{test_prefix}_{k}': v for k, v in test_stats.items()},
                      'epoch': epoch,
                      'n_parameters': n_parameters}
 
@@ -305,7 +341,7 @@ def main(args):
                 f.write(json.dumps(log_stats) + "\n")
 
             # for evaluation logs
-            if coco_evaluator is not None:
+            if coco_evaluator is not None and kind == 'full':
                 (output_dir / 'eval').mkdir(exist_ok=True)
                 if "bbox" in coco_evaluator.coco_eval:
                     filenames = ['latest.pth']
@@ -315,6 +351,7 @@ def main(args):
                         torch.save(coco_evaluator.coco_eval["bbox"].eval,
                                    output_dir / "eval" / name)
 
+    checkpoint_writer.close()
     total_time = time.time() - start_time
     total_time_str = str(datetime.timedelta(seconds=int(total_time)))
     print('Training time {}'.format(total_time_str))
@@ -9,7 +9,7 @@
 # ------------------------------------------------------------------------
 import argparse
 import datetime
-import json
+import os
 import random
 import time
 from pathlib import Path
@@ -21,17 +21,32 @@ import datasets
 import util.misc as utils
 import datasets.samplers as samplers
 from datasets.sampler_video_distributed import DistributedVideoSampler
+from datasets.sampler_video_train import DistributedVideoClipSampler, restrict_image_cache
+from datasets.sampler_video_lockstep import VideoLockstepBatchSampler
+from datasets.frame_index import load_frame_index, split_ann_file
+from datasets.coco_index_cache import install_coco_index_cache
+from datasets.frame_cache import attach_frame_cache, video_sequential_sampler, PinnedPrefetcher, WorkerChunkBatchSampler
 from datasets import build_dataset, get_coco_api_from_dataset
 from engine_track import evaluate, train_one_epoch, multiply_loss_giou_values, sigmoid_base_sche, sigmoid
+from engine_track_online import evaluate_lockstep
+from engine_track_parallel import evaluate_parallel
+from engine_track_accum import build_accumulator, train_one_epoch_accum
+from util.checkpoint_writer import AsyncCheckpointWriter
+from util.metrics_history import MetricsHistory
+from util.profiling import StageProfiler
+from util.mot_metrics import collect_sequences, evaluate_mot, write_summary
+from util.track_io import save_track_arrays, tracks_to_array
+from util.kinematics import compute_kinematics, save_kinematics_csv
+from util.precision import enable_bf16, keep_fp32_tracker
+from util.activation_checkpoint import apply_activation_checkpointing
 from models import build_tracktrain_model, build_tracktest_model, build_model
-from models import Tracker
+from models.query_pruning import build_pruner
+from models.sparse_tracker import build_tracker
 from models import save_track
 
-from collections import defaultdict
 from tqdm import tqdm
-from learning_curve_each import plot_combined_loss
-from learning_unscaled_curve_each import plot_combined_unscaled_loss
-from ultralytics import RTDETR
+from util.plot_service import LearningCurvePlotter
+from models.detector_registry import DetectorRegistry, detector_for_phase
 
 
 def get_args_parser():
@@ -137,16 +152,52 @@ def get_args_parser():
     parser.add_argument('--eval', action='store_true')
     parser.add_argument('--num_workers', default=1, type=int)
     parser.add_argument('--cache_mode', default=False, action='store_true', help='whether to cache images on memory')
+    parser.add_argument('--coco_index_cache', default='', type=str,
+                        help='directory of the memory-mapped annotation index cache (empty = parse the json)')
+    parser.add_argument('--frame_cache', default=0, type=int,
+                        help='LRU of this many decoded training frames per loader worker, shared by neighbouring '
+                             'frame pairs; without distributed training it also changes the training order from '
+                             'random frames to shuffled clips of --clip_len consecutive frames')
+    parser.add_argument('--prefetch', default=False, action='store_true',
+                        help='pin and copy the next training batches to the device on a background thread')
+
+    # frozen detector.
+    parser.add_argument('--det_checkpoint', default='', type=str,
+                        help='RT-DETR checkpoint, defaults to q500 for training and q100 for --eval')
 
     # PyTorch checkpointing for saving memory (torch.utils.checkpoint.checkpoint)
     parser.add_argument('--checkpoint_enc_ffn', default=False, action='store_true')
     parser.add_argument('--checkpoint_dec_ffn', default=False, action='store_true')
+    parser.add_argument('--checkpoint_modules', default=[], type=str, nargs='+',
+                        help='recompute whole submodules in backward: enc_layer, dec_layer or re:<regex> on the '
+                             'module name')
+    # gradient accumulation: one optimizer step every accum_steps batches of --batch_size
+    parser.add_argument('--accum_steps', default=1, type=int)
+
+    # keep only the last K numbered checkpoint files (0 keeps all)
+    parser.add_argument('--keep_checkpoints', default=0, type=int)
+
+    # per-stage timing / memory, written to profile.txt next to log.txt
+    parser.add_argument('--profile', default=False, action='store_true')
+    parser.add_argument('--profile_trace', default=None, type=int, nargs=2, metavar=('START', 'STOP'),
+                        help='also record a torch.profiler trace for these iterations')
+
+    # redraw the learning curves every N epochs (0 disables)
+    parser.add_argument('--plot_interval', default=1, type=int)
 
     # appended for track.
     parser.add_argument('--track_train_split', default='train', type=str)
     #parser.add_argument('--track_eval_split', default='val', type=str)
     parser.add_argument('--track_eval_split', default='test', type=str)
     parser.add_argument('--track_thresh', default=0.4, type=float)
+    parser.add_argument('--sparse_assoc', default=False, action='store_true',
+                        help='associate only detections/tracks within --assoc_radius (KD-tree, per component)')
+    parser.add_argument('--assoc_radius', default=64.0, type=float, help='max centre motion per frame in pixels')
+    parser.add_argument('--prune_topk', default=0, type=int,
+                        help='eval: pass only the top-k detector queries to the track model (0 = all)')
+    parser.add_argument('--prune_score', default=None, type=float,
+                        help='eval: also drop detector queries below this score')
+    parser.add_argument('--prune_min_keep', default=1, type=int)
     parser.add_argument('--reid_shared', default=False, type=bool)
     parser.add_argument('--reid_dim', default=128, type=int)
     parser.add_argument('--num_ids', default=360, type=int)
@@ -157,10 +208,30 @@ def get_args_parser():
 
     # fp16
     parser.add_argument('--fp16', default=False, action='store_true')
+    parser.add_argument('--bf16', default=False, action='store_true',
+                        help='bfloat16 autocast on --device for the track model and the detector (matcher / tracker stay fp32)')
     
     # multi-gpu test
     parser.add_argument('--start_id', default = 0, type=int)
     parser.add_argument('--dist_video', default=False, action='store_true')
+    parser.add_argument('--video_train_sampler', default=False, action='store_true',
+                        help='give each rank contiguous clips of training videos instead of scattered frames')
+    parser.add_argument('--clip_len', default=8, type=int)
+    parser.add_argument('--lockstep_videos', default=1, type=int,
+                        help='track this many test videos at once, frame t of each video in one batch')
+    parser.add_argument('--eval_workers', default=0, type=int,
+                        help='track test videos on this many local processes (no torch.distributed needed)')
+    parser.add_argument('--eval_threads', default=0, type=int,
+                        help='torch threads per --eval_workers process (0 = cores / workers)')
+    parser.add_argument('--eval_mot', default=False, action='store_true',
+                        help='compute HOTA/MOTA/IDF1 from the tracking results and write mot_metrics.json')
+    parser.add_argument('--mot_workers', default=0, type=int, help='processes for --eval_mot (0 = all cores)')
+    parser.add_argument('--track_format', default='mot', choices=['mot', 'npy', 'both'],
+                        help='per-video tracking output: MOT text, columnar .npy (util/track_io.py) or both')
+    parser.add_argument('--kinematics', default=False, action='store_true',
+                        help='write per-sperm CASA kinematics (VCL, VSL, VAP, ...) per test video')
+    parser.add_argument('--fps', default=50.0, type=float, help='frame rate of the recordings, for --kinematics')
+    parser.add_argument('--um_per_px', default=1.0, type=float, help='pixel size in um, for --kinematics')
     return parser
 
 
@@ -200,13 +271,12 @@ def main(args):
     print('number of params:', n_parameters)
      
     # ----------- DETRモデルの定義 ----------
-    yolo_model = RTDETR('models/pretrain_rtdetr_q500.pt')
-    #print('device =  ',device)
-    yolo_model.to(device)
+    # 学習はq500, 評価はq100のDETRだけをロードする (パラメータは固定)
+    detectors = DetectorRegistry(device)
+    det_checkpoint = detector_for_phase(args)
+    yolo_model = detectors.get(det_checkpoint)
+    print('DETR {} loaded in {:.2f}s'.format(det_checkpoint, detectors.load_times[det_checkpoint]))
     #yolo_model = RTDETR('rtdetr-l.pt')
-    # モデルのすべてのパラメータを学習可能 or 不可能に設定
-    for param in yolo_model.parameters():
-        param.requires_grad = False
     params = 0
     for n, p in yolo_model.named_parameters():
         if p.requires_grad:
@@ -220,8 +290,13 @@ def main(args):
 
     # ---------------------------------------
 
+    # アノテーションのインデックスをキャッシュから読み込む
+    if args.coco_index_cache:
+        install_coco_index_cache(args.coco_index_cache)
     dataset_train = build_dataset(image_set=args.track_train_split, args=args)
     dataset_val = build_dataset(image_set=args.track_eval_split, args=args)
+    if args.eval:
+        frame_index_val = load_frame_index(dataset_val, split_ann_file(args.coco_path, args.track_eval_split))
     
     #check
     #args.distributed = False
@@ -237,19 +312,44 @@ def main(args):
                 sampler_val = DistributedVideoSampler(dataset_val, start_id=args.start_id, shuffle=False)
             else:
                 sampler_val = samplers.DistributedSampler(dataset_val, shuffle=False)     
+        if args.video_train_sampler:
+            # 動画の連続クリップ単位でrankに割り当てる
+            # (--cache_mode では動画をrankに固定し、そのrankの動画の画像だけをキャッシュする)
+            sampler_train = DistributedVideoClipSampler(dataset_train, clip_len=args.clip_len, seed=args.seed,
+                                                        fixed_videos=args.cache_mode)
+            if args.cache_mode:
+                restrict_image_cache(dataset_train, sampler_train.owned_indices())
     else:
         sampler_train = torch.utils.data.RandomSampler(dataset_train)
         sampler_val = torch.utils.data.SequentialSampler(dataset_val)
 
+    if args.frame_cache > 0:
+        # 現在/前フレームのデコード結果を隣接サンプル間で共有する
+        attach_frame_cache(dataset_train, args.frame_cache)
+        if not args.distributed:
+            sampler_train = video_sequential_sampler(dataset_train, clip_len=args.clip_len, seed=args.seed)
+
     batch_sampler_train = torch.utils.data.BatchSampler(
         sampler_train, args.batch_size, drop_last=True)
+    if args.frame_cache > 0 and args.num_workers > 1:
+        # キャッシュはworkerごとなので、各workerに連続したバッチを渡す
+        batch_sampler_train = WorkerChunkBatchSampler(batch_sampler_train, args.num_workers)
 
     data_loader_train = DataLoader(dataset_train, batch_sampler=batch_sampler_train,
                                    collate_fn=utils.collate_fn, num_workers=args.num_workers,
                                    pin_memory=True)
-    data_loader_val = DataLoader(dataset_val, args.batch_size, sampler=sampler_val,
-                                 drop_last=False, collate_fn=utils.collate_fn, num_workers=args.num_workers,
-                                 pin_memory=True)
+    if args.prefetch:
+        data_loader_train = PinnedPrefetcher(data_loader_train, device)
+    if args.eval and args.lockstep_videos > 1:
+        # frame t of several videos in one batch, one Tracker per batch slot
+        batch_sampler_val = VideoLockstepBatchSampler(dataset_val, args.lockstep_videos, indices=list(sampler_val))
+        data_loader_val = DataLoader(dataset_val, batch_sampler=batch_sampler_val,
+                                     collate_fn=utils.collate_fn, num_workers=args.num_workers,
+                                     pin_memory=True)
+    else:
+        data_loader_val = DataLoader(dataset_val, args.batch_size, sampler=sampler_val,
+                                     drop_last=False, collate_fn=utils.collate_fn, num_workers=args.num_workers,
+                                     pin_memory=True)
 
     # lr_backbone_names = ["backbone.0", "backbone.neck", "input_proj", "transformer.encoder"]
     def match_name_keywords(n, name_keywords):
@@ -288,12 +388,36 @@ def main(args):
                                       weight_decay=args.weight_decay)
     lr_scheduler = torch.optim.lr_scheduler.StepLR(optimizer, args.lr_drop)
 
+    # --bf16: track model と detector の forward だけ bf16 autocast (--device 上)、matcher は fp32 のまま
+    if args.bf16:
+        assert not args.fp16, '--bf16 and --fp16 are exclusive'
+        enable_bf16(model, yolo_model, criterion, device.type)
+    if args.checkpoint_modules and not args.eval:
+        for granularity, names in apply_activation_checkpointing(model, args.checkpoint_modules).items():
+            print('activation checkpointing {}: {} modules'.format(granularity, len(names)))
+
+    # --profile: 各ステージ (data / detector / track model / loss / backward / optimizer step) の時間とメモリを計測
+    profiler = StageProfiler(args.output_dir, enabled=args.profile, device=args.device,
+                             trace_iters=args.profile_trace, write=utils.is_main_process())
+    profiler.instrument_module(getattr(yolo_model, 'model', yolo_model), 'detector')
+    profiler.instrument_module(model, 'track_model')
+    profiler.instrument_module(criterion, 'loss')
+    profiler.instrument_optimizer(optimizer)
+    if not args.eval:
+        profiler.instrument_backward()
+    if args.eval:
+        profiler.instrument_module(postprocessors.get('bbox'), 'postprocess')
+        data_loader_val = profiler.wrap_loader(data_loader_val)
+    else:
+        data_loader_train = profiler.wrap_loader(data_loader_train)
+
     if args.distributed:
         print('---------- distribution ----------')
         #args.gpu = 2
         #print(args.gpu) 
         model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[args.gpu], find_unused_parameters=True)
         model_without_ddp = model.module
+    accumulator = None if args.eval else build_accumulator(args, model, optimizer, scaler)
 
     if args.dataset_file == "coco_panoptic":
         # We also evaluate AP during panoptic training, on original coco DS
@@ -347,60 +471,94 @@ def main(args):
 #             )
     
     if args.eval:
-        assert args.batch_size == 1, print("Now only support 1.")
-        tracker = Tracker(score_thresh=args.track_thresh)
+        if args.lockstep_videos > 1:
+            trackers = [build_tracker(args) for _ in range(args.lockstep_videos)]
+        else:
+            assert args.batch_size == 1, print("Now only support 1. Use --lockstep_videos to batch videos.")
+            tracker = build_tracker(args)
         #checkpoint_detr = torch.load(args.resume_detr, map_location='cpu')
         
         #print(checkpoint_detr['model'].keys())
         
-        yolo_model_eval = RTDETR('models/pretrain_rtdetr_q100.pt')
+        # 低スコアのクエリはtrack modelに入る前に落とす
+        yolo_model_eval = build_pruner(args, yolo_model)
         #yolo_model_eval.load_state_dict(checkpoint_detr['model'],strict=False)
-        # モデルにロードされたパラメータ数（学習可能パラメータのみカウント）
-        num_params = sum(p.numel() for p in yolo_model.parameters() if p.requires_grad_ == False)
+        # モデルにロードされたパラメータ数（固定パラメータを含む）
+        num_params = sum(p.numel() for p in yolo_model_eval.parameters())
         print('--------------------------------')
         print(f"DETR eval Params : {num_params}")
         print('--------------------------------')
 
         
         #print('DETR params = ',len(checkpoint_detr['model']))
+        for t in (trackers if args.lockstep_videos > 1 else [tracker]):
+            if args.bf16:
+                keep_fp32_tracker(t, device.type)
+            profiler.instrument_method(t, 'step', 'tracker')
             
-        test_stats, coco_evalu_ator, res_tracks = evaluate(model, yolo_model_eval, criterion, postprocessors, data_loader_val,
-                                                          base_ds, device, args.output_dir, tracker=tracker, 
-                                                          phase='eval', det_val=args.det_val, fp16=args.fp16)
+        if args.eval_workers > 1:
+            # 動画単位でローカルのプロセスプールに分配する
+            assert not args.distributed, '--eval_workers replaces the distributed launch'
+            res_tracks = evaluate_parallel(args, frame_index_val, args.eval_workers, args.eval_threads or None)
+        elif args.lockstep_videos > 1:
+            res_tracks = evaluate_lockstep(model, yolo_model_eval, postprocessors, data_loader_val, device,
+                                           trackers, fp16=args.fp16)
+        else:
+            test_stats, coco_evalu_ator, res_tracks = evaluate(model, yolo_model_eval, criterion, postprocessors, data_loader_val,
+                                                              base_ds, device, args.output_dir, tracker=tracker, 
+                                                              phase='eval', det_val=args.det_val, fp16=args.fp16)
+        profiler.end_epoch(args.start_epoch, phase='eval')
         if args.output_dir:
 #             utils.save_on_master(coco_evaluator.coco_eval["bbox"].eval, output_dir / "eval.pth")
             if res_tracks is not None:
                 print("Creating video index for {}.".format(args.dataset_file))
-                video_to_images = defaultdict(list)
-                video_names = defaultdict()
-                
-                coco = dataset_val.coco
-                img_idxs = sampler_val.indices[utils.get_rank()] if args.distributed else list(range(len(dataset_val)))
-                
-#                 for _, img_info in dataset_val.coco.imgs.items():
-                for i, idx in enumerate(img_idxs):
-                    img_id = dataset_val.ids[idx]
-                    img_info = coco.loadImgs(img_id)[0]
-                    
-                    video_id = img_info["video_id"]
-                    video_to_images[video_id].append({"image_id": img_info["id"], "frame_id": img_info["frame_id"]})
-                    video_name = img_info["file_name"].split("/")[0]
-                    if video_id not in video_names:
-                        video_names[video_id] = video_name
-                
+                img_idxs = sampler_val.indices[utils.get_rank()] if args.distributed else None
+                video_to_images, video_names = frame_index_val.group_by_video(img_idxs)
 
                 assert len(video_to_images) == len(video_names)
                 # save mot results.
-                save_track(res_tracks, args.output_dir, video_to_images, video_names, args.track_eval_split)
+                if args.track_format in ('mot', 'both'):
+                    save_track(res_tracks, args.output_dir, video_to_images, video_names, args.track_eval_split)
+                if args.track_format in ('npy', 'both'):
+                    save_track_arrays(res_tracks, args.output_dir, video_to_images, video_names, args.track_eval_split)
+                if args.kinematics:
+                    # 精子ごとの運動指標 (track idはMOTファイルと同じ)
+                    for video_id, images in video_to_images.items():
+                        kinematics = compute_kinematics(tracks_to_array(res_tracks, images), args.fps, args.um_per_px)
+                        save_kinematics_csv(kinematics, os.path.join(args.output_dir, args.track_eval_split,
+                                                                     '{}_kinematics.csv'.format(video_names[video_id])))
+
+        if args.eval_mot and res_tracks is not None:
+            # テキストファイルを経由せず res_tracks とGTから直接MOT指標を計算する
+            if args.distributed:
+                res_tracks = {k: v for part in utils.all_gather(res_tracks) for k, v in part.items()}
+            if utils.is_main_process():
+                video_to_images, video_names = frame_index_val.group_by_video()
+                sequences = collect_sequences(res_tracks, dataset_val.coco, video_to_images, video_names)
+                mot_summary = evaluate_mot(sequences, num_workers=args.mot_workers)
+                print('MOT metrics: ' + '  '.join('{} {:.4f}'.format(k, mot_summary['overall'][k])
+                                                   for k in ('HOTA', 'DetA', 'AssA', 'MOTA', 'IDF1')) +
+                      '  IDSW {}'.format(mot_summary['overall']['IDSW']))
+                if args.output_dir:
+                    write_summary(mot_summary, output_dir / 'mot_metrics.json')
 
         return
 
     print("--------------------Start training--------------------\n")
     #print(args.start_epoch)
     #print('epoch = ',epoch + 1)
+    checkpoint_writer = AsyncCheckpointWriter(keep_last=args.keep_checkpoints)
     start_time = time.time()
-     # ベストepochのためのloss_dictの定義
-    loss_list = []
+     # ベストepochのためのlossの履歴 (log.txtを読み直さずメモリ上で保持)
+    history = MetricsHistory(output_dir / "log.txt" if args.output_dir else None,
+                             write=utils.is_main_process())
+    if args.start_epoch > 0:
+        history.load()
+    # 学習曲線は別スレッドで追記分だけ描画する (master以外では何もしない)
+    plotter = LearningCurvePlotter(args.output_dir, interval=args.plot_interval,
+                                   enabled=utils.is_main_process())
+    for stats in history.records:
+        plotter.update(stats)
     
     #
     #for name, param in model.named_parameters():
@@ -409,7 +567,7 @@ def main(args):
             #print(f"Froze parameter: {name}")
             
     for epoch in tqdm(range(args.start_epoch, args.epochs)):
-        if args.distributed:
+        if hasattr(sampler_train, 'set_epoch'):
             sampler_train.set_epoch(epoch)
 
     
@@ -427,8 +585,12 @@ def main(args):
         
         
         #learning start 
-        train_stats = train_one_epoch(
-            model,yolo_model, criterion, data_loader_train, optimizer, device, scaler, epoch,new_weight_dict,args.clip_max_norm, fp16=args.fp16)
+        if accumulator is not None:
+            train_stats = train_one_epoch_accum(
+                accumulator, model, yolo_model, criterion, data_loader_train, device, epoch, new_weight_dict, fp16=args.fp16)
+        else:
+            train_stats = train_one_epoch(
+                model,yolo_model, criterion, data_loader_train, optimizer, device, scaler, epoch,new_weight_dict,args.clip_max_norm, fp16=args.fp16)
         
         lr_scheduler.step()
                 
@@ -436,16 +598,8 @@ def main(args):
                      'epoch': epoch,
                      'n_parameters': n_parameters}
         
-        if args.output_dir and utils.is_main_process():
-            with (output_dir / "log.txt").open("a") as f:
-                f.write(json.dumps(log_stats) + "\n")
-        
-        with open((output_dir / "log.txt"), 'r') as file:
-            lines = file.readlines()
-
-        json_txt = lines[len(lines)-1]
-        data = json.loads(json_txt)
-        loss_list.append(data['train_loss'])
+        history.append(log_stats)
+        plotter.update(log_stats)
         
         # Best Epoch save phase
         if args.output_dir:
@@ -460,14 +614,15 @@ def main(args):
                 checkpoint_paths.append(output_dir / f'checkpoint{args.epochs:02}.pth')
                 #checkpoint_detr_paths.append(output_dir / f'checkpoint_detr{args.epochs:02}.pth')
             
-            for checkpoint_path in checkpoint_paths:
-                utils.save_on_master({
+            # CPUにコピーしてから別スレッドで一度だけ書き込む (他のパスはハードリンク)
+            with profiler.span('checkpoint'):
+                checkpoint_writer.save({
                     'model': model_without_ddp.state_dict(),
                     'optimizer': optimizer.state_dict(),
                     'lr_scheduler': lr_scheduler.state_dict(),
                     'epoch': epoch,
                     'args': args,
-                }, checkpoint_path)
+                }, checkpoint_paths)
                 
             # DETR用の重み保存   
             """ 
@@ -481,11 +636,13 @@ def main(args):
                 }, checkpoint_path)
             """
         
-        #1エポックごとに学習曲線を保存
-        plot_combined_loss(args.output_dir)
-        plot_combined_unscaled_loss(args.output_dir)
-        #plot_unscaled_combined_loss(args.output_dir)
+        profiler.end_epoch(epoch)
         #1エポックここまで
+    checkpoint_writer.close()
+    plotter.close()
+    best = history.best('train_loss')
+    if best is not None:
+        print('best train_loss {:.4f} at epoch {}'.format(best[1], best[0]))
     total_time = time.time() - start_time
     total_time_str = str(datetime.timedelta(seconds=int(total_time)))
     print('\n ---------- Training time {} -----------'.format(total_time_str))
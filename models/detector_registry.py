@@ -0,0 +1,48 @@
+"""
+Lazily built, frozen RT-DETR detectors keyed by checkpoint path.
+
+Each phase only asks for the detector it runs (q500 for track training, q100
+for tracking eval), so a checkpoint is loaded and moved to the device at most
+once per process and the other one is never touched.
+"""
+import time
+
+TRAIN_DETECTOR = 'models/pretrain_rtdetr_q500.pt'
+EVAL_DETECTOR = 'models/pretrain_rtdetr_q100.pt'
+
+
+def _build_rtdetr(checkpoint):
+    from ultralytics import RTDETR
+    return RTDETR(checkpoint)
+
+
+class DetectorRegistry(object):
+    def __init__(self, device=None, builder=_build_rtdetr):
+        self.device = device
+        self.builder = builder
+        self.detectors = {}
+        self.load_times = {}
+
+    def get(self, checkpoint):
+        if checkpoint not in self.detectors:
+            start = time.perf_counter()
+            detector = self.builder(checkpoint)
+            if self.device is not None:
+                detector.to(self.device)
+            for param in detector.parameters():
+                param.requires_grad = False
+            self.detectors[checkpoint] = detector
+            self.load_times[checkpoint] = time.perf_counter() - start
+        return self.detectors[checkpoint]
+
+    def release(self, checkpoint):
+        self.detectors.pop(checkpoint, None)
+
+    def __contains__(self, checkpoint):
+        return checkpoint in self.detectors
+
+
+def detector_for_phase(args):
+    if getattr(args, 'det_checkpoint', ''):
+        return args.det_checkpoint
+    return EVAL_DETECTOR if args.eval else TRAIN_DETECTOR
@@ -0,0 +1,98 @@
+"""
+TorchScript export of the track-test model for CPU inference.
+
+The track-test model, the frozen detector and the bbox postprocessor are
+traced together into two graphs, one for the first frame of a video (no
+previous-frame embedding) and one for the following frames:
+
+    track_init.pt   (image, orig_size)              -> (scores, labels, boxes, *pre_embed)
+    track_step.pt   (image, orig_size, *pre_embed)  -> (scores, labels, boxes, track_boxes, *pre_embed)
+
+The previous-frame embedding is flattened to a list of tensors. Traced graphs
+have the input size baked in, so every frame is resized to the size recorded
+in ``export.json``. The exported directory is loaded by track_runtime.py.
+
+export_track.py adds its parity check against the eager model to
+``export.json``; track_runtime refuses an export whose check failed.
+"""
+import json
+from pathlib import Path
+
+import torch
+from torch import nn
+from torch.utils._pytree import tree_flatten, tree_unflatten
+
+from util.misc import nested_tensor_from_tensor_list
+
+# deformable attention samples at these offsets, int8 errors move the sampling points
+DEFAULT_QUANT_SKIP = ('sampling_offsets', 'reference_points')
+
+
+def quantize_linear(model, skip=DEFAULT_QUANT_SKIP):
+    """Dynamic int8 quantization of the nn.Linear layers whose name contains none of ``skip``.
+
+    Returns a quantized copy, ``model`` itself is left in fp32.
+    """
+    names = {name for name, m in model.named_modules()
+             if isinstance(m, nn.Linear) and not any(s in name for s in skip)}
+    return torch.ao.quantization.quantize_dynamic(model, names, dtype=torch.qint8)
+
+
+class TrackExportWrapper(nn.Module):
+    """Tensor-only interface of track-test model + detector + postprocessor, for tracing."""
+    def __init__(self, model, det_model, postprocess):
+        super(TrackExportWrapper, self).__init__()
+        self.model = model
+        self.det_model = det_model
+        self.postprocess = postprocess
+        self.embed_spec = None
+
+    def forward(self, image, orig_size, *pre_embed_flat):
+        samples = nested_tensor_from_tensor_list([image[0]])
+        pre_embed = tree_unflatten(list(pre_embed_flat), self.embed_spec) if pre_embed_flat else None
+        outputs, pre_embed = self.model(samples, pre_embed, self.det_model)
+        result = self.postprocess(outputs, orig_size)[0]
+        out = [result['scores'], result['labels'], result['boxes']]
+        if pre_embed_flat:
+            out.append(result['track_boxes'])
+        flat, self.embed_spec = tree_flatten(pre_embed)
+        return tuple(out) + tuple(flat)
+
+
+def export_track_model(model, det_model, postprocess, examples, out_dir, mean, std,
+                       quantize=True, quant_skip=DEFAULT_QUANT_SKIP):
+    """Trace and save both graphs. ``examples`` are two consecutive ``(image, orig_size)`` pairs."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    model = model.eval()
+    if quantize:
+        model = quantize_linear(model, quant_skip)
+    wrapper = TrackExportWrapper(model, det_model, postprocess).eval()
+
+    (image0, size0), (image1, size1) = examples
+    with torch.no_grad():
+        first = wrapper(image0, size0)
+        pre_embed = first[3:]
+        init = torch.jit.trace(wrapper, (image0, size0), strict=False, check_trace=False)
+        step = torch.jit.trace(wrapper, (image1, size1) + tuple(pre_embed), strict=False, check_trace=False)
+    init = torch.jit.freeze(init.eval()) if not quantize else init
+    step = torch.jit.freeze(step.eval()) if not quantize else step
+    init.save(str(out_dir / 'track_init.pt'))
+    step.save(str(out_dir / 'track_step.pt'))
+
+    meta = {
+        'input_size': list(image0.shape[-2:]),
+        'mean': list(mean),
+        'std': list(std),
+        'num_pre_embed': len(pre_embed),
+        'quantized': bool(quantize),
+        'quant_skip': list(quant_skip) if quantize else [],
+        'torch': torch.__version__,
+    }
+    write_export_meta(out_dir, meta)
+    return meta
+
+
+def write_export_meta(out_dir, meta):
+    with (Path(out_dir) / 'export.json').open('w') as f:
+        json.dump(meta, f, indent=2)
@@ -0,0 +1,123 @@
+"""
+Top-k / score gating of the frozen detector's queries before the track model.
+
+With 500 queries and a 0.4 track threshold most detector queries per frame
+are background, yet each of them goes through the re-ID head and the tracking
+decoder. QueryPruner sits between the detector and the track-test model and
+keeps only the best-scoring queries. Because a batch must keep one query
+count, the kept count per batch is the largest number of queries above
+``score_thresh`` in any image, clamped to ``[min_keep, topk]``.
+"""
+import warnings
+
+import torch
+
+
+def _query_scores(outputs):
+    logits = outputs['pred_logits']
+    return logits.sigmoid().max(-1)[0]
+
+
+def num_queries_to_keep(scores, topk=None, score_thresh=None, min_keep=1):
+    num_queries = scores.shape[1]
+    keep = num_queries if topk is None or topk <= 0 else min(topk, num_queries)
+    if score_thresh is not None:
+        above = int((scores >= score_thresh).sum(1).max())
+        keep = min(keep, max(above, min_keep))
+    return max(min(keep, num_queries), 1)
+
+
+def prune_queries(outputs, topk=None, score_thresh=None, min_keep=1):
+    """Keep the highest scoring queries of DETR-style outputs (tensors shaped ``[B, Q, ...]``)."""
+    scores = _query_scores(outputs)
+    B, Q = scores.shape
+    keep = num_queries_to_keep(scores, topk, score_thresh, min_keep)
+    if keep == Q:
+        return outputs
+    # keep the original query order among the survivors
+    idx = scores.topk(keep, dim=1)[1].sort(dim=1)[0]
+
+    def gather(v):
+        if torch.is_tensor(v) and v.dim() >= 2 and v.shape[:2] == (B, Q):
+            return v.gather(1, idx.view(B, keep, *([1] * (v.dim() - 2))).expand(B, keep, *v.shape[2:]))
+        if isinstance(v, dict):
+            return {k: gather(x) for k, x in v.items()}
+        if isinstance(v, (list, tuple)):
+            return type(v)(gather(x) for x in v)
+        return v
+    return gather(outputs)
+
+
+def prune_results(results, topk=None, score_thresh=None, min_keep=1):
+    """Same for a list of ultralytics ``Results`` (boxes can differ per image there)."""
+    pruned = []
+    for res in results:
+        conf = res.boxes.conf
+        keep = conf.numel() if topk is None or topk <= 0 else min(topk, conf.numel())
+        if score_thresh is not None:
+            keep = min(keep, max(int((conf >= score_thresh).sum()), min_keep))
+        pruned.append(res[conf.topk(keep)[1].sort()[0]] if keep < conf.numel() else res)
+    return pruned
+
+
+class QueryPruner(object):
+    """Wraps the frozen detector so every call returns pruned outputs.
+
+    Only calling the pruner itself and ``predict`` prune. Any other attribute is
+    forwarded to the detector unchanged, so e.g. ``pruner.model(images)`` runs the
+    underlying network and returns all of its queries.
+    """
+    def __init__(self, detector, topk=None, score_thresh=None, min_keep=1):
+        self.detector = detector
+        self.topk = topk
+        self.score_thresh = score_thresh
+        self.min_keep = min_keep
+        # per-image query counts before / after pruning, for reporting
+        self.queries_in = 0
+        self.queries_kept = 0
+        self.images = 0
+        self._warned = False
+
+    def __getattr__(self, name):
+        if name == 'detector':
+            raise AttributeError(name)
+        return getattr(self.detector, name)
+
+    def _prune(self, outputs):
+        if isinstance(outputs, dict) and 'pred_logits' in outputs:
+            pruned = prune_queries(outputs, self.topk, self.score_thresh, self.min_keep)
+            B, Q = outputs['pred_logits'].shape[:2]
+            self._count(B, B * Q, B * pruned['pred_logits'].shape[1])
+            return pruned
+        if isinstance(outputs, (list, tuple)) and outputs and hasattr(outputs[0], 'boxes'):
+            pruned = prune_results(outputs, self.topk, self.score_thresh, self.min_keep)
+            self._count(len(outputs), sum(len(r.boxes) for r in outputs), sum(len(r.boxes) for r in pruned))
+            return pruned
+        if not self._warned and not (isinstance(outputs, (list, tuple)) and not outputs):
+            warnings.warn('QueryPruner cannot prune detector outputs of type {}, they are passed through '
+                          'unpruned'.format(type(outputs).__name__))
+            self._warned = True
+        return outputs
+
+    def _count(self, images, queries_in, queries_kept):
+        self.images += images
+        self.queries_in += queries_in
+        self.queries_kept += queries_kept
+
+    def kept_fraction(self):
+        return self.queries_kept / self.queries_in if self.queries_in else 1.0
+
+    def __call__(self, *args, **kwargs):
+        return self._prune(self.detector(*args, **kwargs))
+
+    def predict(self, *args, **kwargs):
+        return self._prune(self.detector.predict(*args, **kwargs))
+
+
+def build_pruner(args, detector):
+    """Wrap ``detector`` according to --prune_topk / --prune_score, unchanged if both are off."""
+    topk = getattr(args, 'prune_topk', 0)
+    score_thresh = getattr(args, 'prune_score', None)
+    if topk <= 0 and score_thresh is None:
+        return detector
+    return QueryPruner(detector, topk=topk, score_thresh=score_thresh, min_keep=args.prune_min_keep)
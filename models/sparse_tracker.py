@@ -0,0 +1,12 @@
+"""
+SparseTracker for the training / evaluation code, see track_assoc.py.
+"""
+from track_assoc import SparseTracker, pairwise_giou, sparse_associate
+
+from .tracker import Tracker
+
+
+def build_tracker(args):
+    if getattr(args, 'sparse_assoc', False):
+        return SparseTracker(score_thresh=args.track_thresh, radius=args.assoc_radius)
+    return Tracker(score_thresh=args.track_thresh)
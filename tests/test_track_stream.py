@@ -0,0 +1,53 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+class _Init(torch.nn.Module):
+    def forward(self, image, orig_size):
+        boxes = torch.tensor([[10.0, 10.0, 30.0, 30.0], [50.0, 50.0, 70.0, 70.0]])
+        return torch.tensor([0.9, 0.8]), torch.zeros(2, dtype=torch.int64), boxes, image.mean().reshape(1)
+
+
+class _Step(torch.nn.Module):
+    def forward(self, image, orig_size, pre_embed):
+        boxes = torch.tensor([[12.0, 11.0, 32.0, 31.0], [52.0, 49.0, 72.0, 69.0]])
+        return torch.tensor([0.9, 0.8]), torch.zeros(2, dtype=torch.int64), boxes, boxes, pre_embed
+
+
+def _fake_export(out_dir):
+    out_dir.mkdir()
+    torch.jit.script(_Init()).save(str(out_dir / 'track_init.pt'))
+    torch.jit.script(_Step()).save(str(out_dir / 'track_step.pt'))
+    meta = {'input_size': [32, 32], 'mean': [0.5] * 3, 'std': [0.25] * 3, 'num_pre_embed': 1}
+    (out_dir / 'export.json').write_text(json.dumps(meta))
+
+
+def test_exported_stream_does_not_import_models(tmp_path):
+    _fake_export(tmp_path / 'export')
+    frames = tmp_path / 'frames'
+    frames.mkdir()
+    for i in range(1, 4):
+        Image.fromarray(np.full((32, 32, 3), 40 * i, dtype=np.uint8)).save(frames / 'v_frame_{}.png'.format(i))
+    out = tmp_path / 'tracks.txt'
+
+    script = (
+        "import runpy, sys\n"
+        "sys.argv = ['track_stream.py', '--exported', sys.argv[1], '--source', sys.argv[2],\n"
+        "            '--stream_out', sys.argv[3], '--stream_timeout', '0.2', '--sparse_assoc']\n"
+        "runpy.run_path('track_stream.py', run_name='__main__')\n"
+        "assert 'models' not in sys.modules, sorted(m for m in sys.modules if m.startswith('models'))\n"
+    )
+    subprocess.run([sys.executable, '-c', script, str(tmp_path / 'export'), str(frames), str(out)],
+                   cwd=str(ROOT), check=True)
+
+    rows = [line.split(',') for line in out.read_text().splitlines()]
+    assert [int(r[0]) for r in rows] == [1, 1, 2, 2, 3, 3]
+    assert {int(r[1]) for r in rows} == {1, 2}
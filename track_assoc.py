@@ -0,0 +1,183 @@
+"""
+Tracker with spatially indexed association for dense sperm fields.
+
+This module only needs numpy and scipy, so the streaming runtime
+(track_stream.py --exported) can track without importing the ``models``
+package; models/sparse_tracker.py re-exports it for the training code.
+
+The default Tracker builds the full detections x tracks GIoU cost matrix and
+runs one Hungarian assignment over it, which grows quadratically with the
+number of sperm in the field. SparseTracker only considers pairs whose box
+centres are within ``radius`` pixels (the largest plausible motion between
+two frames), found with a KD-tree. It splits the resulting bipartite graph
+into connected components and solves a small assignment per component.
+
+Pairs further apart than ``radius`` can never be matched. Inside the radius
+the matching is the same as the dense one, including the rejection of pairs
+with a GIoU cost above ``max_cost``. With ``radius=None`` every pair is a
+candidate, which is the dense Tracker's association.
+"""
+import copy
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+
+def pairwise_giou(boxes1, boxes2):
+    """GIoU of row-aligned x1y1x2y2 boxes."""
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    lt = np.maximum(boxes1[:, :2], boxes2[:, :2])
+    rb = np.minimum(boxes1[:, 2:], boxes2[:, 2:])
+    wh = np.clip(rb - lt, 0, None)
+    inter = wh[:, 0] * wh[:, 1]
+    union = area1 + area2 - inter
+    iou = inter / np.maximum(union, 1e-7)
+    lt = np.minimum(boxes1[:, :2], boxes2[:, :2])
+    rb = np.maximum(boxes1[:, 2:], boxes2[:, 2:])
+    wh = np.clip(rb - lt, 0, None)
+    hull = wh[:, 0] * wh[:, 1]
+    return iou - (hull - union) / np.maximum(hull, 1e-7)
+
+
+def sparse_associate(det_boxes, track_boxes, radius, max_cost=1.2):
+    """Match detections to tracks using only pairs with centres within ``radius`` (all pairs if None).
+
+    Returns ``(matches, unmatched_dets, unmatched_tracks)`` with ``matches`` a list
+    of ``(det_idx, track_idx)``.
+    """
+    N, M = len(det_boxes), len(track_boxes)
+    if N == 0 or M == 0:
+        return [], list(range(N)), list(range(M))
+
+    if radius is None:
+        di, ti = np.divmod(np.arange(N * M, dtype=np.int64), M)
+    else:
+        det_ctr = (det_boxes[:, :2] + det_boxes[:, 2:]) / 2
+        track_ctr = (track_boxes[:, :2] + track_boxes[:, 2:]) / 2
+        pairs = cKDTree(det_ctr).sparse_distance_matrix(cKDTree(track_ctr), radius, output_type='ndarray')
+        di = pairs['i'].astype(np.int64)
+        ti = pairs['j'].astype(np.int64)
+
+    cost = 1.0 - pairwise_giou(det_boxes[di], track_boxes[ti])
+    matched_d = np.zeros(N, dtype=bool)
+    matched_t = np.zeros(M, dtype=bool)
+    matches = []
+    if len(di) > 0:
+        # nodes 0..N-1 are detections, N..N+M-1 tracks
+        graph = coo_matrix((np.ones(len(di)), (di, ti + N)), shape=(N + M, N + M))
+        _, labels = connected_components(graph, directed=False)
+        comp = labels[di]
+        edges_per_comp = np.bincount(comp)
+        # an isolated pair is matched directly, no assignment needed
+        single = edges_per_comp[comp] == 1
+        ok = single & (cost <= max_cost)
+        matches.extend(zip(di[ok].tolist(), ti[ok].tolist()))
+        matched_d[di[ok]] = True
+        matched_t[ti[ok]] = True
+
+        multi = np.flatnonzero(~single)
+        order = multi[np.argsort(comp[multi], kind='stable')]
+        bounds = np.flatnonzero(np.diff(comp[order])) + 1
+        for edges in np.split(order, bounds) if len(order) else []:
+            dets, d_inv = np.unique(di[edges], return_inverse=True)
+            trks, t_inv = np.unique(ti[edges], return_inverse=True)
+            sub = np.full((len(dets), len(trks)), 1e6)
+            sub[d_inv, t_inv] = cost[edges]
+            rows, cols = linear_sum_assignment(sub)
+            for r, c in zip(rows, cols):
+                if sub[r, c] <= max_cost:
+                    matches.append((int(dets[r]), int(trks[c])))
+                    matched_d[dets[r]] = True
+                    matched_t[trks[c]] = True
+
+    unmatched_dets = np.flatnonzero(~matched_d).tolist()
+    unmatched_tracks = np.flatnonzero(~matched_t).tolist()
+    return matches, unmatched_dets, unmatched_tracks
+
+
+class SparseTracker(object):
+    """Same interface and track dicts as models.tracker.Tracker (``init_track``, ``step``, ``reset_all``)."""
+    def __init__(self, score_thresh, radius=64.0, max_cost=1.2, max_age=32):
+        self.score_thresh = score_thresh
+        self.radius = radius
+        self.max_cost = max_cost
+        self.max_age = max_age
+        self.reset_all()
+
+    def reset_all(self):
+        self.id_count = 0
+        self.tracks_dict = dict()
+        self.tracks = list()
+        self.unmatched_tracks = list()
+
+    def init_track(self, results):
+        scores = results["scores"].detach().cpu().numpy()
+        bboxes = results["boxes"].detach().cpu().numpy()  # x1y1x2y2
+        ret = list()
+        ret_dict = dict()
+        for idx in np.flatnonzero(scores >= self.score_thresh).tolist():
+            self.id_count += 1
+            obj = {"score": float(scores[idx]), "bbox": bboxes[idx, :].tolist(), "tracking_id": self.id_count,
+                   "active": 1, "age": 1}
+            ret.append(obj)
+            ret_dict[idx] = obj
+        self.tracks = ret
+        self.tracks_dict = ret_dict
+        return copy.deepcopy(ret)
+
+    def step(self, output_results):
+        scores = output_results["scores"].detach().cpu().numpy()
+        bboxes = output_results["boxes"].detach().cpu().numpy()  # x1y1x2y2
+        track_bboxes = output_results.get("track_boxes", None)
+        if track_bboxes is not None:
+            track_bboxes = track_bboxes.detach().cpu().numpy()
+            # move the tracks of the previous frame to their predicted boxes
+            for idx, track in self.tracks_dict.items():
+                track["bbox"] = track_bboxes[idx, :].tolist()
+
+        keep = np.flatnonzero(scores >= self.score_thresh)
+        results = [{"score": float(scores[idx]), "bbox": bboxes[idx, :].tolist()} for idx in keep]
+        results_dict = dict(zip(keep.tolist(), results))
+
+        tracks = [v for v in self.tracks_dict.values()] + self.unmatched_tracks
+        det_box = bboxes[keep].astype(np.float64).reshape(-1, 4)
+        track_box = np.asarray([t['bbox'] for t in tracks], dtype=np.float64).reshape(-1, 4)
+        matches, unmatched_dets, unmatched_tracks = sparse_associate(det_box, track_box, self.radius, self.max_cost)
+
+        ret = list()
+        for m0, m1 in matches:
+            track = results[m0]
+            track['tracking_id'] = tracks[m1]['tracking_id']
+            track['age'] = 1
+            track['active'] = 1
+            ret.append(track)
+        for i in unmatched_dets:
+            track = results[i]
+            self.id_count += 1
+            track['tracking_id'] = self.id_count
+            track['age'] = 1
+            track['active'] = 1
+            ret.append(track)
+        ret_unmatched_tracks = []
+        for i in unmatched_tracks:
+            track = tracks[i]
+            if track['age'] < self.max_age:
+                track['age'] += 1
+                track['active'] = 0
+                ret.append(track)
+                ret_unmatched_tracks.append(track)
+
+        self.tracks = ret
+        self.tracks_dict = {idx: det for idx, det in results_dict.items() if 'tracking_id' in det}
+        self.unmatched_tracks = ret_unmatched_tracks
+        return copy.deepcopy(ret)
+
+
+def build_stream_tracker(args):
+    """Tracker for --exported streaming: sparse with --sparse_assoc, otherwise the dense association."""
+    radius = args.assoc_radius if getattr(args, 'sparse_assoc', False) else None
+    return SparseTracker(score_thresh=args.track_thresh, radius=radius)
@@ -0,0 +1,157 @@
+"""
+CPU inference with a track-test model exported by export_track.py.
+
+Needs only torch and numpy: the model, the detector and the postprocessor
+are in the TorchScript graphs, so neither the training code nor ultralytics
+is imported. The results have the format the Tracker expects (``scores``,
+``labels``, ``boxes`` and from the second frame on ``track_boxes``).
+
+    model = ExportedTrackModel('exports/int8', num_threads=4)
+    for frame in frames:                # RGB HxWx3 uint8 arrays or PIL images
+        results = model(frame)
+    model.reset()                       # before the next video
+"""
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def preprocess_frame(frame, input_size, mean, std):
+    """RGB HxWx3 uint8 frame -> ``(image [1, 3, H, W], orig_size [1, 2])`` at ``input_size``."""
+    frame = np.asarray(frame)
+    if not frame.flags.writeable:
+        # arrays viewing a PIL image are read-only
+        frame = frame.copy()
+    h, w = frame.shape[:2]
+    image = torch.from_numpy(np.ascontiguousarray(frame)).permute(2, 0, 1)[None].float().div_(255)
+    if tuple(image.shape[-2:]) != tuple(input_size):
+        image = F.interpolate(image, size=tuple(input_size), mode='bilinear', align_corners=False, antialias=True)
+    image = (image - torch.as_tensor(mean).view(1, 3, 1, 1)) / torch.as_tensor(std).view(1, 3, 1, 1)
+    return image, torch.as_tensor([[h, w]])
+
+
+def load_frames(path, limit=None, suffixes=('.png', '.jpg', '.jpeg', '.tif')):
+    """The first ``limit`` image files of a directory, in name order, as RGB arrays."""
+    from PIL import Image
+
+    files = sorted(p for p in Path(path).iterdir() if p.suffix.lower() in suffixes)[:limit]
+    frames = []
+    for p in files:
+        with Image.open(p) as img:
+            frames.append(np.asarray(img.convert('RGB')))
+    return frames
+
+
+class ExportedTrackModel(object):
+    def __init__(self, artifact_dir, num_threads=None):
+        artifact_dir = Path(artifact_dir)
+        with (artifact_dir / 'export.json').open('r') as f:
+            self.meta = json.load(f)
+        parity = self.meta.get('parity')
+        if parity is not None and not parity['passed']:
+            raise ValueError('{} failed the parity check of export_track.py (agreement {:.3f} < {})'.format(
+                artifact_dir, parity['agreement'], parity['min_agreement']))
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.init_graph = torch.jit.load(str(artifact_dir / 'track_init.pt'), map_location='cpu').eval()
+        self.step_graph = torch.jit.load(str(artifact_dir / 'track_step.pt'), map_location='cpu').eval()
+        self.input_size = tuple(self.meta['input_size'])
+        self.mean = self.meta['mean']
+        self.std = self.meta['std']
+        self.reset()
+
+    def reset(self):
+        """Start a new video; the next frame goes through the first-frame graph."""
+        self.pre_embed = None
+
+    def preprocess(self, frame):
+        return preprocess_frame(frame, self.input_size, self.mean, self.std)
+
+    @torch.no_grad()
+    def __call__(self, frame):
+        image, orig_size = self.preprocess(frame)
+        if self.pre_embed is None:
+            out = self.init_graph(image, orig_size)
+            results = {'scores': out[0], 'labels': out[1], 'boxes': out[2]}
+            self.pre_embed = tuple(out[3:])
+        else:
+            out = self.step_graph(image, orig_size, *self.pre_embed)
+            results = {'scores': out[0], 'labels': out[1], 'boxes': out[2], 'track_boxes': out[3]}
+            self.pre_embed = tuple(out[4:])
+        return results
+
+
+def frames_from_capture(capture):
+    """RGB frames from an opened ``cv2.VideoCapture`` until it runs dry."""
+    import cv2
+
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+def frames_from_directory(path, poll_interval=0.5, suffixes=('.png', '.jpg', '.jpeg', '.tif'), stop_after=None,
+                          max_retries=20):
+    """RGB frames from image files as they appear in ``path``, in frame number order.
+
+    Files are ordered with ``frame_key`` (numbers compared as numbers, so the unpadded
+    VISEM ``<video>_frame_<n>.jpg`` names work) and every file is read once, whenever
+    it appears. The directory is only listed again when its modification time changes.
+    A file that cannot be decoded yet (still being written) is retried on the next
+    polls and skipped with a warning after ``max_retries`` of them. Stops after
+    ``stop_after`` seconds without a new frame (never, if None).
+    """
+    import os
+    import sys
+
+    from PIL import Image
+
+    from track_tools.convert_visem import frame_key
+
+    seen = set()
+    pending = []
+    retries = 0
+    dir_mtime = None
+    racy = True
+    last_new = time.time()
+    while True:
+        mtime = os.stat(path).st_mtime_ns
+        if mtime != dir_mtime or racy:
+            with os.scandir(path) as entries:
+                new = [e.name for e in entries
+                       if e.name not in seen and os.path.splitext(e.name)[1].lower() in suffixes]
+            # a file created in the same mtime tick as this listing does not change
+            # the directory mtime again, so list once more while the change is recent
+            racy = time.time_ns() - mtime < 2 * 10 ** 9
+            dir_mtime = mtime
+            seen.update(new)
+            pending = sorted(pending + new, key=frame_key)
+
+        got_new = False
+        while pending:
+            try:
+                with Image.open(os.path.join(path, pending[0])) as img:
+                    frame = img.convert('RGB')
+            except OSError as e:
+                retries += 1
+                if retries <= max_retries:
+                    break
+                print('skipping unreadable frame {}: {}'.format(pending[0], e), file=sys.stderr)
+            else:
+                yield frame
+                got_new = True
+            pending.pop(0)
+            retries = 0
+
+        if got_new:
+            last_new = time.time()
+        elif stop_after is not None and time.time() - last_new > stop_after:
+            break
+        else:
+            time.sleep(poll_interval)
@@ -0,0 +1,120 @@
+"""
+Online tracking of a live microscope feed.
+
+    python track_stream.py --resume exps/checkpoint.pth --source 0
+    python track_stream.py --resume exps/checkpoint.pth --source /data/incoming --stream_out tracks.txt
+    python track_stream.py --exported exports/int8 --source /data/incoming
+
+--source is a camera index, a video file or a directory that new frames are
+written into. Every tracked frame is written out in MOT format right away.
+With --exported the TorchScript model written by export_track.py is used
+instead of the checkpoint, and main_track / the model and detector code are
+not imported; only the tracker options below are accepted then and tracking
+uses track_assoc.py.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import torch
+
+from track_assoc import build_stream_tracker
+from track_runtime import ExportedTrackModel, frames_from_capture, frames_from_directory
+from util.kinematics import StreamingKinematics, save_kinematics_csv
+
+
+def open_source(args):
+    if Path(args.source).is_dir():
+        return frames_from_directory(args.source, stop_after=args.stream_timeout)
+    import cv2
+    source = int(args.source) if args.source.isdigit() else args.source
+    return frames_from_capture(cv2.VideoCapture(source))
+
+
+def track_exported(runtime, tracker, frames):
+    """Same as StreamingTracker.track with a model exported by export_track.py."""
+    tracker.reset_all()
+    runtime.reset()
+    for frame_id, frame in enumerate(frames, 1):
+        results = runtime(frame)
+        yield frame_id, tracker.init_track(results) if frame_id == 1 else tracker.step(results)
+
+
+def main(args):
+    if args.exported:
+        tracker = build_stream_tracker(args)
+        stream = track_exported(ExportedTrackModel(args.exported), tracker, open_source(args))
+    else:
+        from engine_track_online import StreamingTracker
+        from models import build_tracktest_model
+        from models.detector_registry import DetectorRegistry, detector_for_phase
+        from models.query_pruning import build_pruner
+        from models.sparse_tracker import build_tracker
+        from util.precision import enable_bf16, keep_fp32_tracker
+
+        tracker = build_tracker(args)
+        device = torch.device(args.device)
+        model, _, postprocessors = build_tracktest_model(args)
+        checkpoint = torch.load(args.resume, map_location='cpu')
+        missing_keys, _ = model.load_state_dict(checkpoint['model'], strict=False)
+        if len(missing_keys) > 0:
+            print('Missing Keys: {}'.format(missing_keys), file=sys.stderr)
+        model.to(device)
+
+        det_model = build_pruner(args, DetectorRegistry(device).get(detector_for_phase(args)))
+        if args.bf16:
+            enable_bf16(model, det_model, device_type=device.type)
+            keep_fp32_tracker(tracker, device.type)
+        streamer = StreamingTracker(model, det_model, postprocessors, tracker, device, fp16=args.fp16)
+        stream = streamer.track(open_source(args))
+
+    kinematics = StreamingKinematics(args.fps, args.um_per_px) if args.kinematics_out else None
+    out = open(args.stream_out, 'w') if args.stream_out else sys.stdout
+    try:
+        for frame_id, tracks in stream:
+            if kinematics is not None:
+                kinematics.update(frame_id, tracks)
+            for t in tracks:
+                if t['active'] > 0:
+                    x1, y1, x2, y2 = t['bbox']
+                    out.write("{},{},{:.2f},{:.2f},{:.2f},{:.2f},{:.3f},-1,-1,-1\n".format(
+                        frame_id, t['tracking_id'], x1, y1, x2 - x1, y2 - y1, t['score']))
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if kinematics is not None:
+            save_kinematics_csv(kinematics.summary(), args.kinematics_out)
+
+
+def get_exported_args_parser():
+    """The main_track options used with --exported (tracker and kinematics), same defaults."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--track_thresh', default=0.4, type=float)
+    parser.add_argument('--sparse_assoc', default=False, action='store_true',
+                        help='associate only detections/tracks within --assoc_radius (KD-tree, per component)')
+    parser.add_argument('--assoc_radius', default=64.0, type=float, help='max centre motion per frame in pixels')
+    parser.add_argument('--fps', default=50.0, type=float, help='frame rate of the recordings')
+    parser.add_argument('--um_per_px', default=1.0, type=float, help='pixel size in um')
+    return parser
+
+
+if __name__ == '__main__':
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument('--exported', default='')
+    if pre_parser.parse_known_args()[0].exported:
+        parents = [get_exported_args_parser()]
+    else:
+        from main_track import get_args_parser
+        parents = [get_args_parser()]
+    parser = argparse.ArgumentParser('HDE-Track online tracking', parents=parents)
+    parser.add_argument('--source', required=True, help='camera index, video file or frame directory')
+    parser.add_argument('--stream_out', default='', help='MOT text output, stdout if empty')
+    parser.add_argument('--stream_timeout', default=None, type=float,
+                        help='stop a directory source after this many seconds without a new frame')
+    parser.add_argument('--exported', default='', help='directory written by export_track.py, replaces --resume')
+    parser.add_argument('--kinematics_out', default='',
+                        help='CSV of per-sperm CASA kinematics (uses --fps / --um_per_px), written when the stream ends')
+    args = parser.parse_args()
+    args.eval = True
+    main(args)
@@ -0,0 +1,197 @@
+"""
+Convert VISEM-Tracking ground truth to MOT text and COCO json in one pass.
+
+Replaces annotation_visem.ipynb. Every ``gt/gt.txt`` line gets its last three
+fields (conf, class, visibility) set to 1, as the notebook did, so that all
+sperm pass the MOT-style filters. Expected layout:
+
+    <data_root>/<split>/<video>/img1/*.jpg
+    <data_root>/<split>/<video>/gt/gt.txt
+
+Outputs:
+
+    <mot_root>/<split>/<video>/gt/gt.txt        rewritten ground truth
+    <mot_root>/<split>/<video>/gt/gt.npz        parsed boxes + frame info, reused when skipping
+    <data_root>/annotations/<split>.json        COCO json for build_dataset
+
+Videos are converted in a process pool. Each input file is streamed once
+through a single buffered writer, and the COCO annotations are collected in
+the same pass. A video is skipped when its outputs are newer than its
+gt.txt and img1 directory; its COCO entries then come from gt.npz.
+
+    python track_tools/convert_visem.py --data_root ./visem --splits train test
+"""
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+
+
+def change_line(line):
+    values = line.rstrip('\r\n').split(',')
+    for i in range(-3, 0):
+        values[i] = '1'
+    return ','.join(values)
+
+
+def frame_key(name):
+    # VISEM frames are <video>_frame_<n>.jpg with unpadded n, so compare the numbers
+    return [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', name)]
+
+
+def _mtime(path):
+    return os.stat(path).st_mtime_ns
+
+
+def is_up_to_date(task):
+    src_times = [_mtime(task['gt']), _mtime(task['img_dir'])]
+    try:
+        out_times = [_mtime(task['out_txt']), _mtime(task['out_npz'])]
+    except FileNotFoundError:
+        return False
+    return min(out_times) > max(src_times)
+
+
+def convert_video(task, force=False):
+    """Rewrite one video's gt.txt and return its frame list and annotation arrays."""
+    if not force and is_up_to_date(task):
+        with np.load(task['out_npz']) as data:
+            return dict(task, skipped=True, **{k: data[k] for k in data.files})
+
+    images = sorted((f for f in os.listdir(task['img_dir']) if f.lower().endswith(IMAGE_SUFFIXES)), key=frame_key)
+    if images:
+        # all frames of a recording have the same size, the header of the first is enough
+        with Image.open(os.path.join(task['img_dir'], images[0])) as img:
+            width, height = img.size
+    else:
+        width = height = 0
+
+    frames, track_ids, boxes = [], [], []
+    os.makedirs(os.path.dirname(task['out_txt']), exist_ok=True)
+    tmp_txt = task['out_txt'] + '.tmp'
+    with open(task['gt'], 'r') as src, open(tmp_txt, 'w', buffering=1 << 20) as dst:
+        for line in src:
+            if not line.strip():
+                continue
+            new_line = change_line(line)
+            dst.write(new_line + '\n')
+            values = new_line.split(',')
+            frames.append(int(float(values[0])))
+            track_ids.append(int(float(values[1])))
+            boxes.append([float(v) for v in values[2:6]])
+    os.replace(tmp_txt, task['out_txt'])
+
+    result = {
+        'images': np.asarray(images, dtype=str),
+        'size': np.asarray([height, width], dtype=np.int64),
+        'frame': np.asarray(frames, dtype=np.int64),
+        'track_id': np.asarray(track_ids, dtype=np.int64),
+        'bbox': np.asarray(boxes, dtype=np.float64).reshape(-1, 4),
+    }
+    tmp_npz = task['out_npz'] + '.tmp.npz'
+    np.savez(tmp_npz, **result)
+    os.replace(tmp_npz, task['out_npz'])
+    return dict(task, skipped=False, **result)
+
+
+def build_coco(videos):
+    """COCO json in the layout of TransTrack's convert_mot_to_coco (whole videos)."""
+    out = {'images': [], 'annotations': [], 'categories': [{'id': 1, 'name': 'sperm'}], 'videos': []}
+    image_cnt = 0
+    ann_cnt = 0
+    for video_cnt, video in enumerate(videos, 1):
+        seq = video['video']
+        out['videos'].append({'id': video_cnt, 'file_name': seq})
+        height, width = video['size'].tolist()
+        num_images = len(video['images'])
+        for i, name in enumerate(video['images'].tolist()):
+            out['images'].append({
+                'file_name': '{}/img1/{}'.format(seq, name),
+                'id': image_cnt + i + 1,
+                'frame_id': i + 1,
+                'prev_image_id': image_cnt + i if i > 0 else -1,
+                'next_image_id': image_cnt + i + 2 if i < num_images - 1 else -1,
+                'video_id': video_cnt,
+                'height': height,
+                'width': width,
+            })
+        keep = (video['frame'] >= 1) & (video['frame'] <= num_images)
+        for frame_id, track_id, bbox in zip(video['frame'][keep].tolist(), video['track_id'][keep].tolist(),
+                                            video['bbox'][keep].tolist()):
+            ann_cnt += 1
+            out['annotations'].append({
+                'id': ann_cnt,
+                'category_id': 1,
+                'image_id': image_cnt + frame_id,
+                'track_id': track_id,
+                'bbox': bbox,
+                'area': bbox[2] * bbox[3],
+                'iscrowd': 0,
+                'conf': 1.0,
+            })
+        image_cnt += num_images
+    return out
+
+
+def list_tasks(data_root, mot_root, split):
+    split_dir = os.path.join(data_root, split)
+    tasks = []
+    for seq in sorted(os.listdir(split_dir)):
+        gt = os.path.join(split_dir, seq, 'gt', 'gt.txt')
+        if not os.path.isfile(gt):
+            continue
+        out_dir = os.path.join(mot_root, split, seq, 'gt')
+        tasks.append({
+            'split': split,
+            'video': seq,
+            'gt': gt,
+            'img_dir': os.path.join(split_dir, seq, 'img1'),
+            'out_txt': os.path.join(out_dir, 'gt.txt'),
+            'out_npz': os.path.join(out_dir, 'gt.npz'),
+        })
+    return tasks
+
+
+def main(args):
+    mot_root = args.mot_root or os.path.join(args.data_root, 'mot_gt')
+    ann_dir = os.path.join(args.data_root, 'annotations')
+    os.makedirs(ann_dir, exist_ok=True)
+
+    tasks = [t for split in args.splits for t in list_tasks(args.data_root, mot_root, split)]
+    results = []
+    with ProcessPoolExecutor(args.workers or None) as pool:
+        futures = [pool.submit(convert_video, t, args.force) for t in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures), desc='videos'):
+            results.append(future.result())
+
+    for split in args.splits:
+        videos = sorted((r for r in results if r['split'] == split), key=lambda r: r['video'])
+        out_path = os.path.join(ann_dir, '{}.json'.format(split))
+        skipped = all(v['skipped'] for v in videos)
+        if skipped and os.path.exists(out_path) and not args.force:
+            print('{}: {} videos up to date'.format(split, len(videos)))
+            continue
+        coco = build_coco(videos)
+        with open(out_path + '.tmp', 'w') as f:
+            json.dump(coco, f)
+        os.replace(out_path + '.tmp', out_path)
+        print('{}: {} videos ({} converted), {} images, {} annotations -> {}'.format(
+            split, len(videos), sum(not v['skipped'] for v in videos), len(coco['images']),
+            len(coco['annotations']), out_path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('VISEM-Tracking to MOT / COCO conversion')
+    parser.add_argument('--data_root', default='./visem')
+    parser.add_argument('--splits', default=['train', 'test'], nargs='+')
+    parser.add_argument('--mot_root', default='', help='root of the rewritten gt.txt files (default <data_root>/mot_gt)')
+    parser.add_argument('--workers', default=0, type=int, help='conversion processes (0 = all cores)')
+    parser.add_argument('--force', default=False, action='store_true', help='convert up-to-date videos too')
+    main(parser.parse_args())
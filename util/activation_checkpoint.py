@@ -0,0 +1,71 @@
+"""
+Activation checkpointing of whole submodules of the track model.
+
+``--checkpoint_enc_ffn`` / ``--checkpoint_dec_ffn`` only recompute the FFNs.
+``apply_activation_checkpointing`` wraps the forward of every submodule whose
+name matches one of the requested granularities in
+``torch.utils.checkpoint.checkpoint``: its activations are dropped after the
+forward pass and recomputed during backward. The presets are the encoder and
+decoder layers of the Deformable DETR transformer; any other submodule (e.g.
+the temporal attention or the re-ID head) is given as ``re:<regex>``, matched
+against the full module name, e.g. ``re:transformer\\.decoder\\.layers\\.[3-5]``.
+A granularity that matches no submodule is an error.
+
+Only the outermost match is wrapped, so ``enc_layer`` together with a regex
+for a module inside the encoder layers does not recompute it twice. The
+forward is recomputed only while training with grad enabled.
+"""
+import re
+
+import torch
+from torch.utils.checkpoint import checkpoint
+
+CHECKPOINT_PRESETS = {
+    'enc_layer': r'(.*\.)?encoder\.layers\.\d+',
+    'dec_layer': r'(.*\.)?decoder\.layers\.\d+',
+}
+
+
+def checkpoint_patterns(granularities):
+    patterns = []
+    for g in granularities:
+        if g.startswith('re:'):
+            patterns.append((g, re.compile(g[3:])))
+        elif g in CHECKPOINT_PRESETS:
+            patterns.append((g, re.compile(CHECKPOINT_PRESETS[g])))
+        else:
+            raise ValueError('unknown checkpoint granularity {!r}, expected one of {} or re:<regex>'.format(
+                g, sorted(CHECKPOINT_PRESETS)))
+    return patterns
+
+
+def checkpointed_forward(module):
+    forward = module.forward
+
+    def forward_checkpoint(*args, **kwargs):
+        if not (module.training and torch.is_grad_enabled()):
+            return forward(*args, **kwargs)
+        return checkpoint(forward, *args, use_reentrant=False, **kwargs)
+    module.forward = forward_checkpoint
+    return module
+
+
+def apply_activation_checkpointing(model, granularities):
+    """Checkpoint the submodules of ``model`` matching ``granularities``; returns ``{granularity: [names]}``."""
+    patterns = checkpoint_patterns(granularities)
+    wrapped = {g: [] for g, _ in patterns}
+    done = []
+    for name, module in model.named_modules():
+        if not name or any(name.startswith(d + '.') for d in done):
+            continue
+        for g, pattern in patterns:
+            if pattern.fullmatch(name):
+                checkpointed_forward(module)
+                wrapped[g].append(name)
+                done.append(name)
+                break
+    missing = [g for g, names in wrapped.items() if not names]
+    if missing:
+        raise ValueError('no submodule of the model matches {}; use re:<regex> with one of e.g. {}'.format(
+            missing, [n for n, _ in list(model.named_modules())[1:8]]))
+    return wrapped
@@ -0,0 +1,84 @@
+"""
+Background checkpoint writing for the training loops.
+
+The state is copied to CPU once on the training thread, then a single worker
+thread serializes it once, links it to every requested path and atomically
+renames it into place. Only one write is in flight at a time, so at most one
+extra CPU copy of the state is alive.
+"""
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import torch
+
+from util.misc import is_main_process
+
+
+def _to_cpu(obj):
+    if torch.is_tensor(obj):
+        obj = obj.detach()
+        return obj.cpu() if obj.device.type != 'cpu' else obj.clone()
+    if isinstance(obj, dict):
+        return type(obj)((k, _to_cpu(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class AsyncCheckpointWriter(object):
+    def __init__(self, keep_last=0, numbered=r'checkpoint(\d+)\.pth'):
+        self.keep_last = keep_last
+        self.numbered = re.compile(numbered)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    def save(self, state, paths):
+        """Write ``state`` to every path in ``paths`` without blocking the caller."""
+        if not is_main_process():
+            return
+        paths = list(dict.fromkeys(Path(p) for p in paths))
+        self.wait()
+        snapshot = _to_cpu(state)
+        self._pending = self._executor.submit(self._write, snapshot, paths)
+
+    def _write(self, snapshot, paths):
+        tmp_files = [p.with_name(p.name + '.tmp') for p in paths]
+        torch.save(snapshot, tmp_files[0])
+        for tmp in tmp_files[1:]:
+            if tmp.exists():
+                tmp.unlink()
+            _link_or_copy(tmp_files[0], tmp)
+        for tmp, path in zip(tmp_files, paths):
+            os.replace(tmp, path)
+        if self.keep_last > 0:
+            self._prune(paths[0].parent)
+
+    def _prune(self, directory):
+        numbered = []
+        for p in directory.iterdir():
+            m = self.numbered.fullmatch(p.name)
+            if m:
+                numbered.append((int(m.group(1)), p))
+        numbered.sort()
+        for _, p in numbered[:-self.keep_last]:
+            p.unlink()
+
+    def wait(self):
+        """Block until the last write has finished; re-raises its error."""
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
@@ -0,0 +1,266 @@
+"""
+COCO bbox AP / AR with NumPy, without pycocotools' per-box Python loops.
+
+Gives the 12 ``COCOeval.stats`` of a bbox evaluation (same IoU and recall
+thresholds, area ranges, max detections, crowd and area ignore rules,
+score-ordered greedy matching and interpolated precision). COCOeval matches
+one detection against one ground truth at a time for every image, category,
+area range and IoU threshold. Here images are processed in chunks, and every
+detection rank is matched for all images, IoU thresholds and area ranges at
+once.
+
+    gt = gt_from_coco(base_ds, img_ids)
+    dt = detections_from_results(res)       # {image_id: {'scores', 'labels', 'boxes' (x1y1x2y2)}}
+    stats = evaluate_bbox(gt, dt, img_ids)['stats']
+"""
+import numpy as np
+
+IOU_THRS = np.linspace(.5, 0.95, int(np.round((0.95 - .5) / .05)) + 1, endpoint=True)
+REC_THRS = np.linspace(.0, 1.00, int(np.round((1.00 - .0) / .01)) + 1, endpoint=True)
+MAX_DETS = (1, 10, 100)
+AREA_RNGS = np.asarray([[0 ** 2, 1e5 ** 2], [0 ** 2, 32 ** 2], [32 ** 2, 96 ** 2], [96 ** 2, 1e5 ** 2]])
+AREA_NAMES = ('all', 'small', 'medium', 'large')
+
+
+def gt_from_coco(coco, img_ids=None):
+    """Ground-truth boxes of ``img_ids`` (all images if None) as arrays, in COCOeval's order."""
+    img_ids = sorted(coco.getImgIds()) if img_ids is None else sorted(set(int(i) for i in img_ids))
+    anns = coco.loadAnns(coco.getAnnIds(imgIds=img_ids))
+    bbox = np.asarray([a['bbox'] for a in anns], dtype=np.float64).reshape(-1, 4)
+    return {
+        'image_id': np.asarray([a['image_id'] for a in anns], dtype=np.int64),
+        'category_id': np.asarray([a['category_id'] for a in anns], dtype=np.int64),
+        'bbox': bbox,
+        'area': np.asarray([a['area'] if 'area' in a else a['bbox'][2] * a['bbox'][3] for a in anns],
+                           dtype=np.float64),
+        'iscrowd': np.asarray([a.get('iscrowd', 0) for a in anns], dtype=bool),
+        'cat_ids': np.asarray(sorted(coco.getCatIds()), dtype=np.int64),
+    }
+
+
+def detections_from_results(res):
+    """Detection arrays of postprocessor outputs ``{image_id: {'scores', 'labels', 'boxes'}}``."""
+    image_ids, labels, scores, boxes = [], [], [], []
+    for image_id, out in res.items():
+        s = np.asarray(_numpy(out['scores']), dtype=np.float64).reshape(-1)
+        image_ids.append(np.full(len(s), image_id, dtype=np.int64))
+        scores.append(s)
+        labels.append(np.asarray(_numpy(out['labels']), dtype=np.int64).reshape(-1))
+        # x1y1x2y2 -> xywh in the boxes' own precision, like CocoEvaluator
+        b = np.asarray(_numpy(out['boxes'])).reshape(-1, 4)
+        boxes.append(np.concatenate([b[:, :2], b[:, 2:] - b[:, :2]], axis=1).astype(np.float64))
+    if not image_ids:
+        return {'image_id': np.zeros(0, np.int64), 'category_id': np.zeros(0, np.int64),
+                'bbox': np.zeros((0, 4)), 'score': np.zeros(0)}
+    boxes = np.concatenate(boxes)
+    return {'image_id': np.concatenate(image_ids), 'category_id': np.concatenate(labels),
+            'bbox': boxes, 'score': np.concatenate(scores)}
+
+
+def _numpy(x):
+    return x.detach().cpu().numpy() if hasattr(x, 'detach') else x
+
+
+def _bbox_iou(dt, gt, crowd):
+    """``[..., D, G]`` IoU of xywh boxes as in pycocotools' bbIou (a crowd box counts the detection area only)."""
+    dt = dt[..., :, None, :]
+    gt = gt[..., None, :, :]
+    w = np.minimum(dt[..., 0] + dt[..., 2], gt[..., 0] + gt[..., 2]) - np.maximum(dt[..., 0], gt[..., 0])
+    h = np.minimum(dt[..., 1] + dt[..., 3], gt[..., 1] + gt[..., 3]) - np.maximum(dt[..., 1], gt[..., 1])
+    inter = np.where((w > 0) & (h > 0), w * h, 0.0)
+    da = dt[..., 2] * dt[..., 3]
+    union = np.where(crowd[..., None, :], da, da + gt[..., 2] * gt[..., 3] - inter)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(inter > 0, inter / union, 0.0)
+
+
+def _last_argmax(values):
+    # COCOeval keeps the last of equally good ground truths
+    return values.shape[-1] - 1 - np.argmax(values[..., ::-1], axis=-1)
+
+
+def _pad(unit, rank, size, num_units, values, fill):
+    out = np.full((num_units, size) + values.shape[1:], fill, dtype=values.dtype)
+    out[unit, rank] = values
+    return out
+
+
+def _group(unit_keys, order):
+    """Rank of every (sorted) element inside its unit."""
+    keys = unit_keys[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(keys)) + 1] if len(keys) else np.zeros(0, np.int64)
+    first = np.repeat(starts, np.diff(np.r_[starts, len(keys)]))
+    return np.arange(len(keys)) - first
+
+
+def _match_chunk(dt_box, dt_area, dt_valid, gt_box, gt_area, gt_crowd, gt_valid):
+    """Greedy matching of one chunk of units; ``[c, T, A, D]`` matched and ignored flags."""
+    c, D = dt_valid.shape
+    G = gt_valid.shape[1]
+    T, A = len(IOU_THRS), len(AREA_RNGS)
+    lo, hi = AREA_RNGS[:, 0], AREA_RNGS[:, 1]
+    gt_ig = gt_crowd[:, None, :] | (gt_area[:, None, :] < lo[:, None]) | (gt_area[:, None, :] > hi[:, None])
+    dt_out = (dt_area[:, None, :] < lo[:, None]) | (dt_area[:, None, :] > hi[:, None])
+    dtm = np.zeros((c, T, A, D), dtype=bool)
+    dt_ig = np.zeros((c, T, A, D), dtype=bool)
+    if G:
+        iou = np.where(dt_valid[:, :, None] & gt_valid[:, None, :], _bbox_iou(dt_box, gt_box, gt_crowd), -1.0)
+        matched = np.zeros((c, T, A, G), dtype=bool)
+        ig = gt_ig[:, None, :, :]
+        free_crowd = gt_crowd[:, None, None, :]
+        for d in range(D):
+            iou_d = iou[:, d, None, None, :]
+            avail = (iou_d >= IOU_THRS[None, :, None, None]) & (~matched | free_crowd)
+            # a match with a regular ground truth beats any match with an ignored one
+            avail_reg = avail & ~ig
+            avail_ig = avail & ig
+            has_reg = avail_reg.any(-1)
+            has_ig = avail_ig.any(-1)
+            m = np.where(has_reg, _last_argmax(np.where(avail_reg, iou_d, -np.inf)),
+                         _last_argmax(np.where(avail_ig, iou_d, -np.inf)))
+            has = has_reg | has_ig
+            cc, tt, aa = np.nonzero(has)
+            matched[cc, tt, aa, m[cc, tt, aa]] = True
+            dtm[:, :, :, d] = has
+            dt_ig[:, :, :, d] = has & ~has_reg
+    dt_ig |= ~dtm & dt_out[:, None, :, :]
+    npig = (gt_valid[:, None, :] & ~gt_ig).sum(-1)
+    return dtm, dt_ig, npig
+
+
+def evaluate_bbox(gt, dt, img_ids=None, chunk_elems=1 << 22):
+    """COCOeval-equivalent bbox evaluation: ``{'precision': [T,R,K,A,M], 'recall': [T,K,A,M], 'stats': [12]}``.
+
+    ``img_ids`` are the evaluated images (CocoEvaluator uses the images that were predicted);
+    all images with ground truth or detections if None.
+    """
+    cat_ids = gt['cat_ids']
+    if img_ids is None:
+        img_ids = np.union1d(gt['image_id'], dt['image_id'])
+    img_ids = np.unique(np.asarray(img_ids, dtype=np.int64))
+    I, K = len(img_ids), len(cat_ids)
+    T, R, A, M = len(IOU_THRS), len(REC_THRS), len(AREA_RNGS), len(MAX_DETS)
+    max_det = MAX_DETS[-1]
+
+    def unit_keys(d):
+        keep = np.isin(d['image_id'], img_ids) & np.isin(d['category_id'], cat_ids)
+        keys = np.searchsorted(cat_ids, d['category_id']) * I + np.searchsorted(img_ids, d['image_id'])
+        return keep, keys
+
+    # detections: per (category, image) unit by descending score, at most max_det
+    keep, dkey = unit_keys(dt)
+    didx = np.flatnonzero(keep)
+    order = didx[np.lexsort((-dt['score'][didx], dkey[didx]))]
+    drank = _group(dkey, order)
+    order, drank = order[drank < max_det], drank[drank < max_det]
+    # ground truth: per unit in annotation order
+    keep, gkey = unit_keys(gt)
+    gidx = np.flatnonzero(keep)
+    gorder = gidx[np.argsort(gkey[gidx], kind='stable')]
+    grank = _group(gkey, gorder)
+
+    units = np.union1d(dkey[order], gkey[gorder])
+    U = len(units)
+    du = np.searchsorted(units, dkey[order])
+    gu = np.searchsorted(units, gkey[gorder])
+    D = int(drank.max()) + 1 if len(drank) else 0
+    G = int(grank.max()) + 1 if len(grank) else 0
+
+    dt_score = _pad(du, drank, D, U, dt['score'][order], -np.inf)
+    dt_valid = _pad(du, drank, D, U, np.ones(len(order), bool), False)
+    dtm = np.zeros((U, T, A, D), dtype=bool)
+    dt_ig = np.zeros((U, T, A, D), dtype=bool)
+    npig = np.zeros((U, A), dtype=np.int64)
+    step = max(1, chunk_elems // max(1, T * A * max(D, 1) * max(G, 1)))
+    for s in range(0, U, step):
+        # padded per-unit arrays of this chunk
+        dsel = (du >= s) & (du < s + step)
+        gsel = (gu >= s) & (gu < s + step)
+        c = min(step, U - s)
+        dt_box = _pad(du[dsel] - s, drank[dsel], D, c, dt['bbox'][order[dsel]], 0.0)
+        dt_area = dt_box[..., 2] * dt_box[..., 3]
+        gt_box = _pad(gu[gsel] - s, grank[gsel], G, c, gt['bbox'][gorder[gsel]], 0.0)
+        gt_area = _pad(gu[gsel] - s, grank[gsel], G, c, gt['area'][gorder[gsel]], 0.0)
+        gt_crowd = _pad(gu[gsel] - s, grank[gsel], G, c, gt['iscrowd'][gorder[gsel]], False)
+        gt_valid = _pad(gu[gsel] - s, grank[gsel], G, c, np.ones(int(gsel.sum()), bool), False)
+        dtm[s:s + c], dt_ig[s:s + c], npig[s:s + c] = _match_chunk(
+            dt_box, dt_area, dt_valid[s:s + c], gt_box, gt_area, gt_crowd, gt_valid)
+
+    precision = -np.ones((T, R, K, A, M))
+    recall = -np.ones((T, K, A, M))
+    unit_cat = units // I
+    tps_all = dtm & ~dt_ig
+    fps_all = ~dtm & ~dt_ig
+    for k in range(K):
+        us = np.flatnonzero(unit_cat == k)
+        if len(us) == 0:
+            continue
+        for mi, m in enumerate(MAX_DETS):
+            sel = dt_valid[us, :m]
+            scores = dt_score[us, :m][sel]
+            inds = np.argsort(-scores, kind='mergesort')
+            for a in range(A):
+                n_pos = int(npig[us, a].sum())
+                if n_pos == 0:
+                    continue
+                # [T, N] in score order
+                tps = np.moveaxis(tps_all[us, :, a, :m], 1, 0)[:, sel][:, inds]
+                fps = np.moveaxis(fps_all[us, :, a, :m], 1, 0)[:, sel][:, inds]
+                tp_sum = np.cumsum(tps, axis=1, dtype=np.float64)
+                fp_sum = np.cumsum(fps, axis=1, dtype=np.float64)
+                nd = tp_sum.shape[1]
+                rc = tp_sum / n_pos
+                pr = tp_sum / (fp_sum + tp_sum + np.spacing(1))
+                recall[:, k, a, mi] = rc[:, -1] if nd else 0
+                if nd == 0:
+                    precision[:, :, k, a, mi] = 0
+                    continue
+                # precision envelope, then sampled at the recall thresholds
+                pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+                for t in range(T):
+                    pos = np.searchsorted(rc[t], REC_THRS, side='left')
+                    q = np.zeros(R)
+                    ok = pos < nd
+                    q[ok] = pr[t, pos[ok]]
+                    precision[t, :, k, a, mi] = q
+    return {'precision': precision, 'recall': recall, 'stats': summarize(precision, recall)}
+
+
+def summarize(precision, recall):
+    """The 12 numbers of ``COCOeval.summarize()`` for bbox."""
+    def stat(ap, iou_thr=None, area='all', max_dets=100):
+        a = AREA_NAMES.index(area)
+        m = MAX_DETS.index(max_dets)
+        s = precision[..., a, m] if ap else recall[..., a, m]
+        if iou_thr is not None:
+            s = s[np.flatnonzero(IOU_THRS == iou_thr)]
+        s = s[s > -1]
+        return float(np.mean(s)) if s.size else -1.0
+
+    return np.asarray([
+        stat(1), stat(1, iou_thr=.5), stat(1, iou_thr=.75),
+        stat(1, area='small'), stat(1, area='medium'), stat(1, area='large'),
+        stat(0, max_dets=1), stat(0, max_dets=10), stat(0),
+        stat(0, area='small'), stat(0, area='medium'), stat(0, area='large'),
+    ])
+
+
+STAT_NAMES = (
+    'Average Precision  (AP) @[ IoU=0.50:0.95 | area=   all | maxDets=100 ]',
+    'Average Precision  (AP) @[ IoU=0.50      | area=   all | maxDets=100 ]',
+    'Average Precision  (AP) @[ IoU=0.75      | area=   all | maxDets=100 ]',
+    'Average Precision  (AP) @[ IoU=0.50:0.95 | area= small | maxDets=100 ]',
+    'Average Precision  (AP) @[ IoU=0.50:0.95 | area=medium | maxDets=100 ]',
+    'Average Precision  (AP) @[ IoU=0.50:0.95 | area= large | maxDets=100 ]',
+    'Average Recall     (AR) @[ IoU=0.50:0.95 | area=   all | maxDets=  1 ]',
+    'Average Recall     (AR) @[ IoU=0.50:0.95 | area=   all | maxDets= 10 ]',
+    'Average Recall     (AR) @[ IoU=0.50:0.95 | area=   all | maxDets=100 ]',
+    'Average Recall     (AR) @[ IoU=0.50:0.95 | area= small | maxDets=100 ]',
+    'Average Recall     (AR) @[ IoU=0.50:0.95 | area=medium | maxDets=100 ]',
+    'Average Recall     (AR) @[ IoU=0.50:0.95 | area= large | maxDets=100 ]',
+)
+
+
+def print_stats(stats):
+    for name, value in zip(STAT_NAMES, stats):
+        print(' {} = {:0.3f}'.format(name, value))
@@ -0,0 +1,256 @@
+"""
+CASA sperm kinematics from track outputs.
+
+Per track, from the box centres (scaled by ``um_per_px``) and frame numbers
+(at ``fps``):
+
+    VCL  curvilinear velocity: path length / duration                 [um/s]
+    VSL  straight-line velocity: first-to-last distance / duration     [um/s]
+    VAP  average path velocity: length of the average path / its duration [um/s]
+    LIN  VSL / VCL,  STR  VSL / VAP,  WOB  VAP / VCL
+    ALH  2 x the largest distance of a head position from the average path [um]
+    BCF  crossings of the average path per second                      [Hz]
+
+The average path is the centred moving average over ``window`` positions. It
+is only defined where the window is complete, i.e. without the first and last
+``window // 2`` positions of a track, so that the ends do not bend it. A
+crossing is a change of the side of the average path (relative to its
+direction of travel) on which the head lies; positions exactly on the path
+are skipped. Tracks with fewer than ``min_frames`` (at least ``window``)
+positions get NaN.
+
+``compute_kinematics`` works on a whole video at once (a ``TRACK_DTYPE``
+array from util/track_io.py) with array operations over all tracks.
+``StreamingKinematics`` gives the same numbers while the online tracker is
+running, updated frame by frame.
+
+    python -m util.kinematics exps/test/*.npy --fps 50 --um_per_px 0.5
+"""
+import argparse
+import os
+
+import numpy as np
+
+KINEMATICS_DTYPE = np.dtype([
+    ('track_id', np.int64),
+    ('num_frames', np.int32),
+    ('duration', np.float64),
+    ('VCL', np.float64),
+    ('VSL', np.float64),
+    ('VAP', np.float64),
+    ('LIN', np.float64),
+    ('STR', np.float64),
+    ('WOB', np.float64),
+    ('ALH', np.float64),
+    ('BCF', np.float64),
+])
+
+
+def _cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def _finish(track_ids, num_frames, duration, avg_duration, vcl_len, vsl_len, vap_len, dev_max, crossings,
+            min_frames):
+    out = np.empty(len(track_ids), dtype=KINEMATICS_DTYPE)
+    out['track_id'] = track_ids
+    out['num_frames'] = num_frames
+    out['duration'] = duration
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ok = (num_frames >= min_frames) & (duration > 0) & (avg_duration > 0)
+        t = np.where(ok, duration, np.nan)
+        t_avg = np.where(ok, avg_duration, np.nan)
+        out['VCL'] = vcl_len / t
+        out['VSL'] = vsl_len / t
+        out['VAP'] = vap_len / t_avg
+        out['LIN'] = out['VSL'] / out['VCL']
+        out['STR'] = out['VSL'] / out['VAP']
+        out['WOB'] = out['VAP'] / out['VCL']
+        out['ALH'] = np.where(ok, 2 * dev_max, np.nan)
+        out['BCF'] = crossings / t_avg
+    return out
+
+
+def compute_kinematics(tracks, fps, um_per_px=1.0, window=5, min_frames=None):
+    """Kinematics of every track in a ``TRACK_DTYPE`` array, one ``KINEMATICS_DTYPE`` row per track id."""
+    assert window % 2 == 1, 'window must be odd'
+    h = window // 2
+    min_frames = max(window, min_frames or 0)
+
+    order = np.lexsort((tracks['frame'], tracks['track_id']))
+    track_id = np.asarray(tracks['track_id'])[order]
+    frame = np.asarray(tracks['frame'], dtype=np.float64)[order]
+    p = np.stack([(tracks['x1'].astype(np.float64) + tracks['x2']) / 2,
+                  (tracks['y1'].astype(np.float64) + tracks['y2']) / 2], axis=1)[order] * um_per_px
+    N = len(p)
+    if N == 0:
+        return np.empty(0, dtype=KINEMATICS_DTYPE)
+
+    new_track = np.r_[True, track_id[1:] != track_id[:-1]]
+    starts = np.flatnonzero(new_track)
+    ends = np.r_[starts[1:], N]
+    seg = np.cumsum(new_track) - 1
+    S = len(starts)
+    pos = np.arange(N) - starts[seg]
+    # positions with a complete averaging window
+    full = (pos >= h) & (pos < (ends - starts)[seg] - h)
+
+    # centred moving average (only used where full)
+    csum = np.concatenate([np.zeros((1, 2)), np.cumsum(p, axis=0)])
+    lo = np.clip(np.arange(N) - h, 0, N)
+    hi = np.clip(np.arange(N) + h + 1, 0, N)
+    avg = (csum[hi] - csum[lo]) / window
+
+    same = ~new_track[1:]
+    step = np.linalg.norm(p[1:] - p[:-1], axis=1)
+    vcl_len = np.bincount(seg[1:][same], weights=step[same], minlength=S)
+    vsl_len = np.linalg.norm(p[ends - 1] - p[starts], axis=1)
+
+    both = full[1:] & full[:-1]
+    avg_dir = avg[1:] - avg[:-1]
+    vap_len = np.bincount(seg[1:][both], weights=np.linalg.norm(avg_dir, axis=1)[both], minlength=S)
+    dev = np.where(full, np.linalg.norm(p - avg, axis=1), 0)
+    dev_max = np.maximum.reduceat(dev, starts)
+
+    side = np.zeros(N)
+    side[1:] = np.where(both, np.sign(_cross(avg_dir, p[1:] - avg[1:])), 0)
+    # a position exactly on the average path keeps the previous side (forward fill within each track)
+    side = side[np.maximum.accumulate(np.where((side != 0) | new_track, np.arange(N), 0))]
+    crossed = (side[1:] * side[:-1] < 0) & (pos[1:] >= h + 2)
+    crossings = np.bincount(seg[1:][crossed], minlength=S)
+
+    duration = (frame[ends - 1] - frame[starts]) / fps
+    has_avg = ends - starts >= window
+    avg_first = np.minimum(starts + h, N - 1)
+    avg_last = np.maximum(ends - 1 - h, 0)
+    avg_duration = np.where(has_avg, (frame[avg_last] - frame[avg_first]) / fps, 0)
+    return _finish(track_id[starts], ends - starts, duration, avg_duration, vcl_len, vsl_len, vap_len, dev_max,
+                   crossings, min_frames)
+
+
+class StreamingKinematics(object):
+    """Kinematics updated frame by frame from the online Tracker's output.
+
+    Per track only the last ``window`` positions and a few running sums are
+    kept. An average path point is added ``window // 2`` frames late, once its
+    window is complete, so ``summary()`` at any time equals
+    ``compute_kinematics`` over everything seen so far.
+    """
+    def __init__(self, fps, um_per_px=1.0, window=5, min_frames=None, capacity=1024):
+        assert window % 2 == 1, 'window must be odd'
+        self.fps = fps
+        self.um_per_px = um_per_px
+        self.window = window
+        self.h = window // 2
+        self.min_frames = max(window, min_frames or 0)
+        self.slots = {}
+        self.state = self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        W = self.window
+        return {
+            'track_id': np.zeros(capacity, dtype=np.int64),
+            'n': np.zeros(capacity, dtype=np.int64),
+            'first_frame': np.zeros(capacity),
+            'last_frame': np.zeros(capacity),
+            'first_xy': np.zeros((capacity, 2)),
+            'last_xy': np.zeros((capacity, 2)),
+            'ring': np.zeros((capacity, W, 2)),
+            'ring_frame': np.zeros((capacity, W)),
+            'vcl_len': np.zeros(capacity),
+            'vap_len': np.zeros(capacity),
+            'avg_first_frame': np.zeros(capacity),
+            'avg_last_frame': np.zeros(capacity),
+            'prev_avg': np.zeros((capacity, 2)),
+            'dev_max': np.zeros(capacity),
+            'last_side': np.zeros(capacity),
+            'crossings': np.zeros(capacity, dtype=np.int64),
+        }
+
+    def _slots_of(self, track_ids):
+        slots = np.empty(len(track_ids), dtype=np.int64)
+        for i, tid in enumerate(track_ids):
+            slot = self.slots.get(tid)
+            if slot is None:
+                slot = self.slots[tid] = len(self.slots)
+                if slot >= len(self.state['n']):
+                    grown = self._allocate(2 * len(self.state['n']))
+                    for k, v in self.state.items():
+                        grown[k][:len(v)] = v
+                    self.state = grown
+                self.state['track_id'][slot] = tid
+            slots[i] = slot
+        return slots
+
+    def update(self, frame_id, tracks):
+        """Add one frame of Tracker output (inactive tracks are ignored)."""
+        tracks = [t for t in tracks if t['active'] > 0]
+        if not tracks:
+            return
+        slots = self._slots_of([t['tracking_id'] for t in tracks])
+        s = self.state
+        boxes = np.asarray([t['bbox'] for t in tracks], dtype=np.float64)
+        xy = (boxes[:, :2] + boxes[:, 2:]) / 2 * self.um_per_px
+
+        n = s['n'][slots]
+        first = n == 0
+        s['first_xy'][slots[first]] = xy[first]
+        s['first_frame'][slots[first]] = frame_id
+        s['vcl_len'][slots] += np.where(first, 0, np.linalg.norm(xy - s['last_xy'][slots], axis=1))
+        s['last_xy'][slots] = xy
+        s['last_frame'][slots] = frame_id
+        s['ring'][slots, n % self.window] = xy
+        s['ring_frame'][slots, n % self.window] = frame_id
+        n = n + 1
+        s['n'][slots] = n
+
+        # position j = n - 1 - h now has a complete window: the whole ring
+        j = n - 1 - self.h
+        ready = j >= self.h
+        if not ready.any():
+            return
+        slots, j = slots[ready], j[ready]
+        avg = s['ring'][slots].mean(1)
+        p_j = s['ring'][slots, j % self.window]
+        frame_j = s['ring_frame'][slots, j % self.window]
+
+        start = j == self.h
+        s['avg_first_frame'][slots[start]] = frame_j[start]
+        s['avg_last_frame'][slots] = frame_j
+        d = avg - s['prev_avg'][slots]
+        s['vap_len'][slots] += np.where(start, 0, np.linalg.norm(d, axis=1))
+        side = np.where(start, 0, np.sign(_cross(d, p_j - avg)))
+        s['crossings'][slots] += (j >= self.h + 2) & (side * s['last_side'][slots] < 0)
+        s['last_side'][slots] = np.where(side != 0, side, s['last_side'][slots])
+        s['dev_max'][slots] = np.maximum(s['dev_max'][slots], np.linalg.norm(p_j - avg, axis=1))
+        s['prev_avg'][slots] = avg
+
+    def summary(self):
+        """``KINEMATICS_DTYPE`` rows of every track seen so far."""
+        s = {k: v[:len(self.slots)] for k, v in self.state.items()}
+        duration = (s['last_frame'] - s['first_frame']) / self.fps
+        avg_duration = (s['avg_last_frame'] - s['avg_first_frame']) / self.fps
+        vsl_len = np.linalg.norm(s['last_xy'] - s['first_xy'], axis=1)
+        return _finish(s['track_id'], s['n'], duration, avg_duration, s['vcl_len'], vsl_len, s['vap_len'],
+                       s['dev_max'], s['crossings'], self.min_frames)
+
+
+def save_kinematics_csv(kinematics, path):
+    names = KINEMATICS_DTYPE.names
+    np.savetxt(path, np.column_stack([kinematics[k] for k in names]), delimiter=',', header=','.join(names),
+               comments='', fmt=['%d', '%d'] + ['%.4f'] * (len(names) - 2))
+
+
+if __name__ == '__main__':
+    from util.track_io import load_tracks
+
+    parser = argparse.ArgumentParser('CASA kinematics of columnar track files')
+    parser.add_argument('files', nargs='+', help='.npy files written by save_track_arrays')
+    parser.add_argument('--fps', required=True, type=float)
+    parser.add_argument('--um_per_px', default=1.0, type=float)
+    parser.add_argument('--window', default=5, type=int, help='average path smoothing, in frames (odd)')
+    args = parser.parse_args()
+    for path in args.files:
+        out = os.path.splitext(path)[0] + '_kinematics.csv'
+        save_kinematics_csv(compute_kinematics(load_tracks(path), args.fps, args.um_per_px, args.window), out)
+        print(out)
@@ -0,0 +1,51 @@
+"""
+Per-epoch training stats kept in memory and appended to log.txt.
+
+Every rank holds the same history (train stats are already reduced across
+processes), but only the writer rank touches the file, with one buffered
+write per epoch. Consumers such as the best-epoch logic and the learning
+curves read the in-memory series instead of re-parsing the log.
+"""
+import json
+from pathlib import Path
+
+
+class MetricsHistory(object):
+    def __init__(self, log_file=None, write=True):
+        self.log_file = Path(log_file) if log_file else None
+        self.write = write and self.log_file is not None
+        self.records = []
+
+    def load(self):
+        """Read the records of a previous run (e.g. when resuming) into memory."""
+        if self.log_file is None or not self.log_file.exists():
+            return
+        with self.log_file.open('r') as f:
+            self.records = [json.loads(line) for line in f if line.strip()]
+
+    def append(self, stats):
+        self.records.append(stats)
+        if self.write:
+            with self.log_file.open('a') as f:
+                f.write(json.dumps(stats) + "\n")
+
+    def __len__(self):
+        return len(self.records)
+
+    def series(self, key):
+        return [r[key] for r in self.records if key in r]
+
+    def keys(self):
+        keys = {}
+        for r in self.records:
+            keys.update(dict.fromkeys(r))
+        return list(keys)
+
+    def best(self, key, mode='min'):
+        """``(epoch, value)`` of the best record for ``key``, or None if it was never logged."""
+        records = [r for r in self.records if key in r]
+        if not records:
+            return None
+        pick = min if mode == 'min' else max
+        r = pick(records, key=lambda r: r[key])
+        return r.get('epoch'), r[key]
@@ -0,0 +1,230 @@
+"""
+MOTA / IDF1 / HOTA computed directly from in-memory tracking results.
+
+``res_tracks`` (image id -> Tracker output) and the ground-truth ``track_id``
+annotations are turned into per-frame id / box arrays per video. The metrics
+are then computed with one NumPy IoU matrix per frame, without writing and
+re-parsing MOT text files:
+
+* CLEAR MOT (MOTA, MOTP, ID switches) and IDF1 follow motmetrics: a match needs
+  IoU >= 0.5, and matches of the previous frame are kept while still valid.
+* HOTA, DetA, AssA and LocA follow TrackEval and are averaged over IoU
+  thresholds 0.05 ... 0.95.
+
+Videos are evaluated in parallel worker processes.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+HOTA_ALPHAS = np.arange(0.05, 0.99, 0.05)
+EPS = np.finfo('float').eps
+
+
+def iou_matrix(gt_boxes, hyp_boxes):
+    """IoU between all ``[N, 4]`` and ``[M, 4]`` x, y, w, h boxes."""
+    gt_boxes = gt_boxes[:, None, :]
+    hyp_boxes = hyp_boxes[None, :, :]
+    lt = np.maximum(gt_boxes[..., :2], hyp_boxes[..., :2])
+    rb = np.minimum(gt_boxes[..., :2] + gt_boxes[..., 2:], hyp_boxes[..., :2] + hyp_boxes[..., 2:])
+    inter = np.clip(rb - lt, 0, None).prod(-1)
+    union = gt_boxes[..., 2:].prod(-1) + hyp_boxes[..., 2:].prod(-1) - inter
+    return inter / np.maximum(union, EPS)
+
+
+def collect_sequences(res_tracks, coco, video_to_images, video_names):
+    """Per video: a list of ``(gt_ids, gt_boxes, hyp_ids, hyp_boxes)`` per frame, boxes as x, y, w, h.
+
+    Only active tracks count as hypotheses, as in ``save_track``.
+    """
+    sequences = {}
+    for video_id, images in video_to_images.items():
+        frames = []
+        for img in sorted(images, key=lambda x: x['frame_id']):
+            anns = coco.imgToAnns.get(img['image_id'], [])
+            gt_ids = np.asarray([a['track_id'] for a in anns], dtype=np.int64)
+            gt_boxes = np.asarray([a['bbox'] for a in anns], dtype=np.float64).reshape(-1, 4)
+            tracks = [t for t in res_tracks.get(img['image_id'], []) if t['active'] > 0]
+            hyp_ids = np.asarray([t['tracking_id'] for t in tracks], dtype=np.int64)
+            hyp_boxes = np.asarray([t['bbox'] for t in tracks], dtype=np.float64).reshape(-1, 4)
+            hyp_boxes[:, 2:] -= hyp_boxes[:, :2]
+            frames.append((gt_ids, gt_boxes, hyp_ids, hyp_boxes))
+        sequences[video_names[video_id]] = frames
+    return sequences
+
+
+def _clear_and_id(frames, num_gt_ids, num_hyp_ids, threshold=0.5):
+    """CLEAR MOT counts and IDF1 counts of one video (ids already contiguous)."""
+    last_match = np.full(num_gt_ids, -1, dtype=np.int64)
+    overlap = np.zeros((num_gt_ids, num_hyp_ids), dtype=np.int64)
+    num_gt = num_hyp = matches = switches = 0
+    dist_sum = 0.0
+    for gt_ids, hyp_ids, iou in frames:
+        num_gt += len(gt_ids)
+        num_hyp += len(hyp_ids)
+        if len(gt_ids) == 0 or len(hyp_ids) == 0:
+            continue
+        valid = iou >= threshold
+        gi, hi = np.nonzero(valid)
+        np.add.at(overlap, (gt_ids[gi], hyp_ids[hi]), 1)
+
+        # keep last frame's pairs that are still valid
+        kept = valid & (last_match[gt_ids][:, None] == hyp_ids[None, :])
+        rows, cols = np.nonzero(kept)
+        # two ground truths may have last matched the same hypothesis, the first one keeps it
+        _, first = np.unique(cols, return_index=True)
+        rows, cols = rows[first], cols[first]
+        free_g = np.ones(len(gt_ids), dtype=bool)
+        free_h = np.ones(len(hyp_ids), dtype=bool)
+        free_g[rows] = False
+        free_h[cols] = False
+
+        sub = np.where(valid, 1.0 - iou, np.inf)[np.ix_(free_g, free_h)]
+        if sub.size and np.isfinite(sub).any():
+            finite = np.isfinite(sub)
+            r, c = linear_sum_assignment(np.where(finite, sub, 1e6))
+            ok = finite[r, c]
+            new_rows = np.flatnonzero(free_g)[r[ok]]
+            new_cols = np.flatnonzero(free_h)[c[ok]]
+            prev = last_match[gt_ids[new_rows]]
+            switches += int(((prev >= 0) & (prev != hyp_ids[new_cols])).sum())
+            rows = np.concatenate([rows, new_rows])
+            cols = np.concatenate([cols, new_cols])
+
+        last_match[gt_ids[rows]] = hyp_ids[cols]
+        matches += len(rows)
+        dist_sum += float((1.0 - iou[rows, cols]).sum())
+
+    # IDF1: one-to-one gt/hyp trajectory matching that maximizes frames in common
+    gt_len = np.zeros(num_gt_ids, dtype=np.int64)
+    hyp_len = np.zeros(num_hyp_ids, dtype=np.int64)
+    for gt_ids, hyp_ids, _ in frames:
+        np.add.at(gt_len, gt_ids, 1)
+        np.add.at(hyp_len, hyp_ids, 1)
+    idtp = 0
+    if overlap.size:
+        r, c = linear_sum_assignment(-overlap)
+        idtp = int(overlap[r, c].sum())
+    return {
+        'num_gt': num_gt, 'num_hyp': num_hyp, 'matches': matches, 'switches': switches, 'dist_sum': dist_sum,
+        'idtp': idtp, 'idfn': int(gt_len.sum()) - idtp, 'idfp': int(hyp_len.sum()) - idtp,
+    }
+
+
+def _hota(frames, num_gt_ids, num_hyp_ids):
+    """HOTA counts per alpha of one video (TrackEval's algorithm)."""
+    potential = np.zeros((num_gt_ids, num_hyp_ids))
+    gt_count = np.zeros((num_gt_ids, 1))
+    hyp_count = np.zeros((1, num_hyp_ids))
+    num_gt = num_hyp = 0
+    for gt_ids, hyp_ids, iou in frames:
+        num_gt += len(gt_ids)
+        num_hyp += len(hyp_ids)
+        if len(gt_ids):
+            gt_count[gt_ids, 0] += 1
+        if len(hyp_ids):
+            hyp_count[0, hyp_ids] += 1
+        if len(gt_ids) and len(hyp_ids):
+            denom = iou.sum(0, keepdims=True) + iou.sum(1, keepdims=True) - iou
+            sim_iou = np.divide(iou, denom, out=np.zeros_like(iou), where=denom > EPS)
+            potential[np.ix_(gt_ids, hyp_ids)] += sim_iou
+    global_score = potential / (gt_count + hyp_count - potential)
+
+    A = len(HOTA_ALPHAS)
+    tp = np.zeros(A)
+    loc = np.zeros(A)
+    # matched (alpha, gt, hyp) triples as flat keys, counted at the end instead of a dense A x G x H array
+    keys = []
+    for gt_ids, hyp_ids, iou in frames:
+        if len(gt_ids) == 0 or len(hyp_ids) == 0:
+            continue
+        score = global_score[np.ix_(gt_ids, hyp_ids)] * iou
+        r, c = linear_sum_assignment(-score)
+        sim = iou[r, c]
+        matched = sim[None, :] >= HOTA_ALPHAS[:, None] - EPS
+        tp += matched.sum(1)
+        loc += (matched * sim[None, :]).sum(1)
+        a, m = np.nonzero(matched)
+        keys.append((a * num_gt_ids + gt_ids[r[m]]) * num_hyp_ids + hyp_ids[c[m]])
+
+    ass_sum = np.zeros(A)
+    if keys:
+        keys, matches_count = np.unique(np.concatenate(keys), return_counts=True)
+        a, rest = np.divmod(keys, num_gt_ids * num_hyp_ids)
+        g, h = np.divmod(rest, num_hyp_ids)
+        ass_a = matches_count / np.maximum(gt_count[g, 0] + hyp_count[0, h] - matches_count, 1)
+        ass_sum = np.bincount(a, weights=matches_count * ass_a, minlength=A)
+    return {'hota_tp': tp, 'hota_fn': num_gt - tp, 'hota_fp': num_hyp - tp, 'ass_sum': ass_sum, 'loc_sum': loc}
+
+
+def evaluate_sequence(frames):
+    """Raw counts of one video from its ``(gt_ids, gt_boxes, hyp_ids, hyp_boxes)`` frames."""
+    gt_uniq = np.unique(np.concatenate([f[0] for f in frames] + [np.zeros(0, np.int64)]))
+    hyp_uniq = np.unique(np.concatenate([f[2] for f in frames] + [np.zeros(0, np.int64)]))
+    compact = []
+    for gt_ids, gt_boxes, hyp_ids, hyp_boxes in frames:
+        compact.append((np.searchsorted(gt_uniq, gt_ids), np.searchsorted(hyp_uniq, hyp_ids),
+                        iou_matrix(gt_boxes, hyp_boxes)))
+    counts = _clear_and_id(compact, len(gt_uniq), len(hyp_uniq))
+    counts.update(_hota(compact, len(gt_uniq), len(hyp_uniq)))
+    counts['gt_tracks'] = len(gt_uniq)
+    counts['hyp_tracks'] = len(hyp_uniq)
+    return counts
+
+
+def _sum_counts(counts):
+    total = {}
+    for c in counts:
+        for k, v in c.items():
+            total[k] = total[k] + v if k in total else v
+    return total
+
+
+def summarize_counts(c):
+    num_gt = max(c['num_gt'], 1)
+    tp = c['hota_tp']
+    det_a = tp / np.maximum(tp + c['hota_fn'] + c['hota_fp'], 1)
+    ass_a = c['ass_sum'] / np.maximum(tp, 1)
+    loc_a = np.where(tp > 0, c['loc_sum'] / np.maximum(tp, EPS), 1.0)
+    fn = c['num_gt'] - c['matches']
+    fp = c['num_hyp'] - c['matches']
+    return {
+        'HOTA': float(np.sqrt(det_a * ass_a).mean()),
+        'DetA': float(det_a.mean()),
+        'AssA': float(ass_a.mean()),
+        'LocA': float(loc_a.mean()),
+        'MOTA': 1.0 - (fn + fp + c['switches']) / num_gt,
+        'MOTP': c['dist_sum'] / c['matches'] if c['matches'] else 0.0,
+        'IDF1': 2 * c['idtp'] / max(2 * c['idtp'] + c['idfp'] + c['idfn'], 1),
+        'IDP': c['idtp'] / max(c['idtp'] + c['idfp'], 1),
+        'IDR': c['idtp'] / max(c['idtp'] + c['idfn'], 1),
+        'IDSW': int(c['switches']),
+        'FP': int(fp),
+        'FN': int(fn),
+        'num_gt': int(c['num_gt']),
+        'num_hyp': int(c['num_hyp']),
+        'gt_tracks': int(c['gt_tracks']),
+        'hyp_tracks': int(c['hyp_tracks']),
+    }
+
+
+def evaluate_mot(sequences, num_workers=0):
+    """Per-video and overall metrics of ``collect_sequences`` output."""
+    names = list(sequences)
+    num_workers = min(num_workers or os.cpu_count() or 1, len(names))
+    if num_workers > 1:
+        with ProcessPoolExecutor(num_workers) as pool:
+            counts = list(pool.map(evaluate_sequence, [sequences[n] for n in names]))
+    else:
+        counts = [evaluate_sequence(sequences[n]) for n in names]
+    summary = {'videos': {n: summarize_counts(c) for n, c in zip(names, counts)}}
+    summary['overall'] = summarize_counts(_sum_counts(counts)) if counts else {}
+    return summary
+
+
+def write_summary(summary, path):
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=2)
@@ -0,0 +1,103 @@
+"""
+Learning curves drawn off the training thread.
+
+The plotter keeps one in-memory series per loss key and only appends the
+points of the new epoch. A worker thread redraws the figures every
+``interval`` epochs by updating the existing line data, so the cost per epoch
+does not grow with the length of the run. It does nothing on non-master ranks.
+"""
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+
+def _is_scaled_loss(key):
+    return key.startswith('train_loss') and not key.endswith('_unscaled')
+
+
+def _is_unscaled_loss(key):
+    return key.startswith('train_loss') and key.endswith('_unscaled')
+
+
+class LearningCurvePlotter(object):
+    FIGURES = {
+        'learning_curve.png': _is_scaled_loss,
+        'learning_curve_unscaled.png': _is_unscaled_loss,
+    }
+
+    def __init__(self, output_dir, interval=1, enabled=True):
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.interval = interval
+        self.enabled = enabled and self.output_dir is not None and interval > 0
+        self.series = defaultdict(lambda: ([], []))
+        self.num_updates = 0
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stop = False
+        self._figures = {}
+        self._thread = None
+        if self.enabled:
+            self._thread = threading.Thread(target=self._run, name='learning-curve-plotter', daemon=True)
+            self._thread.start()
+
+    def update(self, stats):
+        """Add one epoch of log stats; schedules a redraw every ``interval`` updates."""
+        if not self.enabled:
+            return
+        epoch = stats.get('epoch', self.num_updates)
+        with self._lock:
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and (_is_scaled_loss(key) or _is_unscaled_loss(key)):
+                    xs, ys = self.series[key]
+                    xs.append(epoch)
+                    ys.append(value)
+            self.num_updates += 1
+        if self.num_updates % self.interval == 0:
+            self._dirty.set()
+
+    def _run(self):
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+            stop = self._stop
+            self._render()
+            if stop:
+                return
+
+    def _render(self):
+        with self._lock:
+            snapshot = {k: (list(xs), list(ys)) for k, (xs, ys) in self.series.items()}
+        for filename, select in self.FIGURES.items():
+            series = {k: v for k, v in snapshot.items() if select(k)}
+            if series:
+                self._draw(filename, series)
+
+    def _draw(self, filename, series):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        if filename not in self._figures:
+            fig = Figure(figsize=(8, 5))
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot(1, 1, 1)
+            ax.set_xlabel('epoch')
+            ax.set_ylabel('loss')
+            self._figures[filename] = (fig, ax, {})
+        fig, ax, lines = self._figures[filename]
+        for key, (xs, ys) in series.items():
+            if key not in lines:
+                lines[key], = ax.plot([], [], label=key[len('train_'):])
+                ax.legend(loc='upper right', fontsize='small')
+            lines[key].set_data(xs, ys)
+        ax.relim()
+        ax.autoscale_view()
+        fig.savefig(self.output_dir / filename)
+
+    def close(self):
+        """Draw the final state and stop the worker."""
+        if self._thread is None:
+            return
+        self._stop = True
+        self._dirty.set()
+        self._thread.join()
+        self._thread = None
@@ -0,0 +1,78 @@
+"""
+bfloat16 autocast for the track model and the frozen RT-DETR detector.
+
+``--fp16`` only enables CUDA autocast and the GradScaler, so it does nothing
+on CPU. ``--bf16`` works on CPU and on GPUs with bf16 support: ``enable_bf16``
+patches the forward of the given module instances (the classes are untouched):
+
+* the track model and the detector's ``nn.Module`` run under
+  ``torch.autocast(device_type, dtype=torch.bfloat16)``, with ``device_type``
+  the type of the device they run on (``'cpu'``, ``'cuda'``). Their floating-point
+  outputs are cast back to float32, so postprocessing, losses and everything
+  downstream see fp32 tensors;
+* the Hungarian matcher of the criterion and the Tracker's ``init_track`` /
+  ``step`` always run with autocast disabled, on float32 inputs.
+
+Parameters stay float32 (autocast casts per op), so checkpoints, the
+optimizer and the GradScaler-free bf16 training step are unchanged.
+"""
+import torch
+
+
+def cast_floats(obj, dtype=torch.float32):
+    """``obj`` with every floating-point tensor (in dicts, lists, tuples, NestedTensors) cast to ``dtype``."""
+    if torch.is_tensor(obj):
+        return obj.to(dtype) if obj.is_floating_point() and obj.dtype != dtype else obj
+    if hasattr(obj, 'tensors') and hasattr(obj, 'mask'):
+        # NestedTensor
+        return type(obj)(cast_floats(obj.tensors, dtype), obj.mask)
+    if isinstance(obj, dict):
+        return type(obj)((k, cast_floats(v, dtype)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cast_floats(v, dtype) for v in obj)
+    return obj
+
+
+def autocast_forward(module, dtype=torch.bfloat16, device_type='cpu'):
+    """Run ``module.forward`` under autocast and return float32 outputs."""
+    forward = module.forward
+
+    def forward_autocast(*args, **kwargs):
+        with torch.autocast(device_type, dtype=dtype):
+            out = forward(*args, **kwargs)
+        return cast_floats(out)
+    module.forward = forward_autocast
+    return module
+
+
+def fp32_method(obj, method, device_type='cpu'):
+    """Run ``obj.<method>`` with autocast disabled and float32 arguments."""
+    fn = getattr(obj, method)
+
+    def fp32(*args, **kwargs):
+        with torch.autocast(device_type, enabled=False):
+            return fn(*cast_floats(args), **cast_floats(kwargs))
+    setattr(obj, method, fp32)
+    return obj
+
+
+def keep_fp32_tracker(tracker, device_type='cpu'):
+    for method in ('init_track', 'step'):
+        if hasattr(tracker, method):
+            fp32_method(tracker, method, device_type)
+    return tracker
+
+
+def enable_bf16(model, detector=None, criterion=None, device_type='cpu'):
+    """bf16 autocast for ``model`` and ``detector``; the criterion's matcher stays fp32.
+
+    Call before wrapping ``model`` in DistributedDataParallel.
+    """
+    autocast_forward(model, torch.bfloat16, device_type)
+    det_module = getattr(detector, 'model', detector)
+    if isinstance(det_module, torch.nn.Module):
+        autocast_forward(det_module, torch.bfloat16, device_type)
+    matcher = getattr(criterion, 'matcher', None)
+    if matcher is not None:
+        fp32_method(matcher, 'forward', device_type)
+    return model
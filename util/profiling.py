@@ -0,0 +1,225 @@
+"""
+Opt-in per-stage timing for train_one_epoch and evaluate.
+
+A StageProfiler collects named spans: wall time and peak memory per call.
+Spans come from three places:
+
+* ``span(name)`` context managers in the code,
+* forward hooks on modules (``instrument_module``), e.g. the frozen detector,
+  the track model, the criterion and the postprocessor,
+* ``wrap_loader`` (time spent waiting for data, one profiler step per batch),
+  ``instrument_optimizer`` (the optimizer / GradScaler step) and
+  ``instrument_backward`` (every ``Tensor.backward`` call).
+
+Spans nest, e.g. the detector runs inside the track model's forward. Each
+stage reports its inclusive time (``total_s``, ``mean_ms``, percentiles) and
+its exclusive time without the spans nested in it (``self_s``,
+``self_mean_ms``); ``share`` is the exclusive time over the epoch, so the
+shares of all stages add up to at most 1.
+
+Hooks and wrappers are only installed when profiling is enabled, so a normal
+run pays nothing. ``end_epoch`` appends a JSON summary per epoch to
+``profile.txt`` next to ``log.txt``. Optionally a ``torch.profiler`` trace is
+captured for a window of iterations.
+"""
+import json
+import resource
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import torch
+
+
+class StageProfiler(object):
+    def __init__(self, output_dir='', enabled=False, device='cpu', trace_iters=None, write=True):
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.enabled = enabled
+        self.cuda = torch.device(device).type == 'cuda' and torch.cuda.is_available()
+        self.trace_iters = trace_iters
+        self.write = write and self.output_dir is not None
+        self.iteration = 0
+        self._trace = None
+        self._open = []
+        self._reset()
+
+    def _reset(self):
+        self.times = defaultdict(list)
+        self.self_times = defaultdict(list)
+        self.peak_mem = defaultdict(float)
+        self._epoch_start = time.perf_counter()
+
+    def _sync(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+
+    def _memory_mb(self):
+        if self.cuda:
+            return torch.cuda.max_memory_allocated() / (1024 * 1024)
+        # process-wide peak RSS on CPU, it can only grow
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def begin(self, name):
+        if not self.enabled:
+            return
+        self._sync()
+        if self.cuda:
+            # keep the peak seen so far by enclosing spans before resetting the counter
+            mem = self._memory_mb()
+            for entry in self._open:
+                entry[2] = max(entry[2], mem)
+            torch.cuda.reset_peak_memory_stats()
+        # name, start, peak memory, time spent in nested spans
+        self._open.append([name, time.perf_counter(), 0.0, 0.0])
+
+    def end(self, name):
+        if not self.enabled:
+            return
+        self._sync()
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i][0] == name:
+                _, start, peak, nested = self._open.pop(i)
+                break
+        else:
+            return
+        elapsed = time.perf_counter() - start
+        self.times[name].append(elapsed)
+        self.self_times[name].append(elapsed - nested)
+        # charge this span to the innermost span that encloses it
+        for entry in reversed(self._open):
+            if entry[1] <= start:
+                entry[3] += elapsed
+                break
+        mem = self._memory_mb()
+        for entry in self._open:
+            entry[2] = max(entry[2], mem)
+        self.peak_mem[name] = max(self.peak_mem[name], peak, mem)
+
+    @contextmanager
+    def span(self, name):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def instrument_module(self, module, name):
+        if not self.enabled or module is None:
+            return
+        module.register_forward_pre_hook(lambda *_: self.begin(name))
+        module.register_forward_hook(lambda *_: self.end(name))
+
+    def instrument_optimizer(self, optimizer, name='optimizer_step'):
+        if not self.enabled or not hasattr(optimizer, 'register_step_pre_hook'):
+            return
+        optimizer.register_step_pre_hook(lambda *_: self.begin(name))
+        optimizer.register_step_post_hook(lambda *_: self.end(name))
+
+    def instrument_backward(self, name='backward'):
+        """Time ``Tensor.backward`` (e.g. ``losses.backward()``, ``scaler.scale(losses).backward()``).
+
+        Autograd has no hook around a whole backward pass, so this replaces
+        ``torch.Tensor.backward`` for the process while profiling is enabled.
+        """
+        if not self.enabled:
+            return
+        backward = torch.Tensor.backward
+
+        def timed_backward(tensor, *args, **kwargs):
+            with self.span(name):
+                return backward(tensor, *args, **kwargs)
+        torch.Tensor.backward = timed_backward
+
+    def instrument_method(self, obj, method, name):
+        """Time an instance method (e.g. ``Tracker.step``) without touching its class."""
+        if not self.enabled:
+            return
+        fn = getattr(obj, method)
+
+        def timed(*args, **kwargs):
+            with self.span(name):
+                return fn(*args, **kwargs)
+        setattr(obj, method, timed)
+
+    def wrap_loader(self, loader, name='data'):
+        if not self.enabled:
+            return loader
+        return _ProfiledLoader(loader, self, name)
+
+    def step(self):
+        """Called once per iteration; starts and stops the torch.profiler trace window."""
+        self.iteration += 1
+        if self.trace_iters is None or not self.enabled:
+            return
+        start, stop = self.trace_iters
+        if self.iteration == start and self._trace is None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._trace = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+            self._trace.__enter__()
+        elif self.iteration == stop and self._trace is not None:
+            self._trace.__exit__(None, None, None)
+            if self.write:
+                self._trace.export_chrome_trace(str(self.output_dir / 'trace_iter{}-{}.json'.format(start, stop)))
+            self._trace = None
+
+    def summary(self):
+        total = time.perf_counter() - self._epoch_start
+        stages = {}
+        for name, times in self.times.items():
+            times = np.asarray(times)
+            self_times = np.asarray(self.self_times[name])
+            stages[name] = {
+                'calls': int(times.size),
+                'total_s': float(times.sum()),
+                'mean_ms': float(times.mean() * 1e3),
+                'p50_ms': float(np.percentile(times, 50) * 1e3),
+                'p99_ms': float(np.percentile(times, 99) * 1e3),
+                'self_s': float(self_times.sum()),
+                'self_mean_ms': float(self_times.mean() * 1e3),
+                'share': float(self_times.sum() / total) if total > 0 else 0.0,
+                'peak_mem_mb': float(self.peak_mem[name]),
+            }
+        return {'total_s': total, 'stages': stages}
+
+    def end_epoch(self, epoch, phase='train'):
+        """Append this epoch's summary to profile.txt and start a new one."""
+        if not self.enabled:
+            return None
+        summary = dict(epoch=epoch, phase=phase, **self.summary())
+        if self.write:
+            with (self.output_dir / 'profile.txt').open('a') as f:
+                f.write(json.dumps(summary) + "\n")
+        self._reset()
+        return summary
+
+
+class _ProfiledLoader(object):
+    def __init__(self, loader, profiler, name):
+        self.loader = loader
+        self.profiler = profiler
+        self.name = name
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, attr):
+        if attr == 'loader':
+            raise AttributeError(attr)
+        return getattr(self.loader, attr)
+
+    def __iter__(self):
+        it = iter(self.loader)
+        while True:
+            self.profiler.step()
+            self.profiler.begin(self.name)
+            try:
+                batch = next(it)
+            except StopIteration:
+                self.profiler.end(self.name)
+                return
+            self.profiler.end(self.name)
+            yield batch
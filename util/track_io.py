@@ -0,0 +1,113 @@
+"""
+Columnar per-video track files, next to or instead of save_track's MOT text.
+
+``save_track_arrays`` writes one ``<out_root>/<split>/<video>.npy`` per video:
+a structured array with one record per active track box. It has the same
+rows and renamed track ids as ``save_track`` and also keeps the score.
+Records are in the text file's order (by track, then frame). Boxes are
+stored as float32 x1, y1, x2, y2, as the Tracker produces them. The text
+converter reproduces ``save_track``'s lines exactly.
+
+    tracks = load_tracks('exps/test/12.npy')        # memory-mapped, no parsing
+    tracks[tracks['track_id'] == 3]['frame']
+
+    python -m util.track_io exps/test/*.npy         # writes exps/test/<video>.txt
+"""
+import argparse
+import os
+
+import numpy as np
+
+TRACK_DTYPE = np.dtype([
+    ('frame', np.int32),
+    ('track_id', np.int32),
+    ('x1', np.float32),
+    ('y1', np.float32),
+    ('x2', np.float32),
+    ('y2', np.float32),
+    ('score', np.float32),
+])
+
+MOT_FMT = '%d,%d,%.2f,%.2f,%.2f,%.2f,-1,-1,-1,-1'
+
+
+def tracks_to_array(results, images):
+    """Active track boxes of one video as a ``TRACK_DTYPE`` array, ids renamed as in ``save_track``."""
+    frame_ids, track_ids, boxes, scores, active = [], [], [], [], []
+    for image_info in images:
+        result = results.get(image_info["image_id"])
+        if result is None:
+            continue
+        for item in result:
+            frame_ids.append(image_info["frame_id"])
+            track_ids.append(item["tracking_id"])
+            boxes.append(item["bbox"])
+            scores.append(item["score"])
+            active.append(item["active"])
+
+    track_ids = np.asarray(track_ids, dtype=np.int64)
+    # save_track numbers every track (active or not) 1, 2, ... in id order
+    uniq, renamed = np.unique(track_ids, return_inverse=True)
+    keep = np.asarray(active) > 0
+    # by track, then in the order the frames were listed
+    order = np.argsort(renamed[keep], kind='stable')
+
+    out = np.empty(int(keep.sum()), dtype=TRACK_DTYPE)
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)[keep][order]
+    out['frame'] = np.asarray(frame_ids, dtype=np.int32)[keep][order]
+    out['track_id'] = (renamed[keep] + 1)[order]
+    out['x1'], out['y1'], out['x2'], out['y2'] = boxes.T
+    out['score'] = np.asarray(scores, dtype=np.float32)[keep][order]
+    return out
+
+
+def save_track_arrays(results, out_root, video_to_images, video_names, data_split='val'):
+    """Columnar counterpart of ``save_track``; returns the written paths."""
+    out_dir = os.path.join(out_root, data_split)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for video_id, images in video_to_images.items():
+        path = os.path.join(out_dir, "{}.npy".format(video_names[video_id]))
+        np.save(path, tracks_to_array(results, images))
+        paths.append(path)
+    return paths
+
+
+def load_tracks(path, mmap=True):
+    """A video's ``TRACK_DTYPE`` records, memory-mapped unless ``mmap`` is False."""
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+
+def to_mot_rows(tracks):
+    """``[N, 6]`` frame, id, x, y, w, h rows as written by ``save_track``."""
+    rows = np.empty((len(tracks), 6), dtype=np.float64)
+    rows[:, 0] = tracks['frame']
+    rows[:, 1] = tracks['track_id']
+    rows[:, 2] = tracks['x1']
+    rows[:, 3] = tracks['y1']
+    # widths in float64 from the float32 corners, like the text writer
+    rows[:, 4] = tracks['x2'].astype(np.float64) - tracks['x1']
+    rows[:, 5] = tracks['y2'].astype(np.float64) - tracks['y1']
+    return rows
+
+
+def convert_to_mot(npy_path, txt_path=None):
+    txt_path = txt_path or os.path.splitext(npy_path)[0] + '.txt'
+    tracks = load_tracks(npy_path)
+    with open(txt_path, 'w') as f:
+        if len(tracks):
+            np.savetxt(f, to_mot_rows(tracks), fmt=MOT_FMT)
+    return txt_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Convert columnar track files to MOT text')
+    parser.add_argument('files', nargs='+', help='.npy files written by save_track_arrays')
+    parser.add_argument('--out_dir', default='', help='write the .txt files here instead of next to the inputs')
+    args = parser.parse_args()
+    for path in args.files:
+        txt_path = None
+        if args.out_dir:
+            os.makedirs(args.out_dir, exist_ok=True)
+            txt_path = os.path.join(args.out_dir, os.path.splitext(os.path.basename(path))[0] + '.txt')
+        print(convert_to_mot(path, txt_path))